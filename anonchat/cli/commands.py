@@ -62,8 +62,8 @@ def handle_command(line, discovery, chat, logs=None, show_menu=None):
             print("No peers discovered.")
         else:
             print("\nPeers:")
-            for peer_id, (ip, _, _, _) in peers.items():
-                print(f"  {peer_id:<15} {ip}")
+            for peer_id, peer in peers.items():
+                print(f"  {peer_id:<15} {peer.ip}")
             print()
         return True
 
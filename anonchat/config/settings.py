@@ -17,6 +17,28 @@ class Settings:
         broadcast_ip: str = "255.255.255.255",
         ui_host: str = "0.0.0.0",
         ui_port: int = 5000,
+        db_durability: str = "batch",
+        db_batch_size: int = 64,
+        db_batch_ms: float = 5.0,
+        db_readers: int = 4,
+        search_mode: str = "backfill",
+        retention_days: float = 0.0,
+        retention_rows: int = 0,
+        retention_rooms: str = "",
+        archive: bool = False,
+        upload_max_mb: int = 4096,
+        cache_room_kb: int = 1024,
+        cache_total_mb: int = 32,
+        wire_format: str = "binary",
+        discovery_mode: str = "adaptive",
+        multicast_group: str | None = None,
+        multicast_ttl: int = 1,
+        multicast_loop: bool = True,
+        socket_rcvbuf_kb: int = 2048,
+        socket_sndbuf_kb: int = 0,
+        rx_workers: int = 4,
+        rx_drop_policy: str = "newest",
+        reliable: bool = True,
     ):
         self.nickname = nickname
         self.interface_ip = interface_ip
@@ -24,6 +46,28 @@ class Settings:
         self.broadcast_ip = broadcast_ip
         self.ui_host = ui_host
         self.ui_port = ui_port
+        self.db_durability = db_durability
+        self.db_batch_size = db_batch_size
+        self.db_batch_ms = db_batch_ms
+        self.db_readers = db_readers
+        self.search_mode = search_mode
+        self.retention_days = retention_days
+        self.retention_rows = retention_rows
+        self.retention_rooms = retention_rooms
+        self.archive = archive
+        self.upload_max_mb = upload_max_mb
+        self.cache_room_kb = cache_room_kb
+        self.cache_total_mb = cache_total_mb
+        self.wire_format = wire_format
+        self.discovery_mode = discovery_mode
+        self.multicast_group = multicast_group
+        self.multicast_ttl = multicast_ttl
+        self.multicast_loop = multicast_loop
+        self.socket_rcvbuf_kb = socket_rcvbuf_kb
+        self.socket_sndbuf_kb = socket_sndbuf_kb
+        self.rx_workers = rx_workers
+        self.rx_drop_policy = rx_drop_policy
+        self.reliable = reliable
 
     @classmethod
     def from_env(cls):
@@ -33,6 +77,28 @@ class Settings:
         broadcast_ip = os.getenv("ANONCHAT_BROADCAST_IP", "255.255.255.255")
         ui_host = os.getenv("ANONCHAT_UI_HOST", "0.0.0.0")
         ui_port = int(os.getenv("ANONCHAT_UI_PORT", "5000"))
+        db_durability = os.getenv("ANONCHAT_DB_DURABILITY", "batch")
+        db_batch_size = int(os.getenv("ANONCHAT_DB_BATCH_SIZE", "64"))
+        db_batch_ms = float(os.getenv("ANONCHAT_DB_BATCH_MS", "5"))
+        db_readers = int(os.getenv("ANONCHAT_DB_READERS", "4"))
+        search_mode = os.getenv("ANONCHAT_SEARCH", "backfill")
+        retention_days = float(os.getenv("ANONCHAT_RETENTION_DAYS", "0"))
+        retention_rows = int(os.getenv("ANONCHAT_RETENTION_ROWS", "0"))
+        retention_rooms = os.getenv("ANONCHAT_RETENTION_ROOMS", "")
+        archive = os.getenv("ANONCHAT_ARCHIVE", "0") == "1"
+        upload_max_mb = int(os.getenv("ANONCHAT_UPLOAD_MAX_MB", "4096"))
+        cache_room_kb = int(os.getenv("ANONCHAT_CACHE_ROOM_KB", "1024"))
+        cache_total_mb = int(os.getenv("ANONCHAT_CACHE_TOTAL_MB", "32"))
+        wire_format = os.getenv("ANONCHAT_WIRE_FORMAT", "binary")
+        discovery_mode = os.getenv("ANONCHAT_DISCOVERY_MODE", "adaptive")
+        multicast_group = os.getenv("ANONCHAT_MULTICAST_GROUP") or None
+        multicast_ttl = int(os.getenv("ANONCHAT_MULTICAST_TTL", "1"))
+        multicast_loop = os.getenv("ANONCHAT_MULTICAST_LOOP", "1") != "0"
+        socket_rcvbuf_kb = int(os.getenv("ANONCHAT_SOCKET_RCVBUF_KB", "2048"))
+        socket_sndbuf_kb = int(os.getenv("ANONCHAT_SOCKET_SNDBUF_KB", "0"))
+        rx_workers = int(os.getenv("ANONCHAT_RX_WORKERS", "4"))
+        rx_drop_policy = os.getenv("ANONCHAT_RX_DROP_POLICY", "newest")
+        reliable = os.getenv("ANONCHAT_RELIABLE", "1") != "0"
 
         return cls(
             nickname=nickname,
@@ -41,4 +107,26 @@ class Settings:
             broadcast_ip=broadcast_ip,
             ui_host=ui_host,
             ui_port=ui_port,
+            db_durability=db_durability,
+            db_batch_size=db_batch_size,
+            db_batch_ms=db_batch_ms,
+            db_readers=db_readers,
+            search_mode=search_mode,
+            retention_days=retention_days,
+            retention_rows=retention_rows,
+            retention_rooms=retention_rooms,
+            archive=archive,
+            upload_max_mb=upload_max_mb,
+            cache_room_kb=cache_room_kb,
+            cache_total_mb=cache_total_mb,
+            wire_format=wire_format,
+            discovery_mode=discovery_mode,
+            multicast_group=multicast_group,
+            multicast_ttl=multicast_ttl,
+            multicast_loop=multicast_loop,
+            socket_rcvbuf_kb=socket_rcvbuf_kb,
+            socket_sndbuf_kb=socket_sndbuf_kb,
+            rx_workers=rx_workers,
+            rx_drop_policy=rx_drop_policy,
+            reliable=reliable,
         )
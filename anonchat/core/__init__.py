@@ -2,6 +2,7 @@ __all__ = [
     "crypto",
     "discovery",
     "identity",
+    "locks",
     "network",
     "room_chat",
     "transport",
@@ -1,13 +1,20 @@
 # core/crypto.py
 
-import os
 import base64
+import hashlib
+import itertools
+import os
+import threading
 
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 
+NONCE_LEN = 12
+NONCE_PREFIX_LEN = 4
+REPLAY_WINDOW = 1024
+
 
 def _b64e(b: bytes) -> str:
     return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
@@ -18,6 +25,60 @@ def _b64d(s: str) -> bytes:
     return base64.urlsafe_b64decode((s + pad).encode())
 
 
+def encode_blob(nonce: bytes, ciphertext: bytes) -> str:
+    """
+    Text-format ciphertext: base64(nonce).base64(ciphertext).
+    """
+    return f"{_b64e(nonce)}.{_b64e(ciphertext)}"
+
+
+def _nonce_prefix(public_key: bytes) -> bytes:
+    """
+    Per-sender nonce prefix. Both directions of a peer pair share one key,
+    so each side stamps its counter nonces with a prefix derived from its
+    own public key to keep the two nonce spaces apart.
+    """
+    return hashlib.sha256(b"anonchat-nonce" + public_key).digest()[:NONCE_PREFIX_LEN]
+
+
+class ReplayError(ValueError):
+    """
+    Raised when a counter nonce was already seen or fell out of the window.
+    """
+
+
+class ReplayWindow:
+    """
+    Sliding bitmap of accepted counters (RFC 6479 style).
+
+    `check` is a cheap pre-filter run before any AEAD work; `accept`
+    records the counter once the datagram authenticated.
+    """
+
+    __slots__ = ("top", "bitmap", "size")
+
+    def __init__(self, size: int = REPLAY_WINDOW):
+        self.top = 0
+        self.bitmap = 0
+        self.size = size
+
+    def check(self, counter: int) -> bool:
+        if counter > self.top:
+            return True
+        offset = self.top - counter
+        if offset >= self.size:
+            return False
+        return not (self.bitmap >> offset) & 1
+
+    def accept(self, counter: int):
+        if counter > self.top:
+            shift = counter - self.top
+            self.bitmap = ((self.bitmap << shift) | 1) & ((1 << self.size) - 1)
+            self.top = counter
+        else:
+            self.bitmap |= 1 << (self.top - counter)
+
+
 class CryptoBox:
     """
     Single-responsibility crypto container.
@@ -25,17 +86,44 @@ class CryptoBox:
     - Ephemeral per session
     - One shared key per peer
     - Authenticated encryption
+    - Cached AEAD context and counter nonces per peer
+    - Replay window per peer on receive
     """
 
     def __init__(self):
         # Generate ephemeral keypair
         self._priv = x25519.X25519PrivateKey.generate()
-        self.public_key_b64 = _b64e(
-            self._priv.public_key().public_bytes_raw()
-        )
+        public_bytes = self._priv.public_key().public_bytes_raw()
+        self.public_key_b64 = _b64e(public_bytes)
+        self._public_bytes = public_bytes
+        self._nonce_prefix = _nonce_prefix(public_bytes)
 
         # peer_id -> shared_key
         self._shared_keys = {}
+        # peer_id -> ChaCha20Poly1305 (built once per peer)
+        self._aeads = {}
+        # peer_id -> itertools.count for outgoing nonces
+        self._send_counters = {}
+        # peer_id -> peer's nonce prefix / ReplayWindow for incoming nonces
+        self._peer_prefixes = {}
+        self._peer_pubs = {}
+        self._replay = {}
+        self._replay_lock = threading.Lock()
+        self._register_lock = threading.Lock()
+
+        # room_id -> {epoch: room key}; the newest epoch is used to send,
+        # the previous one is kept for datagrams still in flight.
+        self._group_keys = {}
+        # (room_id, epoch, sender public key) -> ChaCha20Poly1305 keyed with
+        # that sender's subkey (see _group_aead).
+        self._group_sender_aeads = {}
+        self._group_epochs = {}
+        # (room_id, epoch) -> itertools.count for outgoing nonces. Never
+        # dropped: leaving and rejoining at the same epoch must not reuse
+        # a nonce under the same key.
+        self._group_counters = {}
+        # (room_id, epoch, sender_id) -> ReplayWindow
+        self._group_replay = {}
 
     # ---- handshake ----
 
@@ -46,9 +134,15 @@ class CryptoBox:
         if peer_id in self._shared_keys:
             return
 
-        peer_pub = x25519.X25519PublicKey.from_public_bytes(
-            _b64d(peer_pub_b64)
-        )
+        # Receive workers and UI threads may register the same peer at
+        # once; a second registration would restart its nonce counter.
+        with self._register_lock:
+            if peer_id not in self._shared_keys:
+                self._register_peer(peer_id, peer_pub_b64)
+
+    def _register_peer(self, peer_id: str, peer_pub_b64: str):
+        peer_pub_bytes = _b64d(peer_pub_b64)
+        peer_pub = x25519.X25519PublicKey.from_public_bytes(peer_pub_bytes)
 
         shared = self._priv.exchange(peer_pub)
 
@@ -59,37 +153,182 @@ class CryptoBox:
             info=b"anonchat",
         ).derive(shared)
 
+        self._aeads[peer_id] = ChaCha20Poly1305(key)
+        self._send_counters[peer_id] = itertools.count(1)
+        self._peer_prefixes[peer_id] = _nonce_prefix(peer_pub_bytes)
+        self._peer_pubs[peer_id] = peer_pub_bytes
+        self._replay[peer_id] = ReplayWindow()
         self._shared_keys[peer_id] = key
 
     # ---- messaging ----
 
+    def _next_nonce(self, peer_id: str) -> bytes:
+        # next() on itertools.count is atomic under the GIL.
+        counter = next(self._send_counters[peer_id])
+        return self._nonce_prefix + counter.to_bytes(NONCE_LEN - NONCE_PREFIX_LEN, "big")
+
     def encrypt(self, peer_id: str, plaintext: str) -> str:
         """
         Encrypt message for peer.
         Returns nonce.ciphertext (base64)
         """
-        key = self._shared_keys.get(peer_id)
-        if not key:
-            raise ValueError("Unknown peer key")
+        nonce, ct = self.encrypt_raw(peer_id, plaintext)
+        return encode_blob(nonce, ct)
 
-        nonce = os.urandom(12)
-        aead = ChaCha20Poly1305(key)
-        ct = aead.encrypt(nonce, plaintext.encode(), None)
+    def encrypt_raw(self, peer_id: str, plaintext: str):
+        """
+        Encrypt message for peer. Returns (nonce, ciphertext) as bytes.
+        """
+        aead = self._aeads.get(peer_id)
+        if not aead:
+            raise ValueError("Unknown peer key")
 
-        return f"{_b64e(nonce)}.{_b64e(ct)}"
+        nonce = self._next_nonce(peer_id)
+        return nonce, aead.encrypt(nonce, plaintext.encode(), None)
 
     def decrypt(self, peer_id: str, blob: str) -> str:
         """
         Decrypt message from peer.
         """
-        key = self._shared_keys.get(peer_id)
-        if not key:
+        nonce_b64, ct_b64 = blob.split(".", 1)
+        return self.decrypt_raw(peer_id, _b64d(nonce_b64), _b64d(ct_b64))
+
+    def decrypt_raw(self, peer_id: str, nonce, ciphertext) -> str:
+        """
+        Decrypt raw nonce/ciphertext (bytes or memoryview) from peer.
+        """
+        aead = self._aeads.get(peer_id)
+        if not aead:
             raise ValueError("Unknown peer key")
 
+        # Counter nonces carry the sender's prefix; older peers still send
+        # random nonces, which skip the replay window.
+        counter = None
+        if nonce[:NONCE_PREFIX_LEN] == self._peer_prefixes[peer_id]:
+            counter = int.from_bytes(nonce[NONCE_PREFIX_LEN:], "big")
+            window = self._replay[peer_id]
+            if not window.check(counter):
+                raise ReplayError("Replayed or stale nonce")
+
+        pt = aead.decrypt(nonce, ciphertext, None)
+
+        if counter is not None:
+            with self._replay_lock:
+                if not window.check(counter):
+                    raise ReplayError("Replayed or stale nonce")
+                window.accept(counter)
+        return pt.decode()
+
+    # ---- room group keys ----
+
+    @staticmethod
+    def new_group_key() -> bytes:
+        return os.urandom(32)
+
+    def set_group_key(self, room_id: str, key: bytes, epoch: int):
+        """
+        Install a symmetric room key. Members share it, so it authenticates
+        "someone in the room", not which member sent a message; callers check
+        the claimed sender against the member list.
+        """
+        if epoch <= self._group_epochs.get(room_id, 0):
+            return
+        keys = dict(self._group_keys.get(room_id, {}))
+        keys[epoch] = key
+        for old in sorted(keys)[:-2]:
+            del keys[old]
+        with self._replay_lock:
+            for entry in [k for k in self._group_replay if k[0] == room_id and k[1] not in keys]:
+                del self._group_replay[entry]
+        for entry in [k for k in list(self._group_sender_aeads) if k[0] == room_id and k[1] not in keys]:
+            self._group_sender_aeads.pop(entry, None)
+        self._group_keys[room_id] = keys
+        self._group_counters.setdefault((room_id, epoch), itertools.count(1))
+        self._group_epochs[room_id] = epoch
+
+    def drop_group_key(self, room_id: str):
+        self._group_keys.pop(room_id, None)
+        self._group_epochs.pop(room_id, None)
+        for entry in [k for k in list(self._group_sender_aeads) if k[0] == room_id]:
+            self._group_sender_aeads.pop(entry, None)
+        with self._replay_lock:
+            for entry in [k for k in self._group_replay if k[0] == room_id]:
+                del self._group_replay[entry]
+
+    def has_group_key(self, room_id: str) -> bool:
+        return room_id in self._group_epochs
+
+    def _group_aead(self, room_id: str, epoch: int, sender_pub: bytes):
+        """
+        AEAD for one sender's traffic in a room epoch. Members share the
+        room key but each seals under its own subkey, HKDF(room key,
+        sender public key): the 4-byte nonce prefixes may collide
+        between members, the subkeys do not.
+        """
+        entry = (room_id, epoch, sender_pub)
+        aead = self._group_sender_aeads.get(entry)
+        if aead is None:
+            key = self._group_keys.get(room_id, {}).get(epoch)
+            if key is None:
+                return None
+            subkey = HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=b"anonchat-group" + sender_pub,
+            ).derive(key)
+            aead = self._group_sender_aeads[entry] = ChaCha20Poly1305(subkey)
+        return aead
+
+    def _group_aad(self, room_id: str, epoch: int, sender_id: str) -> bytes:
+        return f"{room_id}\n{epoch}\n{sender_id}".encode()
+
+    def encrypt_group(self, sender_id: str, room_id: str, plaintext: str):
+        """
+        Seal a room message once for every member.
+        Returns (epoch, nonce.ciphertext base64).
+        """
+        epoch, nonce, ct = self.encrypt_group_raw(sender_id, room_id, plaintext)
+        return epoch, encode_blob(nonce, ct)
+
+    def encrypt_group_raw(self, sender_id: str, room_id: str, plaintext: str):
+        """
+        Returns (epoch, nonce, ciphertext) with raw bytes.
+        """
+        epoch = self._group_epochs.get(room_id)
+        if not epoch:
+            raise ValueError("Unknown room key")
+        counter = next(self._group_counters[(room_id, epoch)])
+        nonce = self._nonce_prefix + counter.to_bytes(NONCE_LEN - NONCE_PREFIX_LEN, "big")
+        aead = self._group_aead(room_id, epoch, self._public_bytes)
+        ct = aead.encrypt(nonce, plaintext.encode(), self._group_aad(room_id, epoch, sender_id))
+        return epoch, nonce, ct
+
+    def decrypt_group(self, sender_id: str, room_id: str, epoch: int, blob: str) -> str:
         nonce_b64, ct_b64 = blob.split(".", 1)
-        nonce = _b64d(nonce_b64)
-        ct = _b64d(ct_b64)
+        return self.decrypt_group_raw(sender_id, room_id, epoch, _b64d(nonce_b64), _b64d(ct_b64))
+
+    def decrypt_group_raw(self, sender_id: str, room_id: str, epoch: int, nonce, ciphertext) -> str:
+        prefix = self._peer_prefixes.get(sender_id)
+        if not prefix:
+            raise ValueError("Unknown room key")
+        aead = self._group_aead(room_id, epoch, self._peer_pubs[sender_id])
+        if not aead:
+            raise ValueError("Unknown room key")
+
+        if nonce[:NONCE_PREFIX_LEN] != prefix:
+            raise ValueError("Nonce does not belong to sender")
+        counter = int.from_bytes(nonce[NONCE_PREFIX_LEN:], "big")
+        replay_key = (room_id, epoch, sender_id)
+        window = self._group_replay.get(replay_key)
+        if window and not window.check(counter):
+            raise ReplayError("Replayed or stale nonce")
+
+        pt = aead.decrypt(nonce, ciphertext, self._group_aad(room_id, epoch, sender_id))
 
-        aead = ChaCha20Poly1305(key)
-        pt = aead.decrypt(nonce, ct, None)
+        with self._replay_lock:
+            window = self._group_replay.setdefault(replay_key, ReplayWindow())
+            if not window.check(counter):
+                raise ReplayError("Replayed or stale nonce")
+            window.accept(counter)
         return pt.decode()
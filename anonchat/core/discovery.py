@@ -1,139 +1,556 @@
 # core/discovery.py
 
+import asyncio
 import base64
+import heapq
 import os
-import threading
+import random
 import time
+from collections import Counter, deque
+from types import MappingProxyType
+
+from anonchat.core import wire
 
 DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
 
 
+class Peer:
+    """
+    One discovered peer. ip, pub_key, nick and caps never change on a
+    record (a change publishes a new record); last_seen is refreshed in
+    place by beacons.
+    """
+
+    __slots__ = ("peer_id", "ip", "pub_key", "nick", "caps", "last_seen", "beacon_at", "interval")
+
+    def __init__(
+        self,
+        peer_id,
+        ip,
+        pub_key,
+        nick=None,
+        caps=frozenset(),
+        last_seen=0.0,
+        beacon_at=0.0,
+        interval=0.0,
+    ):
+        self.peer_id = peer_id
+        self.ip = ip
+        self.pub_key = pub_key
+        self.nick = nick
+        self.caps = caps
+        self.last_seen = last_seen
+        # Time of the last GM and the gap before it (beacon rate).
+        self.beacon_at = beacon_at
+        self.interval = interval
+
+
+class PeerSnapshot:
+    """
+    Immutable view of the peer table. Discovery swaps in a new snapshot
+    (with a higher version) whenever a peer appears, changes or expires.
+    """
+
+    __slots__ = ("version", "peers")
+
+    def __init__(self, version: int, peers):
+        self.version = version
+        self.peers = MappingProxyType(peers)
+
+
 class Discovery:
     """
     Simple Zeroconf-style peer discovery.
 
     Protocol:
-      GM <peer_id> <pub_key>
-      GM_ACK <peer_id> <pub_key>
+      GM <peer_id> <pub_key>[|<nickname_b64>]
+      GM_ACK <peer_id> <pub_key>[|<nickname_b64>]
       NICK <peer_id> <nickname_b64>
+      CAPS <peer_id> <capability,...>
+
+    Modes:
+      classic  - GM + NICK every GM_INTERVAL, GM_ACK for every GM heard
+      adaptive - one GM beacon carrying the nickname, GM_ACK only for new,
+                 changed or long-silent peers, and a beacon interval that
+                 doubles (with jitter) up to GM_INTERVAL_MAX while the peer
+                 set is stable. Peer timeouts follow each peer's observed
+                 beacon rate, so backed-off peers are not expired.
 
     Keeps an in-memory table:
-      peer_id -> (ip, last_seen, pub_key)
+      peer_id -> Peer(ip, pub_key, nick, caps, last_seen)
+
+    ENC/GRP arrive either as text lines or as binary packets (core/wire.py);
+    binary is only sent to peers that advertised the "wire1" capability.
+
+    Runs as tasks on the network loop (beacon, listen, expiry). The peer
+    table is published as a copy-on-write PeerSnapshot: the loop builds a
+    new one on change and swaps it in with one assignment, so readers on
+    any thread use it without locks or copies.
+
+    Expiry: each peer has one entry in a min-heap of deadlines. Packets
+    only refresh last_seen; the expiry task wakes at the earliest deadline
+    and either drops the peer or re-queues it at last_seen + PEER_TIMEOUT.
+
+    When the transport has joined a multicast group, beacons (and room
+    broadcasts sent via broadcast_ip) go to that group instead of the
+    subnet broadcast address, so only subscribed hosts receive them.
     """
 
+    WIRE_FORMATS = ("binary", "text")
+    MODES = ("adaptive", "classic")
+
     GM_INTERVAL = 3        # seconds
-    PEER_TIMEOUT = 10      # seconds
+    GM_INTERVAL_MAX = 24   # seconds, adaptive backoff ceiling
+    BEACON_JITTER = 0.2    # +/- fraction of the interval
+    PEER_TIMEOUT = 10      # seconds (floor in adaptive mode)
+    PEER_TIMEOUT_MAX = 90  # seconds
+    MISSED_BEACONS = 3.5   # beacon gaps before an adaptive peer expires
+    RATE_WINDOW = 60       # seconds of history for packets/sec
 
-    def __init__(self, transport, identity, broadcast_ip: str, port: int):
+    def __init__(
+        self,
+        transport,
+        identity,
+        broadcast_ip: str,
+        port: int,
+        wire_format: str = "binary",
+        mode: str = "adaptive",
+    ):
+        if wire_format not in self.WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format: {wire_format}")
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown discovery mode: {mode}")
         self.transport = transport
         self.identity = identity
-        self.broadcast_ip = broadcast_ip
+        self.multicast_group = getattr(transport, "multicast_group", None)
+        self.broadcast_ip = self.multicast_group or broadcast_ip
         self.port = port
+        self.wire_format = wire_format
+        # Advertised in CAPS; other layers add theirs via add_capability().
+        self.capabilities = {wire.CAPABILITY} if wire_format == "binary" else set()
+        self.mode = mode
 
-        # peer_id -> (ip, last_seen, pub_key)
-        self.peers = {}
+        self.snapshot = PeerSnapshot(0, {})
+        # (deadline, peer_id), one entry per peer in the snapshot
+        self._expiry = []
+        self._expiry_wakeup = None
+        self._beacon_interval = self.GM_INTERVAL
+        self._beacon_wakeup = None
+        self._tx = Counter()
+        self._rx = Counter()
+        self._rate_samples = deque()
         self.running = False
+        self._tasks = []
         self.enc_handler = None
+        self.group_handler = None
+        self.peer_handler = None
+        self.expiry_handler = None
 
     def start(self):
+        """
+        Start beacon and listen tasks. Must be called on the network loop.
+        """
         self.running = True
-        threading.Thread(target=self._broadcast_loop, daemon=True).start()
-        threading.Thread(target=self._listen_loop, daemon=True).start()
+        loop = asyncio.get_running_loop()
+        self._expiry_wakeup = asyncio.Event()
+        self._beacon_wakeup = asyncio.Event()
+        self._sample_rates(time.monotonic())
+        self._tasks = [
+            loop.create_task(self._broadcast_loop()),
+            loop.create_task(self._listen_loop()),
+            loop.create_task(self._expiry_loop()),
+        ]
 
-    def stop(self):
+    async def stop(self):
         self.running = False
+        for task in self._tasks:
+            task.cancel()
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for task, result in zip(self._tasks, results):
+            if isinstance(result, Exception) and DEBUG:
+                print(f"[discovery] task {task.get_coro().__name__} had failed: {result!r}")
+        self._tasks = []
 
     def get_peers(self):
-        self._cleanup()
-        return dict(self.peers)
+        """
+        Read-only peer_id -> Peer mapping of the current snapshot.
+        """
+        return self.snapshot.peers
+
+    def get_peer(self, peer_id: str):
+        return self.snapshot.peers.get(peer_id)
+
+    def binary_wire(self, peer_id: str) -> bool:
+        """
+        True when packets to this peer should use the binary framing.
+        """
+        if self.wire_format != "binary":
+            return False
+        peer = self.snapshot.peers.get(peer_id)
+        return peer is not None and wire.CAPABILITY in peer.caps
+
+    def add_capability(self, capability: str):
+        self.capabilities.add(capability)
+        self.announce()
+
+    def has_capability(self, peer_id: str, capability: str) -> bool:
+        peer = self.snapshot.peers.get(peer_id)
+        return peer is not None and capability in peer.caps
+
+    def _caps_message(self) -> str:
+        return f"CAPS {self.identity.anon_id} {','.join(sorted(self.capabilities))}"
 
     def set_enc_handler(self, handler):
         self.enc_handler = handler
 
+    def set_group_handler(self, handler):
+        self.group_handler = handler
+
+    def set_peer_handler(self, handler):
+        """
+        handler() is called whenever a peer appears, changes or expires.
+        """
+        self.peer_handler = handler
+
+    def set_expiry_handler(self, handler):
+        """
+        handler(peer_ids) is called with the peers that just timed out.
+        """
+        self.expiry_handler = handler
+
+    def announce(self):
+        """
+        Beacon again soon (e.g. after a nickname change). Thread-safe.
+        """
+        loop = self.transport.loop
+        if loop and self.running:
+            loop.call_soon_threadsafe(self._reset_beacon, True)
+
+    def stats(self):
+        # Called from UI threads: only read the samples, the beacon loop
+        # owns appending and trimming them. The deque never shrinks below
+        # one entry once started, so indexing it here is safe.
+        now = time.monotonic()
+        tx, rx = dict(self._tx), dict(self._rx)
+        tx_total = sum(tx.values())
+        rx_total = sum(rx.values())
+        t0, tx0, rx0 = self._rate_samples[0] if self._rate_samples else (now, tx_total, rx_total)
+        elapsed = max(now - t0, 1e-6)
+        return {
+            "mode": self.mode,
+            "group": self.broadcast_ip,
+            "peers": len(self.snapshot.peers),
+            "beacon_interval": self._beacon_interval if self.mode == "adaptive" else self.GM_INTERVAL,
+            "tx": tx,
+            "rx": rx,
+            "tx_pps": (tx_total - tx0) / elapsed,
+            "rx_pps": (rx_total - rx0) / elapsed,
+        }
+
+    def _peers_changed(self):
+        if self.peer_handler:
+            self.peer_handler()
+
     # ---------------- internal ----------------
 
-    def _broadcast_loop(self):
+    async def _broadcast_loop(self):
         while self.running:
-            msg = f"GM {self.identity.anon_id} {self.identity.crypto.public_key_b64}"
             try:
-                self.transport.send(msg, self.broadcast_ip, self.port)
-                nickname = self.identity.nickname or ""
-                if nickname:
-                    nick_b64 = base64.urlsafe_b64encode(nickname.encode("utf-8")).decode("ascii")
-                    nick_msg = f"NICK {self.identity.anon_id} {nick_b64}"
-                    self.transport.send(nick_msg, self.broadcast_ip, self.port)
+                self._send_beacon()
+                self._sample_rates(time.monotonic())
             except OSError:
                 if not self.running:
                     break
-            time.sleep(self.GM_INTERVAL)
+            except Exception as exc:
+                if DEBUG:
+                    print(f"[discovery] beacon failed: {exc!r}")
+            self._beacon_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._beacon_wakeup.wait(), self._next_beacon_delay())
+            except asyncio.TimeoutError:
+                pass
+
+    def _send_beacon(self):
+        anon_id = self.identity.anon_id
+        if self.mode == "classic":
+            self._send(f"GM {anon_id} {self.identity.crypto.public_key_b64}", self.broadcast_ip)
+            nick_b64 = self._nick_b64()
+            if nick_b64:
+                self._send(f"NICK {anon_id} {nick_b64}", self.broadcast_ip)
+            if self.capabilities:
+                self._send(self._caps_message(), self.broadcast_ip)
+            return
+
+        self._send(f"GM {anon_id} {self._beacon_payload()}", self.broadcast_ip)
+        # Capabilities ride along while beaconing fast; ACKs carry them to
+        # peers that join later.
+        if self.capabilities and self._beacon_interval == self.GM_INTERVAL:
+            self._send(self._caps_message(), self.broadcast_ip)
+
+    def _next_beacon_delay(self) -> float:
+        if self.mode == "classic":
+            return self.GM_INTERVAL
+        interval = self._beacon_interval
+        self._beacon_interval = min(self.GM_INTERVAL_MAX, interval * 2)
+        return interval * random.uniform(1 - self.BEACON_JITTER, 1 + self.BEACON_JITTER)
+
+    def _reset_beacon(self, wake: bool = False):
+        self._beacon_interval = self.GM_INTERVAL
+        if wake and self._beacon_wakeup:
+            self._beacon_wakeup.set()
+
+    def _send_ack(self, ip: str):
+        anon_id = self.identity.anon_id
+        if self.mode == "classic":
+            self._send(f"GM_ACK {anon_id} {self.identity.crypto.public_key_b64}", ip)
+            return
+        self._send(f"GM_ACK {anon_id} {self._beacon_payload()}", ip)
+        if self.capabilities:
+            self._send(self._caps_message(), ip)
+
+    def _beacon_payload(self) -> str:
+        nick_b64 = self._nick_b64()
+        pub_key = self.identity.crypto.public_key_b64
+        return f"{pub_key}|{nick_b64}" if nick_b64 else pub_key
+
+    def _nick_b64(self) -> str:
+        nickname = self.identity.nickname or ""
+        if not nickname:
+            return ""
+        return base64.urlsafe_b64encode(nickname.encode("utf-8")).decode("ascii")
 
-    def _listen_loop(self):
+    def _send(self, msg: str, ip: str):
+        self._tx[msg.split(" ", 1)[0]] += 1
+        self.transport.send(msg, ip, self.port)
+
+    def _sample_rates(self, now: float):
+        samples = self._rate_samples
+        tx_total = sum(dict(self._tx).values())
+        rx_total = sum(dict(self._rx).values())
+        if not samples or now - samples[-1][0] >= 1.0:
+            samples.append((now, tx_total, rx_total))
+        while len(samples) > 1 and now - samples[1][0] >= self.RATE_WINDOW:
+            samples.popleft()
+
+    async def _listen_loop(self):
         while self.running:
+            data, ip, _ = await self.transport.recv_packet()
             try:
-                msg, ip, _ = self.transport.recv()
-            except OSError:
-                if not self.running:
-                    break
-                continue
+                self._handle_datagram(data, ip)
+            except Exception as exc:
+                # A bad packet or a failing handler must not stop discovery.
+                if DEBUG:
+                    print(f"[discovery] error handling packet from {ip}: {exc!r}")
+
+    def _handle_datagram(self, data: bytes, ip: str):
+        if wire.is_binary(data):
+            self._handle_binary(data, ip)
+            return
+
+        msg = data.decode("utf-8", errors="ignore")
+        if DEBUG:
+            print(f"[discovery] recv {ip}: {msg}")
+
+        parts = msg.strip().split(maxsplit=2)
+
+        # Expect exactly: TYPE peer_id pub_key
+        if len(parts) != 3:
             if DEBUG:
-                print(f"[discovery] recv {ip}: {msg}")
+                print(f"[discovery] drop malformed: {msg!r}")
+            return
 
-            parts = msg.strip().split(maxsplit=2)
+        msg_type, peer_id, payload = parts
 
-            # Expect exactly: TYPE peer_id pub_key
-            if len(parts) != 3:
-                if DEBUG:
-                    print(f"[discovery] drop malformed: {msg!r}")
-                continue
+        if msg_type == "ENC":
+            if self.enc_handler:
+                self.enc_handler(peer_id, payload, ip)
+            elif DEBUG:
+                print("[discovery] ENC handler not set; dropped")
+            return
 
-            msg_type, peer_id, payload = parts
+        if msg_type == "GRP":
+            if self.group_handler:
+                self.group_handler(peer_id, payload, ip)
+            elif DEBUG:
+                print("[discovery] GRP handler not set; dropped")
+            return
 
-            if msg_type == "ENC":
-                if self.enc_handler:
-                    self.enc_handler(peer_id, payload, ip)
-                elif DEBUG:
-                    print("[discovery] ENC handler not set; dropped")
-                self._cleanup()
-                continue
+        # Ignore our own messages
+        if peer_id == self.identity.anon_id:
+            return
 
-            # Ignore our own messages
-            if peer_id == self.identity.anon_id:
-                continue
+        self._rx[msg_type] += 1
+        now = time.time()
 
-            now = time.time()
+        if msg_type in ("GM", "GM_ACK"):
+            pub_key, nick = self._parse_payload(payload)
+            previous = self.snapshot.peers.get(peer_id)
+            silent = now - previous.last_seen if previous else 0.0
+            changed = self._upsert(peer_id, ip, pub_key, nick, now)
 
-            if msg_type in ("GM", "GM_ACK"):
-                pub_key, nick = self._parse_payload(payload)
-                if peer_id in self.peers:
-                    _, _, _, existing_nick = self.peers[peer_id]
+            if msg_type == "GM":
+                self._observe_beacon(peer_id, now)
+                if self._should_ack(previous, changed, silent):
+                    self._send_ack(ip)
+        elif msg_type == "NICK":
+            peer = self.snapshot.peers.get(peer_id)
+            if peer is not None:
+                nick = self._parse_nick(payload)
+                if nick == peer.nick:
+                    peer.last_seen = now
                 else:
-                    existing_nick = None
-                self.peers[peer_id] = (ip, now, pub_key, nick or existing_nick)
-
-                if msg_type == "GM":
-                    ack = f"GM_ACK {self.identity.anon_id} {self.identity.crypto.public_key_b64}"
-                    self.transport.send(ack, ip, self.port)
-            elif msg_type == "NICK":
-                if peer_id in self.peers:
-                    ip, _, pub_key, _ = self.peers[peer_id]
-                    nick = self._parse_nick(payload)
-                    self.peers[peer_id] = (ip, now, pub_key, nick)
-            else:
+                    self._replace(peer, nick=nick, last_seen=now)
+        elif msg_type == "CAPS":
+            peer = self.snapshot.peers.get(peer_id)
+            if peer is not None:
+                caps = frozenset(payload.split(","))
+                if caps != peer.caps:
+                    self._replace(peer, caps=caps)
+        else:
+            if DEBUG:
+                print(f"[discovery] drop unknown type: {msg_type}")
+
+    # ---------------- peer table ----------------
+
+    def _publish(self, peers):
+        self.snapshot = PeerSnapshot(self.snapshot.version + 1, peers)
+
+    def _upsert(self, peer_id: str, ip: str, pub_key: str, nick, now: float) -> bool:
+        """
+        Record a GM/GM_ACK. Returns True when the peer is new or changed.
+        """
+        peer = self.snapshot.peers.get(peer_id)
+        if peer is None:
+            peers = dict(self.snapshot.peers)
+            peer = Peer(peer_id, ip, pub_key, nick, last_seen=now, interval=self.GM_INTERVAL)
+            peers[peer_id] = peer
+            self._publish(peers)
+            self._schedule_expiry(peer_id, now + self._peer_timeout(peer))
+            self._reset_beacon()
+            self._peers_changed()
+            return True
+
+        nick = nick or peer.nick
+        if peer.ip == ip and peer.pub_key == pub_key and peer.nick == nick:
+            # Steady-state beacon: no new snapshot.
+            peer.last_seen = now
+            return False
+        # A new key means a new session; capabilities must be re-advertised.
+        caps = peer.caps if peer.pub_key == pub_key else frozenset()
+        self._replace(peer, ip=ip, pub_key=pub_key, nick=nick, caps=caps, last_seen=now)
+        return True
+
+    def _replace(self, peer: Peer, **changes):
+        fields = {name: getattr(peer, name) for name in Peer.__slots__ if name != "peer_id"}
+        fields.update(changes)
+        peers = dict(self.snapshot.peers)
+        peers[peer.peer_id] = Peer(peer.peer_id, **fields)
+        self._publish(peers)
+        self._peers_changed()
+
+    def _observe_beacon(self, peer_id: str, now: float):
+        peer = self.snapshot.peers.get(peer_id)
+        if peer is None:
+            return
+        if peer.beacon_at:
+            gap = now - peer.beacon_at
+            if 0 < gap < self.PEER_TIMEOUT_MAX:
+                # Last gap, not an average: a backing-off sender's next gap
+                # is at most ~3x its last one (doubling plus jitter), which
+                # MISSED_BEACONS covers.
+                peer.interval = gap
+        peer.beacon_at = now
+
+    def _should_ack(self, previous, changed: bool, silent: float) -> bool:
+        if self.mode == "classic" or changed:
+            return True
+        # A peer quiet for several of its own beacon gaps may have expired
+        # us; answer so it does not wait for our next (backed-off) beacon.
+        return silent > 2 * max(previous.interval, self.GM_INTERVAL)
+
+    def _peer_timeout(self, peer: Peer) -> float:
+        if self.mode == "classic":
+            return self.PEER_TIMEOUT
+        return min(
+            self.PEER_TIMEOUT_MAX,
+            max(self.PEER_TIMEOUT, self.MISSED_BEACONS * peer.interval),
+        )
+
+    # ---------------- expiry ----------------
+
+    def _schedule_expiry(self, peer_id: str, deadline: float):
+        heapq.heappush(self._expiry, (deadline, peer_id))
+        if self._expiry_wakeup:
+            self._expiry_wakeup.set()
+
+    async def _expiry_loop(self):
+        while self.running:
+            try:
+                delay = self._expire_due(time.time())
+            except Exception as exc:
+                # Raised by the expiry/peer handlers; the expired peers are
+                # already out of the heap, so look again right away.
                 if DEBUG:
-                    print(f"[discovery] drop unknown type: {msg_type}")
+                    print(f"[discovery] expiry failed: {exc!r}")
+                delay = 0
+            self._expiry_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._expiry_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _expire_due(self, now: float):
+        """
+        Drop peers whose deadline passed. Returns seconds until the next
+        deadline, or None when no peer is scheduled.
+        """
+        expired = []
+        peers = self.snapshot.peers
+        while self._expiry and self._expiry[0][0] <= now:
+            _, peer_id = heapq.heappop(self._expiry)
+            peer = peers.get(peer_id)
+            if peer is None:
+                continue
+            deadline = peer.last_seen + self._peer_timeout(peer)
+            if deadline > now:
+                # Seen since this entry was queued: check again later.
+                heapq.heappush(self._expiry, (deadline, peer_id))
                 continue
+            expired.append(peer_id)
+
+        if expired:
+            remaining = dict(peers)
+            for peer_id in expired:
+                del remaining[peer_id]
+            self._publish(remaining)
+            self._reset_beacon()
+            if DEBUG:
+                print(f"[discovery] expired {len(expired)} peer(s)")
+            self._peers_changed()
+            if self.expiry_handler:
+                self.expiry_handler(expired)
+        if not self._expiry:
+            return None
+        return max(0.0, self._expiry[0][0] - now)
 
-            self._cleanup()
+    def _handle_binary(self, data: bytes, ip: str):
+        try:
+            packet = wire.parse(data)
+        except wire.WireError as exc:
+            if DEBUG:
+                print(f"[discovery] drop binary from {ip}: {exc}")
+            return
+        if DEBUG:
+            print(f"[discovery] recv {ip}: binary type={packet.type} from {packet.sender_id} ({len(data)} bytes)")
 
-    def _cleanup(self):
-        now = time.time()
-        expired = [
-            peer_id
-            for peer_id, (_, last_seen, _, _) in self.peers.items()
-            if now - last_seen > self.PEER_TIMEOUT
-        ]
-        for peer_id in expired:
-            del self.peers[peer_id]
+        if packet.type == wire.TYPE_ENC:
+            handler = self.enc_handler
+        else:
+            handler = self.group_handler
+        if handler:
+            handler(packet.sender_id, packet, ip)
+        elif DEBUG:
+            print("[discovery] binary handler not set; dropped")
 
     def _parse_payload(self, payload: str):
         if "|" not in payload:
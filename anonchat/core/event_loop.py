@@ -0,0 +1,55 @@
+# core/event_loop.py
+
+import asyncio
+import threading
+
+
+class NetworkLoop:
+    """
+    Background asyncio loop that runs transport, discovery and chat.
+
+    The loop lives in one daemon thread. Other threads (Flask handlers,
+    the CLI) reach it through:
+    - run(coro): run a coroutine on the loop and wait for its result
+    - call(fn, *args): run a plain function on the loop and wait for it
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(
+            target=self._run_forever,
+            name="anonchat-net",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def run(self, coro, timeout: float | None = None):
+        if self.in_loop():
+            raise RuntimeError("NetworkLoop.run() called from the loop thread")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def call(self, fn, *args, timeout: float | None = None):
+        async def invoke():
+            return fn(*args)
+
+        return self.run(invoke(), timeout)
+
+    def stop(self):
+        if not self._thread:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
+        self.loop.close()
@@ -0,0 +1,79 @@
+# core/locks.py
+
+import threading
+import time
+
+
+class TimedLock:
+    """
+    threading.Lock that records how long callers waited for it and how
+    long they held it, so contention shows up in /api/metrics.
+
+    Counters are only updated while the lock is held, so they need no
+    extra synchronization.
+    """
+
+    # Holds longer than this are counted as slow.
+    SLOW_HOLD = 0.05
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.slow_holds = 0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            waited = 0.0
+        else:
+            if not blocking:
+                return False
+            start = time.perf_counter()
+            if not self._lock.acquire(True, timeout):
+                return False
+            waited = time.perf_counter() - start
+            self.contended += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+        self.acquisitions += 1
+        self._acquired_at = time.perf_counter()
+        return True
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self.hold_total += held
+        if held > self.hold_max:
+            self.hold_max = held
+        if held > self.SLOW_HOLD:
+            self.slow_holds += 1
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    def stats(self):
+        acquisitions = self.acquisitions
+        return {
+            "acquisitions": acquisitions,
+            "contended": self.contended,
+            "wait_ms_total": round(self.wait_total * 1000, 3),
+            "wait_ms_max": round(self.wait_max * 1000, 3),
+            "hold_ms_avg": round(self.hold_total * 1000 / acquisitions, 4) if acquisitions else 0.0,
+            "hold_ms_max": round(self.hold_max * 1000, 3),
+            "slow_holds": self.slow_holds,
+        }
@@ -1,11 +1,16 @@
+import base64
 import hashlib
 import json
 import secrets
 import threading
 import time
+from collections import deque
 from dataclasses import dataclass, field
+from itertools import islice
 from typing import Callable, Dict, List, Optional, Set, Tuple
 
+from anonchat.core.locks import TimedLock
+
 ROOM_CTL_PREFIX = "ROOMCTL::"
 ROOM_MSG_PREFIX = "ROOMMSG::"
 
@@ -25,28 +30,82 @@ class Room:
     joined: bool = False
     pending: bool = False
     pending_since: Optional[float] = None
+    # Symmetric room key, handed out by the owner and rotated on leave/kick.
+    group_key: Optional[bytes] = None
+    key_epoch: int = 0
+    # Members whose clients predate room keys; they get pairwise copies.
+    legacy_members: Set[str] = field(default_factory=set)
+    # Members whose clients predate membership deltas; they get full lists.
+    snapshot_members: Set[str] = field(default_factory=set)
+    # Membership version: the owner bumps it on every add/remove and
+    # members apply deltas in order, resyncing when they see a gap.
+    members_version: int = 0
+    # Bumped (under the manager lock) whenever a serialized field changes.
+    version: int = 0
 
 
 class RoomManager:
+    # Room events kept for readers that poll with a cursor.
+    EVENT_LOG_SIZE = 256
+    # Minimum gap between membership resync requests for one room.
+    RESYNC_INTERVAL = 1.0
+
     def __init__(
         self,
         lock: Optional[threading.Lock],
         identity,
         chat,
         store_message: Callable[[str, str, str, str], None],
+        on_change: Optional[Callable[[], None]] = None,
+        outbox=None,
     ):
-        self._lock = lock or threading.Lock()
+        # Guards _rooms and every Room. Never held across network sends or
+        # storage calls.
+        self._lock = lock or TimedLock("rooms")
+        # Guards the event ring buffer only, so readers following the log
+        # do not contend with room updates.
+        self._events_lock = TimedLock("room_events")
         self.identity = identity
         self.chat = chat
+        # When set, sends are queued on the Outbox (control traffic at its
+        # CONTROL priority) instead of being sealed on the caller's thread.
+        # Only the injected object is used, so core does not import the
+        # messaging layer.
+        self.outbox = outbox
         self._store_message = store_message
+        self._on_change = on_change
 
         self._rooms: Dict[str, Room] = {}
-        self._room_events: List[Dict] = []
+        # Ring buffer of room events; the event at index i has sequence
+        # number _event_seq - len(_room_events) + 1 + i.
+        self._room_events: deque = deque(maxlen=self.EVENT_LOG_SIZE)
+        # Seeded from the clock so sequence numbers keep growing across
+        # restarts: a browser still holding a cursor from the previous
+        # run sees the new log as ahead of it (missed), not behind it.
+        self._event_seq = int(time.time() * 1000)
         self._known_peers: Set[str] = set()
 
+        # Sum of all room versions (plus removals); keys the cached list.
+        self._version = 0
+        # room_id -> (room.version, JSON object) and (self._version, JSON
+        # array) so unchanged rooms are not re-serialized on every poll.
+        self._room_json: Dict[str, Tuple[int, str]] = {}
+        self._rooms_json: Tuple[int, str] = (-1, "[]")
+        # Only join_room sets pending; lets _clear_stale_pending skip the
+        # scan in the common case.
+        self._has_pending = False
+        # room_id -> time of the last room_members_sync we sent.
+        self._resync_at: Dict[str, float] = {}
+        # room_id -> members_version when a resync was deferred by the
+        # rate limit; sent by a timer once RESYNC_INTERVAL has passed.
+        self._resync_pending: Dict[str, int] = {}
+
     def update_chat(self, chat):
         self.chat = chat
 
+    def lock_stats(self) -> Dict:
+        return {lock.name: lock.stats() for lock in (self._lock, self._events_lock) if isinstance(lock, TimedLock)}
+
     def get_room(self, room_id: str) -> Optional[Room]:
         with self._lock:
             return self._rooms.get(room_id)
@@ -54,6 +113,87 @@ class RoomManager:
     def _hash_password(self, password: str, salt: str) -> str:
         return hashlib.sha256(f"{salt}:{password}".encode("utf-8")).hexdigest()
 
+    # ---------------- room keys ----------------
+
+    def _install_key(self, room: Room, key: bytes, epoch: int):
+        if epoch <= room.key_epoch:
+            return
+        room.group_key = key
+        room.key_epoch = epoch
+        self.identity.crypto.set_group_key(room.id, key, epoch)
+
+    def _drop_key(self, room: Room):
+        room.group_key = None
+        room.key_epoch = 0
+        self.identity.crypto.drop_group_key(room.id)
+
+    def _rotate_key(self, room: Room) -> Dict:
+        """
+        Owner only: switch the room to a fresh key so members that left or
+        were kicked cannot read what follows. Returns the room_key payload.
+        """
+        self._install_key(room, self.identity.crypto.new_group_key(), room.key_epoch + 1)
+        return self._key_payload(room)
+
+    def _key_payload(self, room: Room) -> Dict:
+        return {
+            "type": "room_key",
+            "room_id": room.id,
+            "key": base64.urlsafe_b64encode(room.group_key).decode("ascii"),
+            "key_epoch": room.key_epoch,
+        }
+
+    def _read_key(self, payload: Dict) -> Tuple[Optional[bytes], int]:
+        try:
+            key = base64.urlsafe_b64decode(str(payload.get("key") or "").encode("ascii"))
+            epoch = int(payload.get("key_epoch") or 0)
+        except (ValueError, TypeError):
+            return None, 0
+        if len(key) != 32 or epoch <= 0:
+            return None, 0
+        return key, epoch
+
+    def _read_version(self, payload: Dict) -> int:
+        try:
+            return max(0, int(payload.get("version") or 0))
+        except (ValueError, TypeError):
+            return 0
+
+    def _resync_due(self, room: Room) -> bool:
+        # Caller holds the lock. A gap inside the interval is not dropped:
+        # the request is deferred until the interval has passed.
+        now = time.monotonic()
+        wait = self._resync_at.get(room.id, 0.0) + self.RESYNC_INTERVAL - now
+        if wait <= 0:
+            self._resync_at[room.id] = now
+            return True
+        if room.id not in self._resync_pending:
+            self._resync_pending[room.id] = room.members_version
+            timer = threading.Timer(wait, self._send_deferred_resync, (room.id,))
+            timer.daemon = True
+            timer.start()
+        return False
+
+    def _send_deferred_resync(self, room_id: str):
+        with self._lock:
+            version = self._resync_pending.pop(room_id, None)
+            room = self._rooms.get(room_id)
+            # A full member list (or the missing delta) may have arrived
+            # in the meantime, or we left the room.
+            if version is None or not room or not room.joined or room.members_version != version:
+                return
+            self._resync_at[room_id] = time.monotonic()
+            owner_id = room.owner_id
+        try:
+            self._send_room_ctl(owner_id, {"type": "room_members_sync", "room_id": room_id})
+        except ValueError:
+            pass
+
+    def _forget_resync(self, room_id: str):
+        # Caller holds the lock.
+        self._resync_at.pop(room_id, None)
+        self._resync_pending.pop(room_id, None)
+
     def _room_public_payload(self, room: Room) -> Dict:
         return {
             "id": room.id,
@@ -84,43 +224,86 @@ class RoomManager:
             "is_owner": room.owner_id == self.identity.anon_id,
         }
 
+    def _touch(self, room: Room):
+        # Caller holds the lock.
+        room.version += 1
+        self._version += 1
+
+    @property
+    def version(self) -> int:
+        return self._version
+
     def serialize_rooms(self) -> List[Dict]:
+        return json.loads(self.rooms_json())
+
+    def rooms_json(self) -> str:
+        """
+        JSON array of all rooms, oldest first. Rebuilt only when a room
+        changed since the last call, and then only the rooms that did.
+        """
         self._clear_stale_pending()
         with self._lock:
-            rooms = list(self._rooms.values())
-        rooms.sort(key=lambda r: r.created_at)
-        return [self._serialize_room(room) for room in rooms]
+            version, cached = self._rooms_json
+            if version == self._version:
+                return cached
+            rooms = sorted(self._rooms.values(), key=lambda r: r.created_at)
+            fragments = []
+            for room in rooms:
+                entry = self._room_json.get(room.id)
+                if entry is None or entry[0] != room.version:
+                    entry = (room.version, json.dumps(self._serialize_room(room), separators=(",", ":")))
+                    self._room_json[room.id] = entry
+                fragments.append(entry[1])
+            if len(self._room_json) > len(rooms):
+                for room_id in set(self._room_json) - set(self._rooms):
+                    del self._room_json[room_id]
+            cached = "[" + ",".join(fragments) + "]"
+            self._rooms_json = (self._version, cached)
+            return cached
 
     def serialize_room(self, room: Room) -> Dict:
         return self._serialize_room(room)
 
     def _push_room_event(self, event: Dict):
-        with self._lock:
+        with self._events_lock:
+            self._event_seq += 1
+            event["seq"] = self._event_seq
             self._room_events.append(event)
-            if len(self._room_events) > 50:
-                self._room_events = self._room_events[-50:]
+        self._changed()
+
+    def _changed(self):
+        """
+        Tell listeners (the UI state stream) that rooms or room events moved.
+        Must be called without holding the lock.
+        """
+        if self._on_change:
+            self._on_change()
+
+    def expire_pending(self):
+        self._clear_stale_pending()
 
     def _clear_stale_pending(self, timeout: float = 8.0):
         """
         Reset pending joins that never received an acknowledgement
         so the user can retry instead of being stuck.
         """
+        if not self._has_pending:
+            return
         now = time.time()
         timed_out: List[Tuple[str, str]] = []
         with self._lock:
+            still_pending = False
             for room in self._rooms.values():
                 if not room.pending:
                     continue
-                if not room.pending_since:
-                    room.pending = False
-                    room.pending_since = None
-                    timed_out.append((room.id, room.name))
-                    continue
-                if now - room.pending_since < timeout:
+                if room.pending_since and now - room.pending_since < timeout:
+                    still_pending = True
                     continue
                 room.pending = False
                 room.pending_since = None
+                self._touch(room)
                 timed_out.append((room.id, room.name))
+            self._has_pending = still_pending
 
         for room_id, room_name in timed_out:
             self._push_room_event(
@@ -132,14 +315,45 @@ class RoomManager:
                 }
             )
 
-    def consume_room_events(self, peer_ids: Set[str]) -> Tuple[Set[str], List[Dict]]:
+    def note_peers(self, peer_ids: Set[str]) -> Set[str]:
+        """
+        Record peer_ids as seen and return the ones that are new.
+        """
         with self._lock:
             new_peers = peer_ids - self._known_peers
             if new_peers:
                 self._known_peers |= new_peers
-            room_events = list(self._room_events)
-            self._room_events.clear()
-        return set(new_peers), room_events
+        return set(new_peers)
+
+    def event_cursor(self) -> int:
+        with self._events_lock:
+            return self._event_seq
+
+    def room_events_since(self, cursor: Optional[int]) -> Tuple[int, List[Dict], bool]:
+        """
+        Events with seq > cursor, oldest first. Returns (new cursor, events,
+        missed); missed is True when the buffer already overwrote events
+        the reader had not seen. A reader without a cursor starts at the
+        current end. Nothing is removed, so any number of readers can
+        follow the log independently.
+        """
+        with self._events_lock:
+            latest = self._event_seq
+            if cursor is None or cursor >= latest:
+                return latest, [], False
+            oldest = latest - len(self._room_events) + 1
+            missed = cursor + 1 < oldest
+            start = max(cursor + 1, oldest) - oldest
+            events = list(islice(self._room_events, start, None))
+        return latest, events, missed
+
+    def forget_peers(self, peer_ids):
+        """
+        Called when peers time out, so they get our discoverable rooms
+        announced again if they come back.
+        """
+        with self._lock:
+            self._known_peers.difference_update(peer_ids)
 
     def get_owned_discoverable_rooms(self) -> List[Room]:
         with self._lock:
@@ -152,33 +366,98 @@ class RoomManager:
     def _send_room_ctl(self, peer_id: str, payload: Dict):
         if not self.chat:
             return
-        message = f"{ROOM_CTL_PREFIX}{json.dumps(payload, separators=(',', ':'))}"
-        self.chat.send_to_peer(peer_id, message)
+        self._send_ctl_message(peer_id, f"{ROOM_CTL_PREFIX}{json.dumps(payload, separators=(',', ':'))}")
+
+    def _send_ctl_message(self, peer_id: str, message: str):
+        if self.outbox is None:
+            self.chat.send_to_peer(peer_id, message)
+            return
+        if self.chat.discovery.get_peer(peer_id) is None:
+            raise ValueError("Unknown peer")
+        self.outbox.send_to_peer(peer_id, message, priority=self.outbox.CONTROL)
 
     def _broadcast_room_ctl(self, peer_ids: Set[str], payload: Dict):
         if not self.chat:
             return
+        message = f"{ROOM_CTL_PREFIX}{json.dumps(payload, separators=(',', ':'))}"
         for peer_id in peer_ids:
             if peer_id == self.identity.anon_id:
                 continue
             try:
-                self._send_room_ctl(peer_id, payload)
+                self._send_ctl_message(peer_id, message)
             except ValueError:
                 continue
 
+    # ---------------- membership ----------------
+
+    def _members_payload(self, room: Room) -> Dict:
+        return {
+            "type": "room_members",
+            "room_id": room.id,
+            "members": sorted(room.members),
+            "legacy": sorted(room.legacy_members),
+            "version": room.members_version,
+        }
+
+    def _member_change(
+        self,
+        room: Room,
+        added: Set[str] = frozenset(),
+        removed: Set[str] = frozenset(),
+        skip: Set[str] = frozenset(),
+    ) -> List[Tuple[Set[str], Dict]]:
+        """
+        Owner only, caller holds the lock and has already updated
+        room.members: bump the membership version and return the
+        [(peer_ids, payload)] that announce it. Members get a delta;
+        older clients in snapshot_members get the full list.
+        """
+        room.members_version += 1
+        recipients = room.members - skip - {self.identity.anon_id}
+        full_for = recipients & room.snapshot_members
+        delta_for = recipients - full_for
+        sends = []
+        if delta_for:
+            delta = {
+                "type": "room_members_delta",
+                "room_id": room.id,
+                "version": room.members_version,
+            }
+            if added:
+                delta["add"] = sorted(added)
+                legacy = added & room.legacy_members
+                if legacy:
+                    delta["legacy"] = sorted(legacy)
+            if removed:
+                delta["remove"] = sorted(removed)
+            sends.append((delta_for, delta))
+        if full_for:
+            sends.append((full_for, self._members_payload(room)))
+        return sends
+
+    def _send_member_change(self, sends: List[Tuple[Set[str], Dict]]):
+        for peer_ids, payload in sends:
+            self._broadcast_room_ctl(peer_ids, payload)
+
     def announce_room(self, room: Room, peer_ids: Optional[Set[str]] = None):
         if not room.discoverable or not self.chat:
             return
         payload = {"type": "room_announce", "room": self._room_public_payload(room)}
         message = f"{ROOM_CTL_PREFIX}{json.dumps(payload, separators=(',', ':'))}"
         if peer_ids is None:
-            self.chat.send_to_all(message)
+            if self.outbox is None:
+                self.chat.send_to_all(message)
+            else:
+                self.outbox.send_to_all(message, priority=self.outbox.CONTROL)
             return
         for peer_id in peer_ids:
             if peer_id == self.identity.anon_id:
                 continue
             try:
-                self.chat.send_to_peer(peer_id, message)
+                if self.outbox is None:
+                    self.chat.send_to_peer(peer_id, message)
+                else:
+                    self.outbox.send_to_peer(peer_id, message, priority=self.outbox.CONTROL)
             except ValueError:
                 continue
 
@@ -230,16 +509,21 @@ class RoomManager:
                     room.created_at = created_at
                     if not room.members:
                         room.members.add(owner_id)
+                self._touch(room)
 
             if is_new:
                 self._push_room_event(
                     {"type": "room_discovered", "room_id": room_id, "name": name}
                 )
+            else:
+                self._changed()
             return
 
         if kind == "room_join":
             room_id = str(payload.get("room_id") or "").strip()
             password = str(payload.get("password") or "")
+            supports_key = bool(payload.get("group_key"))
+            supports_deltas = bool(payload.get("member_deltas"))
             if not room_id:
                 return
             with self._lock:
@@ -268,10 +552,21 @@ class RoomManager:
 
                 if ok:
                     room.members.add(sender_id)
-                    members = sorted(room.members)
+                    if supports_key:
+                        room.legacy_members.discard(sender_id)
+                    else:
+                        room.legacy_members.add(sender_id)
+                    if supports_deltas:
+                        room.snapshot_members.discard(sender_id)
+                    else:
+                        room.snapshot_members.add(sender_id)
+                    self._touch(room)
+                    # The joiner gets the full list (and version) in its ack.
+                    member_sends = self._member_change(room, added={sender_id}, skip={sender_id})
+                    members_payload = self._members_payload(room)
                     room_payload = self._room_public_payload(room)
+                    key_payload = self._key_payload(room) if room.group_key else None
                 else:
-                    members = []
                     room_payload = None
 
             if ok:
@@ -287,14 +582,16 @@ class RoomManager:
                     "type": "room_join_ack",
                     "room_id": room_id,
                     "ok": True,
-                    "members": members,
+                    "members": members_payload["members"],
+                    "legacy": members_payload["legacy"],
+                    "version": members_payload["version"],
                     "room": room_payload,
                 }
+                if key_payload:
+                    ack["key"] = key_payload["key"]
+                    ack["key_epoch"] = key_payload["key_epoch"]
                 self._send_room_ctl(sender_id, ack)
-                self._broadcast_room_ctl(
-                    set(members),
-                    {"type": "room_members", "room_id": room_id, "members": members},
-                )
+                self._send_member_change(member_sends)
             else:
                 ack = {
                     "type": "room_join_ack",
@@ -337,6 +634,11 @@ class RoomManager:
                     room.pending = False
                     room.pending_since = None
                     room.members = set(members)
+                    room.legacy_members = set(payload.get("legacy") or [])
+                    room.members_version = self._read_version(payload)
+                    key, epoch = self._read_key(payload)
+                    if key:
+                        self._install_key(room, key, epoch)
                     if self.identity.anon_id not in room.members:
                         room.members.add(self.identity.anon_id)
                     if room_data:
@@ -351,6 +653,7 @@ class RoomManager:
                 else:
                     room.pending = False
                     room.pending_since = None
+                self._touch(room)
 
             if ok:
                 self._push_room_event(
@@ -372,16 +675,25 @@ class RoomManager:
             members = payload.get("members") or []
             if not room_id:
                 return
+            version = self._read_version(payload)
             with self._lock:
                 room = self._rooms.get(room_id)
                 if not room:
                     return
+                if "version" in payload and version < room.members_version:
+                    # Overtaken by a newer delta.
+                    return
                 previous = set(room.members)
                 room.members = set(members)
+                room.members_version = version
+                if "legacy" in payload:
+                    room.legacy_members = set(payload.get("legacy") or [])
                 room.joined = self.identity.anon_id in room.members
                 room.pending = False
                 room.pending_since = None
+                self._touch(room)
                 room_name = room.name
+            self._changed()
             joined = set(members) - previous
             left = previous - set(members)
             for member_id in joined:
@@ -408,6 +720,73 @@ class RoomManager:
                 )
             return
 
+        if kind == "room_members_delta":
+            room_id = str(payload.get("room_id") or "").strip()
+            version = self._read_version(payload)
+            if not room_id or version <= 0:
+                return
+            added: Set[str] = set()
+            removed: Set[str] = set()
+            resync = False
+            with self._lock:
+                room = self._rooms.get(room_id)
+                if not room or room.owner_id != sender_id or not room.joined:
+                    return
+                if version <= room.members_version:
+                    return
+                if version != room.members_version + 1:
+                    resync = self._resync_due(room)
+                else:
+                    added = {str(m) for m in payload.get("add") or []} - room.members
+                    removed = {str(m) for m in payload.get("remove") or []} & room.members
+                    room.members |= added
+                    room.members -= removed
+                    room.legacy_members |= {str(m) for m in payload.get("legacy") or []}
+                    room.legacy_members -= removed
+                    room.members_version = version
+                    room.joined = self.identity.anon_id in room.members
+                    self._touch(room)
+                room_name = room.name
+            if resync:
+                try:
+                    self._send_room_ctl(sender_id, {"type": "room_members_sync", "room_id": room_id})
+                except ValueError:
+                    pass
+                return
+            self._changed()
+            for member_id in added - {self.identity.anon_id}:
+                self._push_room_event(
+                    {
+                        "type": "room_member_joined",
+                        "room_id": room_id,
+                        "room_name": room_name,
+                        "member_id": member_id,
+                    }
+                )
+            for member_id in removed - {self.identity.anon_id}:
+                self._push_room_event(
+                    {
+                        "type": "room_member_left",
+                        "room_id": room_id,
+                        "room_name": room_name,
+                        "member_id": member_id,
+                    }
+                )
+            return
+
+        if kind == "room_members_sync":
+            room_id = str(payload.get("room_id") or "").strip()
+            with self._lock:
+                room = self._rooms.get(room_id)
+                if not room or room.owner_id != self.identity.anon_id or sender_id not in room.members:
+                    return
+                full = self._members_payload(room)
+            try:
+                self._send_room_ctl(sender_id, full)
+            except ValueError:
+                pass
+            return
+
         if kind == "room_leave":
             room_id = str(payload.get("room_id") or "").strip()
             if not room_id:
@@ -416,10 +795,16 @@ class RoomManager:
                 room = self._rooms.get(room_id)
                 if not room or room.owner_id != self.identity.anon_id:
                     return
-                if sender_id in room.members:
-                    room.members.discard(sender_id)
-                members = sorted(room.members)
+                if sender_id not in room.members:
+                    return
+                room.members.discard(sender_id)
+                room.legacy_members.discard(sender_id)
+                room.snapshot_members.discard(sender_id)
+                self._touch(room)
+                members = set(room.members)
+                member_sends = self._member_change(room, removed={sender_id})
                 room_name = room.name
+                key_payload = self._rotate_key(room) if room.group_key else None
             self._push_room_event(
                 {
                     "type": "room_member_left",
@@ -428,10 +813,21 @@ class RoomManager:
                     "member_id": sender_id,
                 }
             )
-            self._broadcast_room_ctl(
-                set(members),
-                {"type": "room_members", "room_id": room_id, "members": members},
-            )
+            if key_payload:
+                self._broadcast_room_ctl(members, key_payload)
+            self._send_member_change(member_sends)
+            return
+
+        if kind == "room_key":
+            room_id = str(payload.get("room_id") or "").strip()
+            key, epoch = self._read_key(payload)
+            if not room_id or not key:
+                return
+            with self._lock:
+                room = self._rooms.get(room_id)
+                if not room or room.owner_id != sender_id or not room.joined:
+                    return
+                self._install_key(room, key, epoch)
             return
 
         if kind == "room_kick":
@@ -447,6 +843,9 @@ class RoomManager:
                 room.pending = False
                 room.pending_since = None
                 room.members.discard(self.identity.anon_id)
+                self._drop_key(room)
+                self._forget_resync(room_id)
+                self._touch(room)
             self._push_room_event(
                 {
                     "type": "room_kicked",
@@ -465,7 +864,36 @@ class RoomManager:
         room_id = room_id.strip()
         if not room_id:
             return None
+        return self._accept_room_message(sender_id, room_id, text)
 
+    def handle_group_message(self, sender_id: str, room_id: str, key_epoch: int, text: str):
+        """
+        Room message sealed with the room key. The key only shows the
+        sender is "someone in the room", so the claimed sender must also be
+        a listed member, for the current epoch and for an older one still
+        accepted for datagrams in flight during a rotation.
+        """
+        resync = False
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if not room:
+                return None
+            listed = sender_id in room.members
+            if not listed and room.joined and room.owner_id != self.identity.anon_id:
+                # Forged, or a new member whose delta has not reached us
+                # yet; catch up on the member list in case it is the latter.
+                resync = key_epoch == room.key_epoch and self._resync_due(room)
+            owner_id = room.owner_id
+        if resync:
+            try:
+                self._send_room_ctl(owner_id, {"type": "room_members_sync", "room_id": room_id})
+            except ValueError:
+                pass
+        if not listed:
+            return None
+        return self._accept_room_message(sender_id, room_id, text)
+
+    def _accept_room_message(self, sender_id: str, room_id: str, text: str):
         with self._lock:
             room = self._rooms.get(room_id)
             if not room:
@@ -481,15 +909,61 @@ class RoomManager:
                     joined=True,
                 )
                 self._rooms[room_id] = room
-            room.joined = True
-            room.pending = False
-            room.pending_since = None
-            room.members.add(self.identity.anon_id)
-            room.members.add(sender_id)
+            changed = (
+                not room.joined
+                or room.pending
+                or self.identity.anon_id not in room.members
+                or sender_id not in room.members
+            )
+            if changed:
+                room.joined = True
+                room.pending = False
+                room.pending_since = None
+                room.members.add(self.identity.anon_id)
+                room.members.add(sender_id)
+                self._touch(room)
 
+        if changed:
+            self._changed()
         self._store_message("in", room_id, sender_id, text)
         return room_id, text
 
+    def send_room_message(self, room: Room, text: str, delivery=None) -> int:
+        """
+        Fan a room message out to its members. Members holding the room key
+        share one ciphertext (O(1) crypto per message); members on older
+        clients still get a pairwise copy. Returns the number of recipients.
+
+        With an outbox the fanout is only queued; per-recipient results
+        land in `delivery`.
+        """
+        with self._lock:
+            members = set(room.members)
+            if not members and room.owner_id:
+                members.add(room.owner_id)
+            members.discard(self.identity.anon_id)
+            if room.key_epoch:
+                keyed = members - room.legacy_members
+            else:
+                keyed = set()
+        pairwise = members - keyed
+        payload = f"{ROOM_MSG_PREFIX}{room.id}::{text}"
+
+        if self.outbox is not None:
+            if keyed:
+                self.outbox.send_group(room.id, keyed, text, delivery=delivery)
+            for peer_id in pairwise:
+                self.outbox.send_to_peer(peer_id, payload, delivery=delivery)
+            return len(members)
+
+        sent = 0
+        if keyed:
+            sent += self.chat.send_group(room.id, keyed, text)
+        for peer_id in pairwise:
+            self.chat.send_to_peer(peer_id, payload)
+            sent += 1
+        return sent
+
     def create_room(
         self,
         name: str,
@@ -528,7 +1002,10 @@ class RoomManager:
                 joined=True,
             )
             self._rooms[room_id] = room
+            self._install_key(room, self.identity.crypto.new_group_key(), 1)
+            self._touch(room)
 
+        self._changed()
         self.announce_room(room)
         return room
 
@@ -539,23 +1016,30 @@ class RoomManager:
                 return 404, {"error": "Room not found"}
             if not self.chat:
                 return 503, {"error": "Chat not ready"}
-            if room.owner_id == self.identity.anon_id:
-                room.joined = True
-                room.pending = False
-                room.pending_since = None
-                return 200, {"ok": True, "room": self._serialize_room(room)}
-            if room.joined:
-                room.pending = False
-                room.pending_since = None
+            if room.owner_id == self.identity.anon_id or room.joined:
+                if not room.joined or room.pending:
+                    room.joined = True
+                    room.pending = False
+                    room.pending_since = None
+                    self._touch(room)
                 return 200, {"ok": True, "room": self._serialize_room(room)}
             room.pending = True
             room.pending_since = time.time()
+            self._has_pending = True
+            self._touch(room)
             owner_id = room.owner_id
 
+        self._changed()
         try:
             self._send_room_ctl(
                 owner_id,
-                {"type": "room_join", "room_id": room_id, "password": password},
+                {
+                    "type": "room_join",
+                    "room_id": room_id,
+                    "password": password,
+                    "group_key": True,
+                    "member_deltas": True,
+                },
             )
         except (ValueError, Exception):
             with self._lock:
@@ -563,6 +1047,8 @@ class RoomManager:
                 if room:
                     room.pending = False
                     room.pending_since = None
+                    self._touch(room)
+            self._changed()
             return 400, {"error": "Room owner unavailable"}
 
         return 200, {"ok": True}
@@ -578,8 +1064,12 @@ class RoomManager:
             room.pending = False
             room.pending_since = None
             room.members.discard(self.identity.anon_id)
+            self._drop_key(room)
+            self._forget_resync(room_id)
+            self._touch(room)
             owner_id = room.owner_id
 
+        self._changed()
         try:
             self._send_room_ctl(
                 owner_id,
@@ -604,12 +1094,17 @@ class RoomManager:
             if member_id not in room.members:
                 return 404, {"error": "Member not found"}
             room.members.discard(member_id)
-            members = sorted(room.members)
+            room.legacy_members.discard(member_id)
+            room.snapshot_members.discard(member_id)
+            self._touch(room)
+            members = set(room.members)
+            member_sends = self._member_change(room, removed={member_id})
+            key_payload = self._rotate_key(room) if room.group_key else None
 
-        self._broadcast_room_ctl(
-            set(members),
-            {"type": "room_members", "room_id": room_id, "members": members},
-        )
+        self._changed()
+        if key_payload:
+            self._broadcast_room_ctl(members, key_payload)
+        self._send_member_change(member_sends)
         try:
             self._send_room_ctl(member_id, {"type": "room_kick", "room_id": room_id})
         except ValueError:
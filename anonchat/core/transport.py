@@ -1,6 +1,155 @@
 # core/transport.py
 
+import asyncio
+import itertools
+import os
 import socket
+import sys
+import threading
+import time
+from collections import deque
+
+# Fragment framing:
+#   FRAG <msg_id> <index> <count> <chunk bytes>
+# Older builds read the first three tokens, see an unknown type and drop it.
+FRAG_PREFIX = b"FRAG "
+
+# Datagrams up to this size go out whole; older builds read 4096 bytes.
+FRAGMENT_THRESHOLD = 4096
+# Chunk size that fits a 1500-byte Ethernet MTU with IP/UDP/FRAG headers.
+FRAGMENT_SIZE = 1200
+MAX_MESSAGE_BYTES = 1024 * 1024
+# Whole packets waiting for the discovery stage; beyond this they are
+# dropped at the socket edge like any other UDP overflow.
+RX_QUEUE_SIZE = 2048
+
+DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
+# Fragments of a large message arrive as a burst; leave room in the kernel
+# queue for a couple of them (the OS may clamp this to its own maximum).
+SOCKET_RCVBUF = 2 * MAX_MESSAGE_BYTES
+
+# Batched receive: each readiness event drains up to RX_BATCH datagrams
+# into a preallocated slab of RX_SLOT_SIZE slots. Our own datagrams are at
+# most FRAGMENT_THRESHOLD bytes; anything that does not fit is counted as
+# truncated and dropped.
+RX_BATCH = 64
+RX_SLOT_SIZE = 16 * 1024
+# Datagrams held while the kernel send buffer is full.
+TX_BACKLOG = 4096
+
+# Linux reports the socket's cumulative kernel drop count with each packet
+# once SO_RXQ_OVFL is set; the constant is missing from the socket module.
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40) if sys.platform.startswith("linux") else None
+
+
+class Reassembler:
+    """
+    Bounded reassembly buffers for fragmented datagrams.
+
+    - at most `max_pending` partial messages and `max_bytes` buffered
+    - partial messages older than `timeout` seconds are dropped, so a lost
+      fragment cannot pin memory
+    """
+
+    def __init__(
+        self,
+        timeout: float = 5.0,
+        max_pending: int = 64,
+        max_bytes: int = 4 * MAX_MESSAGE_BYTES,
+    ):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        # (ip, port, msg_id) -> [first_seen, count, received, size, chunks]
+        self._pending = {}
+        self._size = 0
+        self.fragments = 0
+        self.reassembled = 0
+        self.expired = 0
+        self.dropped = 0
+
+    def feed(self, data: bytes, ip: str, port: int):
+        """
+        Add one fragment. Returns the whole payload once complete, else None.
+        """
+        self.fragments += 1
+        now = time.monotonic()
+        self._expire(now)
+
+        try:
+            _, msg_id, index, count, chunk = data.split(b" ", 4)
+            index = int(index)
+            count = int(count)
+        except ValueError:
+            self.dropped += 1
+            return None
+        if not 0 <= index < count or count * FRAGMENT_SIZE > MAX_MESSAGE_BYTES + FRAGMENT_SIZE:
+            self.dropped += 1
+            return None
+
+        key = (ip, port, msg_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            if len(self._pending) >= self.max_pending:
+                self._evict_oldest()
+            entry = [now, count, 0, 0, [None] * count]
+            self._pending[key] = entry
+        if entry[1] != count or entry[4][index] is not None:
+            self.dropped += 1
+            return None
+        if self._size + len(chunk) > self.max_bytes:
+            self._drop(key)
+            self.dropped += 1
+            return None
+
+        entry[4][index] = chunk
+        entry[2] += 1
+        entry[3] += len(chunk)
+        self._size += len(chunk)
+        if entry[2] < count:
+            return None
+
+        self._drop(key)
+        self.reassembled += 1
+        return b"".join(entry[4])
+
+    def _expire(self, now: float):
+        stale = [key for key, entry in self._pending.items() if now - entry[0] > self.timeout]
+        for key in stale:
+            self._drop(key)
+            self.expired += 1
+
+    def _evict_oldest(self):
+        key = min(self._pending, key=lambda k: self._pending[k][0])
+        self._drop(key)
+        self.expired += 1
+
+    def _drop(self, key):
+        entry = self._pending.pop(key)
+        self._size -= entry[3]
+
+    def stats(self):
+        return {
+            "fragments_received": self.fragments,
+            "reassembled": self.reassembled,
+            "reassembly_expired": self.expired,
+            "reassembly_dropped": self.dropped,
+            "reassembly_pending": len(self._pending),
+            "reassembly_bytes": self._size,
+        }
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, owner: "Transport"):
+        self._owner = owner
+
+    def datagram_received(self, data: bytes, addr):
+        self._owner._on_datagram(data, addr)
+
+    def error_received(self, exc: Exception):
+        self._owner.send_errors += 1
+        if DEBUG:
+            print(f"[transport] socket error: {exc}")
 
 
 class Transport:
@@ -9,19 +158,51 @@ class Transport:
 
     Responsibilities:
     - Bind a UDP socket to a specific local interface
-    - Send UTF-8 messages
-    - Receive UTF-8 messages
+    - Send UTF-8 messages or raw binary packets
+    - Receive UTF-8 messages or raw binary packets
+    - Split messages above FRAGMENT_THRESHOLD into MTU-sized fragments
+      and reassemble them on receipt
+    - Optionally join an IP multicast group (multicast_group) so group
+      traffic reaches only subscribed hosts instead of the whole subnet
 
     Non-responsibilities:
     - No peer management
     - No discovery logic
     - No protocol parsing
-    - No threading
+
+    Receiving runs on the asyncio loop passed to open(). send() may be
+    called from any thread; off-loop sends are handed to the loop.
+
+    With batch_io (the default on loops that support add_reader), the
+    sockets are read directly: every readiness event drains all ready
+    datagrams, up to RX_BATCH, with recvmsg_into into a reusable slab and
+    copies out only the bytes received. send_batch() hands a whole fanout
+    to the loop in one hop. Other loops (e.g. the Windows proactor) use
+    asyncio's datagram endpoint, one datagram per callback.
     """
 
-    def __init__(self, port: int, bind_ip: str, broadcast: bool = True):
+    def __init__(
+        self,
+        port: int,
+        bind_ip: str,
+        broadcast: bool = True,
+        fragment_threshold: int = FRAGMENT_THRESHOLD,
+        fragment_size: int = FRAGMENT_SIZE,
+        multicast_group: str | None = None,
+        multicast_ttl: int = 1,
+        multicast_loop: bool = True,
+        rcvbuf: int = SOCKET_RCVBUF,
+        sndbuf: int | None = None,
+        batch_io: bool = True,
+    ):
         self.port = port
         self.bind_ip = bind_ip
+        self.multicast_group = multicast_group or None
+        self.fragment_threshold = fragment_threshold
+        self.fragment_size = fragment_size
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.batch_io = batch_io
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -32,29 +213,378 @@ class Transport:
         if broadcast:
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
+        self._tune(self.sock)
+        if sndbuf:
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+            except OSError:
+                pass
+
         # Bind ONLY to the selected interface
         self.sock.bind((self.bind_ip, self.port))
 
+        self.group_sock = None
+        if self.multicast_group:
+            self._setup_multicast(multicast_ttl, multicast_loop)
+
+        self._loop = None
+        self._loop_thread = None
+        self._endpoint = None
+        self._group_endpoint = None
+        self._readers = []
+        self._inbox = None
+        self._closed = False
+
+        self._rx_slab = None
+        self._rx_slots = ()
+        self._tx_backlog = deque()
+        self._ancbufsize = socket.CMSG_SPACE(4) if SO_RXQ_OVFL is not None and hasattr(socket, "CMSG_SPACE") else 0
+        # fileno -> last cumulative drop count the kernel reported
+        self._kernel_drops = {}
+
+        self._reassembler = Reassembler()
+        self._msg_ids = itertools.count(int.from_bytes(os.urandom(4), "big"))
+        self._stats_lock = threading.Lock()
+        self.fragmented_sent = 0
+        self.fragments_sent = 0
+        self.rx_datagrams = 0
+        self.rx_batches = 0
+        self.rx_truncated = 0
+        self.rx_dropped = 0
+        self.tx_batches = 0
+        self.tx_deferred = 0
+        self.tx_dropped = 0
+        self.send_errors = 0
+
+    def _tune(self, sock):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError:
+            pass
+        if SO_RXQ_OVFL is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            except OSError:
+                pass
+
+    def _setup_multicast(self, ttl: int, loop: bool):
+        """
+        Send group traffic out of bind_ip and receive it on a second socket.
+
+        A socket bound to a unicast address never sees multicast on Linux,
+        so the group gets its own socket bound to (group, port). Binding to
+        the group address also keeps other groups' traffic out; platforms
+        that refuse it fall back to the wildcard address.
+        """
+        iface = socket.inet_aton(self.bind_ip)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, iface)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loop))
+
+        group_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            group_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                group_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._tune(group_sock)
+            try:
+                group_sock.bind((self.multicast_group, self.port))
+            except OSError:
+                group_sock.bind(("", self.port))
+            membership = socket.inet_aton(self.multicast_group) + iface
+            group_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError:
+            group_sock.close()
+            self.sock.close()
+            raise
+        self.group_sock = group_sock
+
+    @property
+    def _sockets(self):
+        return [sock for sock in (self.sock, self.group_sock) if sock is not None]
+
+    async def open(self):
+        """
+        Attach the socket(s) to the running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._inbox = asyncio.Queue(RX_QUEUE_SIZE)
+
+        if self.batch_io:
+            try:
+                for sock in self._sockets:
+                    sock.setblocking(False)
+                    self._loop.add_reader(sock.fileno(), self._drain, sock)
+                    self._readers.append(sock.fileno())
+            except NotImplementedError:
+                self.batch_io = False
+            else:
+                self._rx_slab = bytearray(RX_BATCH * RX_SLOT_SIZE)
+                slab = memoryview(self._rx_slab)
+                self._rx_slots = [
+                    slab[offset:offset + RX_SLOT_SIZE]
+                    for offset in range(0, len(slab), RX_SLOT_SIZE)
+                ]
+                return
+
+        self._endpoint, _ = await self._loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self),
+            sock=self.sock,
+        )
+        if self.group_sock is not None:
+            self._group_endpoint, _ = await self._loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self),
+                sock=self.group_sock,
+            )
+
+    @property
+    def loop(self):
+        return self._loop
+
     def send(self, message: str, target_ip: str, target_port: int):
         """
         Send a message to a specific IP:port.
         """
-        data = message.encode("utf-8")
-        self.sock.sendto(data, (target_ip, target_port))
+        self.send_bytes(message.encode("utf-8"), target_ip, target_port)
+
+    def send_bytes(self, data: bytes, target_ip: str, target_port: int):
+        """
+        Send a raw packet, fragmenting it if needed.
+        """
+        self._dispatch([(self._frame(data), (target_ip, target_port))])
+
+    def send_batch(self, packets):
+        """
+        Send many raw packets, e.g. one message fanned out to a room.
+
+        packets: iterable of (data, target_ip, target_port). Identical
+        payloads are framed once, and the whole batch reaches the loop in
+        one hop instead of one per recipient.
+        """
+        # id(data) -> (data, datagrams); holding data keeps its id unique.
+        framed = {}
+        batch = []
+        for data, target_ip, target_port in packets:
+            entry = framed.get(id(data))
+            if entry is None:
+                entry = framed[id(data)] = (data, self._frame(data))
+            batch.append((entry[1], (target_ip, target_port)))
+        if batch:
+            self.tx_batches += 1
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        if self._loop is None:
+            for datagrams, addr in batch:
+                for datagram in datagrams:
+                    self.sock.sendto(datagram, addr)
+        elif threading.get_ident() == self._loop_thread:
+            self._send_batch(batch)
+        else:
+            self._loop.call_soon_threadsafe(self._send_batch, batch)
+
+    def _frame(self, data: bytes):
+        if len(data) <= self.fragment_threshold:
+            return (data,)
+        if len(data) > MAX_MESSAGE_BYTES:
+            raise ValueError("Message too large")
+
+        msg_id = f"{next(self._msg_ids) & 0xFFFFFFFF:08x}".encode("ascii")
+        chunks = [
+            data[offset:offset + self.fragment_size]
+            for offset in range(0, len(data), self.fragment_size)
+        ]
+        count = str(len(chunks)).encode("ascii")
+        with self._stats_lock:
+            self.fragmented_sent += 1
+            self.fragments_sent += len(chunks)
+        return [
+            b"%s%s %d %s %s" % (FRAG_PREFIX, msg_id, index, count, chunk)
+            for index, chunk in enumerate(chunks)
+        ]
+
+    def _send_batch(self, batch):
+        if self._closed:
+            return
+        if not self.batch_io:
+            if self._endpoint.is_closing():
+                return
+            for datagrams, addr in batch:
+                for datagram in datagrams:
+                    self._endpoint.sendto(datagram, addr)
+            return
+
+        sendto = self.sock.sendto
+        backlog = self._tx_backlog
+        for datagrams, addr in batch:
+            for datagram in datagrams:
+                if backlog:
+                    self._defer(datagram, addr)
+                    continue
+                try:
+                    sendto(datagram, addr)
+                except (BlockingIOError, InterruptedError):
+                    self._defer(datagram, addr)
+                except OSError as exc:
+                    self.send_errors += 1
+                    if DEBUG:
+                        print(f"[transport] send to {addr[0]} failed: {exc}")
+
+    def _defer(self, datagram: bytes, addr):
+        """
+        Hold a datagram until the kernel send buffer drains.
+        """
+        if len(self._tx_backlog) >= TX_BACKLOG:
+            self.tx_dropped += 1
+            return
+        if not self._tx_backlog:
+            self._loop.add_writer(self.sock.fileno(), self._flush_backlog)
+        self._tx_backlog.append((datagram, addr))
+        self.tx_deferred += 1
+
+    def _flush_backlog(self):
+        backlog = self._tx_backlog
+        while backlog:
+            datagram, addr = backlog[0]
+            try:
+                self.sock.sendto(datagram, addr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self.send_errors += 1
+            backlog.popleft()
+        self._loop.remove_writer(self.sock.fileno())
+
+    def _drain(self, sock):
+        """
+        Read every ready datagram (up to RX_BATCH) into the slab, then
+        hand them on. Stops early once the socket would block.
+        """
+        slots = self._rx_slots
+        ancbufsize = self._ancbufsize
+        received = []
+        reads = 0
+        while reads < RX_BATCH:
+            slot = slots[len(received)]
+            reads += 1
+            try:
+                if ancbufsize:
+                    nbytes, ancdata, flags, addr = sock.recvmsg_into((slot,), ancbufsize)
+                    if ancdata:
+                        self._note_kernel_drops(sock, ancdata)
+                else:
+                    nbytes, addr = sock.recvfrom_into(slot)
+                    flags = 0
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self.send_errors += 1
+                if DEBUG:
+                    print(f"[transport] socket error: {exc}")
+                break
+            if flags & getattr(socket, "MSG_TRUNC", 0):
+                self.rx_truncated += 1
+                continue
+            received.append((nbytes, addr))
+
+        if not received:
+            return
+        self.rx_batches += 1
+        self.rx_datagrams += len(received)
+        for slot, (nbytes, addr) in zip(slots, received):
+            # One exact-size copy per datagram; the slot is reused.
+            self._on_datagram(bytes(slot[:nbytes]), addr)
+
+    def _note_kernel_drops(self, sock, ancdata):
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                self._kernel_drops[sock.fileno()] = int.from_bytes(data[:4], sys.byteorder)
+
+    def _on_datagram(self, data: bytes, addr):
+        ip, port = addr[0], addr[1]
+        if data.startswith(FRAG_PREFIX):
+            data = self._reassembler.feed(data, ip, port)
+            if data is None:
+                return
+        if self._inbox.full():
+            self.rx_dropped += 1
+            return
+        self._inbox.put_nowait((data, ip, port))
 
-    def recv(self, bufsize: int = 4096):
+    async def recv_packet(self):
         """
-        Blocking receive.
+        Next whole packet as bytes, text or binary. Fragments are buffered
+        until their message is complete, so callers only see whole packets.
 
         Returns:
-            message (str), sender_ip (str), sender_port (int)
+            data (bytes), sender_ip (str), sender_port (int)
         """
-        data, (ip, port) = self.sock.recvfrom(bufsize)
-        message = data.decode("utf-8", errors="ignore")
-        return message, ip, port
+        return await self._inbox.get()
+
+    def _buffer_sizes(self):
+        try:
+            return (
+                self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+                self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+            )
+        except OSError:
+            return None, None
+
+    def stats(self):
+        rcvbuf, sndbuf = self._buffer_sizes()
+        stats = {
+            "batch_io": self.batch_io,
+            "rcvbuf": rcvbuf,
+            "sndbuf": sndbuf,
+            "fragmented_sent": self.fragmented_sent,
+            "fragments_sent": self.fragments_sent,
+            "rx_datagrams": self.rx_datagrams,
+            "rx_batches": self.rx_batches,
+            "rx_truncated": self.rx_truncated,
+            "rx_queued": self._inbox.qsize() if self._inbox else 0,
+            "rx_dropped": self.rx_dropped,
+            # Datagrams the kernel discarded because the receive buffer
+            # was full (Linux with batch_io only, None elsewhere).
+            "kernel_drops": sum(self._kernel_drops.values()) if self._ancbufsize and self.batch_io else None,
+            "tx_batches": self.tx_batches,
+            "tx_deferred": self.tx_deferred,
+            "tx_backlog": len(self._tx_backlog),
+            "tx_dropped": self.tx_dropped,
+            "send_errors": self.send_errors,
+            "multicast_group": self.multicast_group,
+        }
+        stats.update(self._reassembler.stats())
+        return stats
 
     def close(self):
         """
-        Close the UDP socket.
+        Close the UDP socket(s).
         """
-        self.sock.close()
+        if self._loop is None:
+            self._close_sockets()
+        elif threading.get_ident() == self._loop_thread:
+            self._close_endpoints()
+        else:
+            self._loop.call_soon_threadsafe(self._close_endpoints)
+
+    def _close_endpoints(self):
+        if self._closed:
+            return
+        if self._endpoint is not None:
+            self._endpoint.close()
+            if self._group_endpoint is not None:
+                self._group_endpoint.close()
+            self._closed = True
+            return
+        for fd in self._readers:
+            self._loop.remove_reader(fd)
+        if self._tx_backlog:
+            self._loop.remove_writer(self.sock.fileno())
+            self._tx_backlog.clear()
+        self._close_sockets()
+
+    def _close_sockets(self):
+        self._closed = True
+        for sock in self._sockets:
+            sock.close()
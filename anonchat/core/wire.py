@@ -0,0 +1,127 @@
+# core/wire.py
+
+import struct
+
+# Binary framing (version 1), all integers big-endian:
+#
+#   magic(2) version(1) type(1) sender_len(1) sender_id
+#   ENC: nonce(12) ciphertext
+#   GRP: room_len(1) room_id epoch(4) nonce(12) ciphertext
+#
+# Text packets start with an ASCII type ("GM ", "ENC ", ...); 0xAC is never
+# the first byte of UTF-8 text, so the two formats can share one socket.
+MAGIC = b"\xacC"
+VERSION = 1
+CAPABILITY = "wire1"
+
+TYPE_ENC = 1
+TYPE_GRP = 2
+
+NONCE_LEN = 12
+
+_HEADER = struct.Struct("!2sBBB")
+_EPOCH = struct.Struct("!I")
+
+
+class WireError(ValueError):
+    """
+    Raised for truncated, unknown-version or malformed binary packets.
+    """
+
+
+class Packet:
+    """
+    Parsed binary packet. nonce and ciphertext are memoryview slices of the
+    receive buffer, so nothing is copied until the AEAD reads them.
+    """
+
+    __slots__ = ("type", "sender_id", "room_id", "epoch", "nonce", "ciphertext")
+
+    def __init__(self, type, sender_id, nonce, ciphertext, room_id=None, epoch=0):
+        self.type = type
+        self.sender_id = sender_id
+        self.room_id = room_id
+        self.epoch = epoch
+        self.nonce = nonce
+        self.ciphertext = ciphertext
+
+
+def is_binary(data) -> bool:
+    return data[:2] == MAGIC
+
+
+def _short_field(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if len(raw) > 255:
+        raise WireError("Field too long")
+    return bytes((len(raw),)) + raw
+
+
+def encode_enc(sender_id: str, nonce: bytes, ciphertext: bytes) -> bytes:
+    sender = sender_id.encode("ascii")
+    return b"".join((
+        _HEADER.pack(MAGIC, VERSION, TYPE_ENC, len(sender)),
+        sender,
+        nonce,
+        ciphertext,
+    ))
+
+
+def encode_grp(sender_id: str, room_id: str, epoch: int, nonce: bytes, ciphertext: bytes) -> bytes:
+    sender = sender_id.encode("ascii")
+    return b"".join((
+        _HEADER.pack(MAGIC, VERSION, TYPE_GRP, len(sender)),
+        sender,
+        _short_field(room_id),
+        _EPOCH.pack(epoch),
+        nonce,
+        ciphertext,
+    ))
+
+
+def parse(buf) -> Packet:
+    """
+    Parse a binary packet from bytes or a memoryview.
+    """
+    view = memoryview(buf)
+    if len(view) < _HEADER.size:
+        raise WireError("Truncated header")
+    magic, version, ptype, sender_len = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise WireError("Bad magic")
+    if version != VERSION:
+        raise WireError(f"Unsupported wire version {version}")
+
+    pos = _HEADER.size
+    sender_id = _read_str(view, pos, sender_len)
+    pos += sender_len
+
+    room_id = None
+    epoch = 0
+    if ptype == TYPE_GRP:
+        if pos >= len(view):
+            raise WireError("Truncated room id")
+        room_len = view[pos]
+        room_id = _read_str(view, pos + 1, room_len)
+        pos += 1 + room_len
+        if pos + _EPOCH.size > len(view):
+            raise WireError("Truncated epoch")
+        (epoch,) = _EPOCH.unpack_from(view, pos)
+        pos += _EPOCH.size
+    elif ptype != TYPE_ENC:
+        raise WireError(f"Unknown packet type {ptype}")
+
+    if pos + NONCE_LEN >= len(view):
+        raise WireError("Truncated ciphertext")
+    nonce = view[pos:pos + NONCE_LEN]
+    ciphertext = view[pos + NONCE_LEN:]
+    return Packet(ptype, sender_id, nonce, ciphertext, room_id=room_id, epoch=epoch)
+
+
+def _read_str(view, pos: int, length: int) -> str:
+    if pos + length > len(view):
+        raise WireError("Truncated field")
+    try:
+        return bytes(view[pos:pos + length]).decode("utf-8")
+    except UnicodeDecodeError as exc:
+        raise WireError("Invalid field encoding") from exc
@@ -1,9 +1,81 @@
 # anonchat/messaging/chat.py
 
+import asyncio
 import os
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from anonchat.core import wire
+from anonchat.core.crypto import encode_blob
+from anonchat.messaging import reliability
+from anonchat.messaging.reliability import ReliableChannel
 
 DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
 
+# Opener result for packets handled internally (nothing to deliver).
+_CONSUMED = (None, ())
+
+
+class _Shard:
+    """
+    One receive lane: a bounded queue on the network loop drained by a
+    single worker thread, so one sender's packets are handled in order.
+    """
+
+    def __init__(self, index: int, capacity: int):
+        self.index = index
+        self.capacity = capacity
+        # (opener, sender_id, payload, ip)
+        self.queue = deque()
+        # sender_id -> packets queued
+        self.pending = Counter()
+        self.wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"anonchat-rx{index}")
+        self.dropped = 0
+        self.rejected = 0
+        self.delivered = 0
+
+    def push(self, item):
+        self.queue.append(item)
+        self.pending[item[1]] += 1
+        self.wakeup.set()
+
+    def take(self, limit: int):
+        batch = []
+        while self.queue and len(batch) < limit:
+            item = self.queue.popleft()
+            self._release(item[1])
+            batch.append(item)
+        return batch
+
+    def evict(self, sender_id: str | None = None) -> bool:
+        """
+        Drop the oldest queued packet (of sender_id, if given).
+        """
+        for index, item in enumerate(self.queue):
+            if sender_id is None or item[1] == sender_id:
+                del self.queue[index]
+                self._release(item[1])
+                self.dropped += 1
+                return True
+        return False
+
+    def _release(self, sender_id: str):
+        self.pending[sender_id] -= 1
+        if not self.pending[sender_id]:
+            del self.pending[sender_id]
+
+    def stats(self):
+        return {
+            "queued": len(self.queue),
+            "capacity": self.capacity,
+            "senders": len(self.pending),
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "delivered": self.delivered,
+        }
+
 
 class Chat:
     """
@@ -11,67 +83,232 @@ class Chat:
 
     Message format:
       ENC <sender_id> <ciphertext>
+      GRP <sender_id> <room_id> <key_epoch> <ciphertext>   (room key)
+
+    Peers that advertise "wire1" get the same packets in the binary
+    framing from core/wire.py (raw nonce and ciphertext, no base64).
 
     Responsibilities:
     - Encrypt messages before sending
     - Decrypt messages on receive
     - Use discovery for peer lookup
 
+    Receive pipeline:
+      discovery (network loop: read + classify) -> shard queue by sender id
+      -> shard worker thread (decrypt, on_message: room control, SQLite)
+    Each sender maps to one of `workers` shards, so a peer's packets are
+    handled in arrival order while different peers run in parallel. A
+    slow callback or a flooding peer only backs up its own shard, never
+    packet reception or discovery.
+
+    Drop policy when a shard (or one sender's share of it) is full:
+      "newest"  drop the arriving packet (default)
+      "oldest"  drop the oldest queued packet from the same sender, or
+                from the shard when the sender has none queued
+
+    Reliable delivery (reliable=True): pairwise messages to peers that
+    advertise "rel1" carry a sequence number and are acknowledged,
+    retransmitted and de-duplicated by a ReliableChannel
+    (messaging/reliability.py); on_receipt reports "delivered" or
+    "failed". Room-key (GRP) messages stay best-effort.
+
     Non-responsibilities:
     - No key exchange logic
     - No CLI
     """
 
-    def __init__(self, transport, discovery, identity, port: int):
+    # Rooms with at least this many reachable members get one broadcast
+    # datagram instead of a unicast copy per member.
+    GROUP_BROADCAST_MIN = 8
+
+    RX_WORKERS = 4
+    DROP_POLICIES = ("newest", "oldest")
+    SHARD_QUEUE_SIZE = 1024
+    # Packets one sender may have queued in its shard, so a burst from one
+    # peer cannot crowd out the others that share it.
+    PEER_BACKLOG = 512
+    # Packets handed to a shard thread per hop.
+    RX_BATCH = 64
+
+    def __init__(
+        self,
+        transport,
+        discovery,
+        identity,
+        port: int,
+        workers: int = RX_WORKERS,
+        drop_policy: str = "newest",
+        reliable: bool = True,
+    ):
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
         self.transport = transport
         self.discovery = discovery
         self.identity = identity
         self.port = port
+        self.workers = max(1, workers)
+        self.drop_policy = drop_policy
         self.running = False
         self.on_message = None
+        self.on_group_message = None
+        self._shards = []
+        self._tasks = []
+        self.reliability = ReliableChannel(self._send_plain) if reliable else None
 
-    def start(self, on_message):
+    def start(self, on_message, on_group_message=None):
         """
-        Start listening for incoming messages.
+        Start listening for incoming messages. Must be called on the
+        network loop.
 
         on_message(sender_id: str, message: str)
+        on_group_message(sender_id: str, room_id: str, key_epoch: int, message: str)
         """
         self.on_message = on_message
+        self.on_group_message = on_group_message
         self.running = True
+        loop = asyncio.get_running_loop()
+        self._shards = [_Shard(index, self.SHARD_QUEUE_SIZE) for index in range(self.workers)]
+        self._tasks = [loop.create_task(self._shard_worker(shard)) for shard in self._shards]
+        if self.reliability:
+            self._tasks.append(loop.create_task(self.reliability.run()))
+            self.discovery.add_capability(reliability.CAPABILITY)
         self.discovery.set_enc_handler(self._handle_enc)
+        self.discovery.set_group_handler(self._handle_group)
 
-    def stop(self):
+    async def stop(self):
         self.running = False
         self.discovery.set_enc_handler(None)
+        self.discovery.set_group_handler(None)
+        for task in self._tasks:
+            task.cancel()
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for task, result in zip(self._tasks, results):
+            if isinstance(result, Exception) and DEBUG:
+                print(f"[chat] task {task.get_coro().__name__} had failed: {result!r}")
+        self._tasks = []
+        for shard in self._shards:
+            shard.executor.shutdown(wait=False)
+        if self.reliability:
+            # Nothing will retransmit or receive ACKs any more.
+            self.reliability.close()
 
-    def send_to_peer(self, peer_id: str, message: str):
-        peers = self.discovery.get_peers()
-        if peer_id not in peers:
+    def stats(self):
+        shards = [shard.stats() for shard in self._shards]
+        return {
+            "workers": self.workers,
+            "drop_policy": self.drop_policy,
+            "queued": sum(shard["queued"] for shard in shards),
+            "dropped": sum(shard["dropped"] for shard in shards),
+            "rejected": sum(shard["rejected"] for shard in shards),
+            "delivered": sum(shard["delivered"] for shard in shards),
+            "shards": shards,
+            "reliability": self.reliability.stats() if self.reliability else None,
+        }
+
+    def send_to_peer(self, peer_id: str, message: str, on_receipt=None):
+        peer = self.discovery.get_peer(peer_id)
+        if peer is None:
             raise ValueError("Unknown peer")
+        if self.reliable_for(peer_id):
+            message = self.reliability.submit(peer_id, message, on_receipt)
+            if message is None:
+                return
+        self._send(peer, message)
 
-        ip, _, peer_pub_key, _ = peers[peer_id]
+    def reliable_for(self, peer_id: str) -> bool:
+        return self.reliability is not None and self.discovery.has_capability(
+            peer_id, reliability.CAPABILITY
+        )
 
+    def _send_plain(self, peer_id: str, message: str) -> bool:
+        # Used by the reliable channel for ACKs and retransmissions.
+        peer = self.discovery.get_peer(peer_id)
+        if peer is None:
+            return False
+        self._send(peer, message)
+        return True
+
+    def _send(self, peer, message: str):
+        self.transport.send_bytes(self.seal(peer, message), peer.ip, self.port)
+
+    def seal(self, peer, message: str) -> bytes:
+        """
+        Encrypt a message for one peer; returns the packet to send.
+        """
         # Register peer key (no-op if already known)
-        self.identity.crypto.register_peer(peer_id, peer_pub_key)
+        self.identity.crypto.register_peer(peer.peer_id, peer.pub_key)
 
-        ciphertext = self.identity.crypto.encrypt(peer_id, message)
+        if self.discovery.binary_wire(peer.peer_id):
+            nonce, ct = self.identity.crypto.encrypt_raw(peer.peer_id, message)
+            return wire.encode_enc(self.identity.anon_id, nonce, ct)
+
+        ciphertext = self.identity.crypto.encrypt(peer.peer_id, message)
 
         payload = f"ENC {self.identity.anon_id} {ciphertext}"
-        self.transport.send(payload, ip, self.port)
+        return payload.encode("utf-8")
 
-    def send_to_all(self, message: str) -> int:
+    def send_group(self, room_id: str, peer_ids, message: str) -> int:
+        """
+        Seal a room message once with the room key and send it to every
+        listed member. Returns the number of members that were reachable.
+        """
         peers = self.discovery.get_peers()
-        count = 0
+        members = [peers[peer_id] for peer_id in peer_ids if peer_id in peers]
+        if not members:
+            return 0
+
+        sealed = self.seal_group(room_id, message)
+        binary = {peer.peer_id for peer in members if self.discovery.binary_wire(peer.peer_id)}
+        packet, text = sealed
+
+        if len(members) >= self.GROUP_BROADCAST_MIN:
+            # One broadcast reaches everyone; fall back to text unless all
+            # members read binary.
+            data = packet if len(binary) == len(members) else text
+            self.transport.send_bytes(data, self.discovery.broadcast_ip, self.port)
+            return len(members)
+
+        batch = {}
+        for peer in members:
+            if peer.ip not in batch:
+                batch[peer.ip] = (packet if peer.peer_id in binary else text, peer.ip, self.port)
+        self.transport.send_batch(batch.values())
+        return len(members)
 
-        for peer_id in peers.keys():
-            self.send_to_peer(peer_id, message)
-            count += 1
+    def seal_group(self, room_id: str, message: str):
+        """
+        Seal a room message once with the room key. Returns the same
+        message as (binary packet, text packet); see group_packet().
+        """
+        sender_id = self.identity.anon_id
+        key_epoch, nonce, ct = self.identity.crypto.encrypt_group_raw(sender_id, room_id, message)
+        packet = wire.encode_grp(sender_id, room_id, key_epoch, nonce, ct)
+        text = f"GRP {sender_id} {room_id} {key_epoch} {encode_blob(nonce, ct)}".encode("utf-8")
+        return packet, text
 
-        return count
+    def group_packet(self, peer_id: str, sealed) -> bytes:
+        packet, text = sealed
+        return packet if self.discovery.binary_wire(peer_id) else text
+
+    def send_to_all(self, message: str) -> int:
+        peers = self.discovery.get_peers()
+        self.transport.send_batch(
+            [(self.seal(peer, message), peer.ip, self.port) for peer in peers.values()]
+        )
+        return len(peers)
 
     # ---------------- internal ----------------
 
-    def _handle_enc(self, sender_id: str, ciphertext: str, ip: str):
+    def _handle_enc(self, sender_id: str, ciphertext, ip: str):
+        self._dispatch(self._open_enc, sender_id, ciphertext, ip)
+
+    def _handle_group(self, sender_id: str, payload, ip: str):
+        self._dispatch(self._open_group, sender_id, payload, ip)
+
+    def _shard_for(self, sender_id: str) -> _Shard:
+        return self._shards[zlib.crc32(sender_id.encode("utf-8")) % len(self._shards)]
+
+    def _dispatch(self, opener, sender_id: str, payload, ip: str):
         if not self.running:
             return
 
@@ -79,24 +316,123 @@ class Chat:
         if sender_id == self.identity.anon_id:
             return
 
-        peers = self.discovery.get_peers()
-        if sender_id not in peers:
-            if DEBUG:
-                print(f"[chat] drop ENC from {sender_id} ({ip}): unknown peer")
-            return
+        shard = self._shard_for(sender_id)
+        if shard.pending[sender_id] >= self.PEER_BACKLOG:
+            if self.drop_policy == "newest" or not shard.evict(sender_id):
+                shard.dropped += 1
+                if DEBUG:
+                    print(f"[chat] drop packet from {sender_id} ({ip}): peer backlog full")
+                return
+        elif len(shard.queue) >= shard.capacity:
+            if self.drop_policy == "newest" or not (shard.evict(sender_id) or shard.evict()):
+                shard.dropped += 1
+                if DEBUG:
+                    print(f"[chat] drop packet from {sender_id} ({ip}): shard {shard.index} full")
+                return
+        shard.push((opener, sender_id, payload, ip))
+
+    async def _shard_worker(self, shard: _Shard):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not shard.queue:
+                shard.wakeup.clear()
+                await shard.wakeup.wait()
+                continue
+            batch = shard.take(self.RX_BATCH)
+            try:
+                await loop.run_in_executor(shard.executor, self._process_batch, shard, batch)
+            except Exception as exc:
+                # One bad batch must not silence every peer on this shard.
+                if DEBUG:
+                    print(f"[chat] shard {shard.index} batch failed: {exc!r}")
 
-        _, _, sender_pub_key, _ = peers[sender_id]
+    def _process_batch(self, shard: _Shard, batch):
+        # Runs on the shard's thread.
+        for opener, sender_id, payload, ip in batch:
+            try:
+                delivery = opener(sender_id, payload, ip)
+            except Exception as exc:
+                if DEBUG:
+                    print(f"[chat] drop packet from {sender_id} ({ip}): {exc!r}")
+                delivery = None
+            if delivery is None:
+                shard.rejected += 1
+                continue
+            callback, args = delivery
+            if callback is None:
+                # Consumed by the reliable channel (ACK or duplicate).
+                continue
+            try:
+                callback(*args)
+            except Exception as exc:
+                if DEBUG:
+                    print(f"[chat] delivery callback failed: {exc!r}")
+            shard.delivered += 1
+        if self.reliability:
+            self.reliability.flush_acks()
 
-        # Register peer key if needed
-        self.identity.crypto.register_peer(sender_id, sender_pub_key)
+    def _open_enc(self, sender_id: str, ciphertext, ip: str):
+        peer = self.discovery.get_peer(sender_id)
+        if peer is None:
+            if DEBUG:
+                print(f"[chat] drop ENC from {sender_id} ({ip}): unknown peer")
+            return None
 
         try:
-            plaintext = self.identity.crypto.decrypt(sender_id, ciphertext)
+            # Register peer key if needed; a malformed beacon key fails here.
+            self.identity.crypto.register_peer(sender_id, peer.pub_key)
+            if isinstance(ciphertext, wire.Packet):
+                plaintext = self.identity.crypto.decrypt_raw(
+                    sender_id, ciphertext.nonce, ciphertext.ciphertext
+                )
+            else:
+                plaintext = self.identity.crypto.decrypt(sender_id, ciphertext)
         except Exception:
             # Decryption failed (tampered / wrong key)
             if DEBUG:
                 print(f"[chat] drop ENC from {sender_id} ({ip}): decrypt failed")
-            return
+            return None
+
+        if self.reliability:
+            if plaintext.startswith(reliability.ACK_PREFIX):
+                self.reliability.on_ack(sender_id, plaintext[len(reliability.ACK_PREFIX):])
+                return _CONSUMED
+            if plaintext.startswith(reliability.DATA_PREFIX):
+                plaintext = self.reliability.on_data(sender_id, plaintext[len(reliability.DATA_PREFIX):])
+                if plaintext is None:
+                    return _CONSUMED
+
+        if not self.on_message:
+            return None
+        return self.on_message, (sender_id, plaintext)
+
+    def _open_group(self, sender_id: str, payload, ip: str):
+        if not self.on_group_message:
+            return None
+
+        peer = self.discovery.get_peer(sender_id)
+        if peer is None:
+            if DEBUG:
+                print(f"[chat] drop GRP from {sender_id} ({ip}): unknown peer")
+            return None
+
+        try:
+            self.identity.crypto.register_peer(sender_id, peer.pub_key)
+            if isinstance(payload, wire.Packet):
+                room_id, key_epoch = payload.room_id, payload.epoch
+                plaintext = self.identity.crypto.decrypt_group_raw(
+                    sender_id, room_id, key_epoch, payload.nonce, payload.ciphertext
+                )
+            else:
+                room_id, key_epoch, ciphertext = payload.rsplit(" ", 2)
+                key_epoch = int(key_epoch)
+                plaintext = self.identity.crypto.decrypt_group(
+                    sender_id, room_id, key_epoch, ciphertext
+                )
+        except Exception:
+            # Not a member of that room, stale key, replay or tampered
+            if DEBUG:
+                print(f"[chat] drop GRP from {sender_id} ({ip}): decrypt failed")
+            return None
 
-        if self.on_message:
-            self.on_message(sender_id, plaintext)
+        return self.on_group_message, (sender_id, room_id, key_epoch, plaintext)
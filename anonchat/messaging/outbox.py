@@ -0,0 +1,404 @@
+# anonchat/messaging/outbox.py
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
+
+# Send priorities: control traffic (room joins, keys, announcements) is
+# always serviced before chat traffic.
+CONTROL = 0
+CHAT = 1
+
+# Per-recipient delivery states.
+QUEUED = "queued"
+SENT = "sent"            # handed to the socket
+DELIVERED = "delivered"  # acknowledged by the peer (reliable peers only)
+FAILED = "failed"        # unknown peer, sealing error or never acknowledged
+DROPPED = "dropped"      # queue full (backpressure)
+
+# Queue key for one broadcast datagram that covers a whole room.
+_BROADCAST = "*"
+
+# _packet_for() result when the reliable channel took the message but
+# its window is full: it is sent later and is not SENT yet.
+_DEFERRED = "deferred"
+
+
+class Delivery:
+    """
+    Per-recipient status of one outbound message.
+    """
+
+    def __init__(self, message_id=None):
+        self.message_id = message_id
+        self.created = time.time()
+        # peer_id -> QUEUED | SENT | DELIVERED | FAILED | DROPPED
+        self.recipients = {}
+        self.errors = {}
+
+    def set(self, peer_id: str, status: str, error: str | None = None):
+        # A receipt can beat the sender thread's SENT update.
+        if status == SENT and self.recipients.get(peer_id) in (DELIVERED, FAILED):
+            return
+        self.recipients[peer_id] = status
+        if error:
+            self.errors[peer_id] = error
+
+    def counts(self):
+        counts = {}
+        for status in list(self.recipients.values()):
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def serialize(self):
+        return {
+            "id": self.message_id,
+            "created": self.created,
+            "recipients": dict(self.recipients),
+            "errors": dict(self.errors),
+            "counts": self.counts(),
+        }
+
+
+class _Job:
+    """
+    One message queued for one or more recipients. Room messages are
+    sealed once, on first use, and every recipient's queue shares it.
+    """
+
+    __slots__ = ("kind", "message", "room_id", "delivery", "sealed", "sent_ips", "members")
+
+    def __init__(self, kind: str, message: str, delivery: Delivery, room_id: str | None = None):
+        self.kind = kind            # "direct" | "group" | "broadcast"
+        self.message = message
+        self.room_id = room_id
+        self.delivery = delivery
+        self.sealed = None
+        self.sent_ips = set()
+        self.members = ()
+
+
+class Outbox:
+    """
+    Per-peer outbound queues serviced by one sender thread.
+
+    Callers (HTTP handlers, room control) only enqueue; encryption and
+    sendto happen on the sender thread, so a request never waits on N
+    encryptions. Each peer has a control and a chat queue; every pass
+    drains control traffic first, then takes chat round-robin across
+    peers so one large fanout cannot starve the others.
+
+    Backpressure: a peer's chat queue holds at most PEER_QUEUE_SIZE
+    messages and the outbox at most MAX_PENDING; beyond that new
+    recipients are marked DROPPED. saturated() lets callers refuse work
+    up front instead.
+    """
+
+    # Priorities, for callers that only hold the Outbox instance.
+    CONTROL = CONTROL
+    CHAT = CHAT
+
+    PEER_QUEUE_SIZE = 256
+    MAX_PENDING = 8192
+    # Packets sealed per pass and handed to the transport in one batch.
+    SEND_BATCH = 64
+    # Deliveries kept for status lookups.
+    HISTORY = 1024
+    # Recent receipts kept for receipts_since().
+    RECEIPT_LOG = 256
+
+    def __init__(self, chat=None, on_receipt=None):
+        self.chat = chat
+        # Called with the Delivery whenever a recipient acknowledges (or
+        # finally fails to acknowledge) a reliable message.
+        self._on_receipt = on_receipt
+        self._cond = threading.Condition()
+        # peer_id -> (control deque, chat deque) of _Job
+        self._queues = {}
+        # Peers with queued work, per priority, in round-robin order.
+        self._ready = (deque(), deque())
+        self._pending = 0
+        self._deliveries = OrderedDict()
+        self._receipt_seq = 0
+        self._receipt_log = deque(maxlen=self.RECEIPT_LOG)
+        self._thread = None
+        self.running = False
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        if self._thread:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._sender_loop, name="anonchat-send", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        # Nothing will send what is still queued; say so instead of
+        # leaving those recipients QUEUED forever.
+        with self._cond:
+            leftover = [
+                (peer_id, job)
+                for peer_id, queues in self._queues.items()
+                for queue in queues
+                for job in queue
+            ]
+            self._queues.clear()
+            for ready in self._ready:
+                ready.clear()
+            self._pending = 0
+        for peer_id, job in leftover:
+            self._fail(peer_id, job, "outbox closed")
+
+    def update_chat(self, chat):
+        """
+        Point at a new Chat (after an interface switch). Queued messages
+        are sent through it.
+        """
+        with self._cond:
+            self.chat = chat
+            self._cond.notify_all()
+
+    # ---------------- enqueue ----------------
+
+    def saturated(self) -> bool:
+        return self._pending >= self.MAX_PENDING
+
+    def new_delivery(self, message_id=None) -> Delivery:
+        delivery = Delivery(message_id)
+        if message_id is not None:
+            with self._cond:
+                self._deliveries[message_id] = delivery
+                while len(self._deliveries) > self.HISTORY:
+                    self._deliveries.popitem(last=False)
+        return delivery
+
+    def get_delivery(self, message_id) -> Delivery | None:
+        with self._cond:
+            return self._deliveries.get(message_id)
+
+    def receipt_cursor(self) -> int:
+        with self._cond:
+            return self._receipt_seq
+
+    def receipts_since(self, cursor: int):
+        """
+        Deliveries (with a message id) that got a receipt after `cursor`.
+        Returns (new cursor, [Delivery]).
+        """
+        with self._cond:
+            changed = {}
+            for seq, delivery in self._receipt_log:
+                if seq > cursor and delivery.message_id is not None:
+                    changed[delivery.message_id] = delivery
+            return self._receipt_seq, list(changed.values())
+
+    def send_to_peer(self, peer_id: str, message: str, priority: int = CHAT, delivery: Delivery | None = None):
+        delivery = delivery or Delivery()
+        self._enqueue(_Job("direct", message, delivery), [peer_id], priority)
+        return delivery
+
+    def send_to_all(self, message: str, priority: int = CHAT, delivery: Delivery | None = None):
+        delivery = delivery or Delivery()
+        chat = self.chat
+        peer_ids = list(chat.discovery.get_peers()) if chat else []
+        self._enqueue(_Job("direct", message, delivery), peer_ids, priority)
+        return delivery
+
+    def send_group(self, room_id: str, peer_ids, message: str, delivery: Delivery | None = None):
+        """
+        Room message sealed once with the room key. When at least
+        Chat.GROUP_BROADCAST_MIN members are reachable it goes out as a
+        single broadcast.
+        """
+        delivery = delivery or Delivery()
+        chat = self.chat
+        peers = chat.discovery.get_peers() if chat else {}
+        reachable = []
+        for peer_id in peer_ids:
+            if peer_id in peers:
+                reachable.append(peer_id)
+            else:
+                delivery.set(peer_id, FAILED, "Unknown peer")
+                self.failed += 1
+        peer_ids = reachable
+        if chat and len(peer_ids) >= chat.GROUP_BROADCAST_MIN:
+            job = _Job("broadcast", message, delivery, room_id)
+            job.members = tuple(peer_ids)
+            for peer_id in peer_ids:
+                delivery.set(peer_id, QUEUED)
+            self._enqueue(job, [_BROADCAST], CHAT, track=False)
+            return delivery
+        self._enqueue(_Job("group", message, delivery, room_id), peer_ids, CHAT)
+        return delivery
+
+    def _enqueue(self, job: _Job, peer_ids, priority: int, track: bool = True):
+        with self._cond:
+            for peer_id in peer_ids:
+                queues = self._queues.get(peer_id)
+                if queues is None:
+                    queues = self._queues[peer_id] = (deque(), deque())
+                queue = queues[priority]
+                full = self._pending >= self.MAX_PENDING or (
+                    priority == CHAT and len(queue) >= self.PEER_QUEUE_SIZE
+                )
+                if full:
+                    if not queues[0] and not queues[1]:
+                        del self._queues[peer_id]
+                    self.dropped += 1
+                    if track:
+                        job.delivery.set(peer_id, DROPPED, "send queue full")
+                    else:
+                        for member in job.members:
+                            job.delivery.set(member, DROPPED, "send queue full")
+                    continue
+                if track:
+                    job.delivery.set(peer_id, QUEUED)
+                if not queue:
+                    self._ready[priority].append(peer_id)
+                queue.append(job)
+                self._pending += 1
+            self._cond.notify()
+
+    # ---------------- sender thread ----------------
+
+    def _take(self):
+        """
+        Next batch of (peer_id, job): control first, then chat, one item
+        per peer per turn.
+        """
+        batch = []
+        for priority in (CONTROL, CHAT):
+            ready = self._ready[priority]
+            while ready and len(batch) < self.SEND_BATCH:
+                peer_id = ready.popleft()
+                queue = self._queues[peer_id][priority]
+                batch.append((peer_id, queue.popleft()))
+                self._pending -= 1
+                if queue:
+                    ready.append(peer_id)
+                elif not self._queues[peer_id][1 - priority]:
+                    del self._queues[peer_id]
+        return batch
+
+    def _sender_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self.running or (self._pending and self.chat))
+                if not self.running:
+                    return
+                chat = self.chat
+                batch = self._take()
+            self._send_batch(chat, batch)
+
+    def _send_batch(self, chat, batch):
+        packets = []
+        sent = []
+        for peer_id, job in batch:
+            try:
+                packet = self._packet_for(chat, peer_id, job)
+            except Exception as exc:
+                self._fail(peer_id, job, str(exc) or exc.__class__.__name__)
+                continue
+            if packet is _DEFERRED:
+                continue
+            if packet is None:
+                sent.append((peer_id, job))
+                continue
+            packets.append(packet)
+            sent.append((peer_id, job))
+
+        try:
+            chat.transport.send_batch(packets)
+        except Exception as exc:
+            if DEBUG:
+                print(f"[outbox] send failed: {exc!r}")
+            for peer_id, job in sent:
+                self._fail(peer_id, job, "send failed")
+        else:
+            for peer_id, job in sent:
+                if job.kind == "broadcast":
+                    for member in job.members:
+                        job.delivery.set(member, SENT)
+                    self.sent += len(job.members)
+                else:
+                    job.delivery.set(peer_id, SENT)
+                    self.sent += 1
+        self.batches += 1
+
+    def _packet_for(self, chat, peer_id: str, job: _Job):
+        """
+        (data, ip, port) for one recipient, None when an earlier
+        recipient on the same host already covers it, or _DEFERRED when
+        the reliable channel will send it later.
+        """
+        if job.kind == "broadcast":
+            if job.sealed is None:
+                job.sealed = chat.seal_group(job.room_id, job.message)
+            binary = all(chat.discovery.binary_wire(member) for member in job.members)
+            return job.sealed[0] if binary else job.sealed[1], chat.discovery.broadcast_ip, chat.port
+
+        peer = chat.discovery.get_peer(peer_id)
+        if peer is None:
+            raise ValueError("Unknown peer")
+        if job.kind == "direct":
+            message = job.message
+            if chat.reliable_for(peer_id):
+                message = chat.reliability.submit(peer_id, message, self._receipt(job.delivery, peer_id))
+                if message is None:
+                    # Window full: the reliable channel sends it later.
+                    return _DEFERRED
+            return chat.seal(peer, message), peer.ip, chat.port
+
+        if job.sealed is None:
+            job.sealed = chat.seal_group(job.room_id, job.message)
+        if peer.ip in job.sent_ips:
+            return None
+        job.sent_ips.add(peer.ip)
+        return chat.group_packet(peer_id, job.sealed), peer.ip, chat.port
+
+    def _receipt(self, delivery: Delivery, peer_id: str):
+        def on_receipt(status: str):
+            delivery.set(peer_id, status, "no acknowledgement" if status == FAILED else None)
+            with self._cond:
+                self._receipt_seq += 1
+                self._receipt_log.append((self._receipt_seq, delivery))
+            if self._on_receipt:
+                self._on_receipt(delivery)
+
+        return on_receipt
+
+    def _fail(self, peer_id: str, job: _Job, error: str):
+        members = job.members if job.kind == "broadcast" else (peer_id,)
+        for member in members:
+            job.delivery.set(member, FAILED, error)
+        self.failed += len(members)
+        if DEBUG:
+            print(f"[outbox] {job.kind} to {peer_id} failed: {error}")
+
+    def stats(self):
+        with self._cond:
+            control = sum(len(queues[CONTROL]) for queues in self._queues.values())
+            return {
+                "pending": self._pending,
+                "control_queued": control,
+                "chat_queued": self._pending - control,
+                "peers_queued": len(self._queues),
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "batches": self.batches,
+            }
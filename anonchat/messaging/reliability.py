@@ -0,0 +1,353 @@
+# anonchat/messaging/reliability.py
+
+import asyncio
+import heapq
+import os
+import threading
+import time
+
+DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
+
+# Advertised in CAPS; envelopes are only sent to peers that list it, since
+# older clients would show them as chat text.
+CAPABILITY = "rel1"
+
+# Both travel inside ENC plaintext, like ROOMCTL::, so they are sealed and
+# authenticated with the message itself.
+#   REL::<session>:<seq>::<message>
+#   RACK::<session>:<cumulative>[:<seq>,<seq>,...]
+DATA_PREFIX = "REL::"
+ACK_PREFIX = "RACK::"
+
+# Receipt states passed to on_receipt.
+DELIVERED = "delivered"
+FAILED = "failed"
+
+
+class _Pending:
+    __slots__ = ("seq", "envelope", "on_receipt", "sent_at", "deadline", "tries")
+
+    def __init__(self, seq: int, envelope: str, on_receipt):
+        self.seq = seq
+        self.envelope = envelope
+        self.on_receipt = on_receipt
+        self.sent_at = 0.0
+        self.deadline = 0.0
+        self.tries = 0
+
+
+class _Outgoing:
+    __slots__ = ("next_seq", "unacked", "backlog", "srtt", "rttvar", "rto")
+
+    def __init__(self, rto: float):
+        self.next_seq = 1
+        # seq -> _Pending, at most WINDOW entries
+        self.unacked = {}
+        # (message, on_receipt) waiting for window space
+        self.backlog = []
+        self.srtt = None
+        self.rttvar = None
+        self.rto = rto
+
+
+class _Incoming:
+    __slots__ = ("session", "cumulative", "sacks", "ack_due")
+
+    def __init__(self, session: str):
+        self.session = session
+        # Every seq <= cumulative has been received.
+        self.cumulative = 0
+        # Received seqs above cumulative (gaps still open).
+        self.sacks = set()
+        self.ack_due = False
+
+
+class ReliableChannel:
+    """
+    Optional ordered-ID, acknowledged delivery on top of ENC datagrams.
+
+    Sender: every message gets a per-peer sequence number inside a session
+    (random per channel, so a restarted sender is not mistaken for
+    duplicates). At most WINDOW messages per peer are unacknowledged; the
+    rest wait in a backlog. Unacknowledged messages are re-sealed and
+    resent when their RTO expires (RFC 6298 estimator, Karn's rule,
+    exponential backoff) and fail after MAX_RETRIES.
+
+    Receiver: duplicates are suppressed by (session, seq) and every
+    receipt, duplicate or not, schedules one coalesced ACK per peer that
+    carries the cumulative seq plus up to SACK_MAX selective seqs.
+
+    send(peer_id, plaintext) -> bool seals and transmits one ENC packet.
+    Retransmission runs in run() on the network loop; everything else is
+    thread-safe.
+    """
+
+    WINDOW = 32
+    BACKLOG = 1024
+    RTO_INITIAL = 0.2      # seconds, before the first RTT sample
+    RTO_MIN = 0.02
+    RTO_MAX = 3.0
+    MAX_RETRIES = 8
+    SACK_MAX = 16
+    # Out-of-order seqs remembered per sender before the oldest gap is
+    # given up on.
+    RECV_HISTORY = 1024
+
+    def __init__(self, send):
+        self._send = send
+        self.session = os.urandom(4).hex()
+        self._lock = threading.Lock()
+        self._out = {}
+        self._in = {}
+        # (deadline, peer_id, seq); stale entries are skipped when popped
+        self._timers = []
+        self._next_wake = float("inf")
+        self._loop = None
+        self._wakeup = None
+        self.sent = 0
+        self.retransmits = 0
+        self.delivered = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.acks_sent = 0
+
+    # ---------------- sending ----------------
+
+    def submit(self, peer_id: str, message: str, on_receipt=None):
+        """
+        Track a message for peer_id. Returns the envelope to seal and send
+        now, or None when the window is full (the channel sends it later).
+        """
+        with self._lock:
+            out = self._out.get(peer_id)
+            if out is None:
+                out = self._out[peer_id] = _Outgoing(self.RTO_INITIAL)
+            if len(out.unacked) >= self.WINDOW or out.backlog:
+                if len(out.backlog) >= self.BACKLOG:
+                    overflow = True
+                else:
+                    out.backlog.append((message, on_receipt))
+                    return None
+            else:
+                overflow = False
+                envelope = self._track(peer_id, out, message, on_receipt, time.monotonic())
+        if overflow:
+            self.failed += 1
+            if on_receipt:
+                on_receipt(FAILED)
+            return None
+        return envelope
+
+    def _track(self, peer_id: str, out: _Outgoing, message: str, on_receipt, now: float) -> str:
+        # Caller holds the lock.
+        seq = out.next_seq
+        out.next_seq += 1
+        pending = _Pending(seq, f"{DATA_PREFIX}{self.session}:{seq}::{message}", on_receipt)
+        out.unacked[seq] = pending
+        self._arm(peer_id, out, pending, now)
+        self.sent += 1
+        return pending.envelope
+
+    def _arm(self, peer_id: str, out: _Outgoing, pending: _Pending, now: float):
+        pending.tries += 1
+        pending.sent_at = now
+        pending.deadline = now + out.rto
+        heapq.heappush(self._timers, (pending.deadline, peer_id, pending.seq))
+        if pending.deadline < self._next_wake and self._loop is not None:
+            self._next_wake = pending.deadline
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def on_ack(self, peer_id: str, body: str):
+        """
+        Handle RACK::<body> from peer_id.
+        """
+        try:
+            session, cumulative, *rest = body.split(":")
+            cumulative = int(cumulative)
+            sacks = {int(seq) for seq in rest[0].split(",")} if rest and rest[0] else set()
+        except ValueError:
+            return
+        if session != self.session:
+            return
+
+        now = time.monotonic()
+        receipts = []
+        sends = []
+        with self._lock:
+            out = self._out.get(peer_id)
+            if out is None:
+                return
+            acked = [seq for seq in out.unacked if seq <= cumulative or seq in sacks]
+            if acked:
+                # Only the newest acked seq triggered this ACK; older ones
+                # were waiting on a gap or a delayed ACK and would inflate
+                # the estimate.
+                newest = out.unacked[max(acked)]
+                if newest.tries == 1:
+                    self._sample_rtt(out, now - newest.sent_at)
+            for seq in acked:
+                receipts.append(out.unacked.pop(seq).on_receipt)
+            self.delivered += len(acked)
+            while out.backlog and len(out.unacked) < self.WINDOW:
+                message, on_receipt = out.backlog.pop(0)
+                sends.append(self._track(peer_id, out, message, on_receipt, now))
+
+        for envelope in sends:
+            self._send(peer_id, envelope)
+        for on_receipt in receipts:
+            if on_receipt:
+                on_receipt(DELIVERED)
+
+    def _sample_rtt(self, out: _Outgoing, rtt: float):
+        if out.srtt is None:
+            out.srtt = rtt
+            out.rttvar = rtt / 2
+        else:
+            out.rttvar = 0.75 * out.rttvar + 0.25 * abs(out.srtt - rtt)
+            out.srtt = 0.875 * out.srtt + 0.125 * rtt
+        out.rto = min(self.RTO_MAX, max(self.RTO_MIN, out.srtt + 4 * out.rttvar))
+
+    # ---------------- receiving ----------------
+
+    def on_data(self, peer_id: str, body: str):
+        """
+        Handle REL::<body> from peer_id. Returns the message the first time
+        a (session, seq) is seen, None for duplicates or garbage.
+        """
+        try:
+            header, message = body.split("::", 1)
+            session, seq = header.split(":")
+            seq = int(seq)
+        except ValueError:
+            return None
+        if seq < 1:
+            return None
+
+        with self._lock:
+            state = self._in.get(peer_id)
+            if state is None or state.session != session:
+                state = self._in[peer_id] = _Incoming(session)
+            state.ack_due = True
+            if seq <= state.cumulative or seq in state.sacks:
+                self.duplicates += 1
+                return None
+            state.sacks.add(seq)
+            if len(state.sacks) > self.RECV_HISTORY:
+                # The sender has long given up on the oldest gap.
+                state.cumulative = min(state.sacks) - 1
+            while state.cumulative + 1 in state.sacks:
+                state.cumulative += 1
+                state.sacks.discard(state.cumulative)
+        return message
+
+    def flush_acks(self):
+        """
+        Send one ACK to every peer with receipts since the last flush.
+        """
+        acks = []
+        with self._lock:
+            for peer_id, state in self._in.items():
+                if not state.ack_due:
+                    continue
+                state.ack_due = False
+                ack = f"{ACK_PREFIX}{state.session}:{state.cumulative}"
+                if state.sacks:
+                    ack += ":" + ",".join(str(seq) for seq in sorted(state.sacks)[: self.SACK_MAX])
+                acks.append((peer_id, ack))
+        for peer_id, ack in acks:
+            self._send(peer_id, ack)
+        self.acks_sent += len(acks)
+
+    def forget(self, peer_ids):
+        """
+        Drop state for departed peers; their pending messages fail.
+        """
+        receipts = []
+        with self._lock:
+            for peer_id in peer_ids:
+                self._in.pop(peer_id, None)
+                out = self._out.pop(peer_id, None)
+                if out is None:
+                    continue
+                receipts.extend(pending.on_receipt for pending in out.unacked.values())
+                receipts.extend(on_receipt for _, on_receipt in out.backlog)
+        self.failed += len(receipts)
+        for on_receipt in receipts:
+            if on_receipt:
+                on_receipt(FAILED)
+
+    def close(self):
+        """
+        Fail everything still unacknowledged or waiting for window space.
+        """
+        with self._lock:
+            peer_ids = list(self._out)
+        self.forget(peer_ids)
+
+    # ---------------- retransmission ----------------
+
+    async def run(self):
+        """
+        Retransmission timer; runs on the network loop until cancelled.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                self._next_wake = self._timers[0][0] if self._timers else float("inf")
+                delay = self._next_wake - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if delay == float("inf") else delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._retransmit_due()
+
+    def _retransmit_due(self):
+        now = time.monotonic()
+        sends = []
+        receipts = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                deadline, peer_id, seq = heapq.heappop(self._timers)
+                out = self._out.get(peer_id)
+                pending = out.unacked.get(seq) if out else None
+                if pending is None or pending.deadline != deadline:
+                    continue
+                if pending.tries > self.MAX_RETRIES:
+                    del out.unacked[seq]
+                    receipts.append(pending.on_receipt)
+                    while out.backlog and len(out.unacked) < self.WINDOW:
+                        message, on_receipt = out.backlog.pop(0)
+                        sends.append((peer_id, self._track(peer_id, out, message, on_receipt, now)))
+                    continue
+                out.rto = min(self.RTO_MAX, out.rto * 2)
+                self._arm(peer_id, out, pending, now)
+                self.retransmits += 1
+                sends.append((peer_id, pending.envelope))
+
+        for peer_id, envelope in sends:
+            if not self._send(peer_id, envelope) and DEBUG:
+                print(f"[reliability] retransmit to {peer_id} skipped: unknown peer")
+        self.failed += len(receipts)
+        for on_receipt in receipts:
+            if on_receipt:
+                on_receipt(FAILED)
+
+    def stats(self):
+        with self._lock:
+            unacked = sum(len(out.unacked) for out in self._out.values())
+            backlog = sum(len(out.backlog) for out in self._out.values())
+            rtts = [out.srtt for out in self._out.values() if out.srtt is not None]
+        return {
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "retransmits": self.retransmits,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "acks_sent": self.acks_sent,
+            "unacked": unacked,
+            "backlog": backlog,
+            "srtt_ms": round(1000 * sum(rtts) / len(rtts), 2) if rtts else None,
+        }
@@ -1,3 +1,4 @@
+import asyncio
 from collections import deque
 import logging
 import time
@@ -5,6 +6,7 @@ import time
 from anonchat.cli.commands import handle_command, print_menu
 from anonchat.config.settings import Settings
 from anonchat.core.discovery import Discovery
+from anonchat.core.event_loop import NetworkLoop
 from anonchat.core.identity import Identity
 from anonchat.core.network import default_interface_ip
 from anonchat.core.transport import Transport
@@ -25,6 +27,10 @@ def main():
     # --- Identity ---
     identity = Identity(nickname=settings.nickname)
 
+    # --- Network loop (transport, discovery and chat run here) ---
+    net = NetworkLoop()
+    net.start()
+
     # --- Interface selection (auto or configured) ---
     bind_ip = settings.interface_ip or default_interface_ip()
     record_log(f"Using interface IP: {bind_ip}")
@@ -48,30 +54,64 @@ def main():
         transport = Transport(
             port=settings.port,
             bind_ip=ip,
-            broadcast=True,
+            broadcast=not settings.multicast_group,
+            multicast_group=settings.multicast_group,
+            multicast_ttl=settings.multicast_ttl,
+            multicast_loop=settings.multicast_loop,
+            rcvbuf=settings.socket_rcvbuf_kb * 1024,
+            sndbuf=settings.socket_sndbuf_kb * 1024,
         )
         discovery = Discovery(
             transport=transport,
             identity=identity,
             broadcast_ip=settings.broadcast_ip,
             port=settings.port,
+            wire_format=settings.wire_format,
+            mode=settings.discovery_mode,
         )
         chat = Chat(
             transport=transport,
             discovery=discovery,
             identity=identity,
             port=settings.port,
+            workers=settings.rx_workers,
+            drop_policy=settings.rx_drop_policy,
+            reliable=settings.reliable,
         )
         return transport, discovery, chat
 
-    def stop_stack():
+    async def start_stack(ip: str):
+        transport, discovery, chat = build_stack(ip)
+        await transport.open()
+        discovery.start()
+        state["transport"] = transport
+        state["discovery"] = discovery
+        state["chat"] = chat
+        return transport, discovery, chat
+
+    async def stop_stack():
         if state["chat"]:
-            state["chat"].stop()
+            await state["chat"].stop()
+        # Flush-on-shutdown: commit whatever the batch writer still holds
+        # (off the loop, the writer may take a moment) before teardown.
+        if state["ui"]:
+            await asyncio.get_running_loop().run_in_executor(None, state["ui"].flush)
         if state["discovery"]:
-            state["discovery"].stop()
+            await state["discovery"].stop()
         if state["transport"]:
             state["transport"].close()
 
+    async def restart_stack(new_ip: str):
+        await stop_stack()
+        state["current_ip"] = new_ip
+        _, discovery, chat = await start_stack(new_ip)
+
+        # Re-wire UI hooks
+        if state["ui"]:
+            state["ui"].attach(chat, discovery)
+            state["ui"].set_current_ip(new_ip)
+            chat.start(state["ui"].on_message, state["ui"].on_group_message)
+
     def on_message(sender_id: str, message: str):
         record_log(f"[{sender_id}] {message}")
 
@@ -82,33 +122,13 @@ def main():
         if new_ip == state["current_ip"]:
             return True
         record_log(f"Switching interface to {new_ip}")
-
-        # Stop existing stack
-        stop_stack()
-
-        # Rebuild
-        state["current_ip"] = new_ip
-        transport, discovery, chat = build_stack(new_ip)
-        discovery.start()
-        state["transport"] = transport
-        state["discovery"] = discovery
-        state["chat"] = chat
-
-        # Re-wire UI hooks
-        if state["ui"]:
-            state["ui"].attach(chat, discovery)
-            state["ui"].set_current_ip(new_ip)
-            chat.start(state["ui"].on_message)
+        net.run(restart_stack(new_ip))
         record_log(f"Interface switched to {new_ip}")
         record_log(f"UI running at {current_ui_url()}")
         return True
 
     # Initial stack
-    transport, discovery, chat = build_stack(bind_ip)
-    discovery.start()
-    state["transport"] = transport
-    state["discovery"] = discovery
-    state["chat"] = chat
+    transport, discovery, chat = net.run(start_stack(bind_ip))
 
     # --- UI server (non-blocking) ---
     ui = run_ui_server(
@@ -119,11 +139,12 @@ def main():
         host=settings.ui_host,
         port=settings.ui_port,
         on_set_interface=switch_interface,
+        settings=settings,
     )
     ui.set_current_ip(bind_ip)
     state["ui"] = ui
 
-    chat.start(ui.on_message)
+    net.call(chat.start, ui.on_message, ui.on_group_message)
 
     # --- CLI ---
     record_log(f"UI running at {current_ui_url()}")
@@ -154,4 +175,7 @@ def main():
         pass
     finally:
         print("\nExiting...")
-        stop_stack()
+        net.run(stop_stack())
+        net.stop()
+        # Flush-on-shutdown: commit whatever the batch writer still holds.
+        ui.close()
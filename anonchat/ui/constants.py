@@ -11,5 +11,16 @@ SHARE_DIR = ROOT_DIR / "share"
 DATA_DIR = ROOT_DIR / "database"
 TEMPLATES_DIR = FRONT_DIR / "templates"
 STATIC_DIR = FRONT_DIR / "static"
+# Largest single request body: a form upload or one chunk of a chunked
+# upload (whose total size is capped by Settings.upload_max_mb instead).
 MAX_UPLOAD_MB = 10
 MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+# Sealed and base64-encoded this stays under the transport's 1 MiB cap.
+MAX_MESSAGE_TEXT_BYTES = 512 * 1024
+HISTORY_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_WAIT_SECONDS = 2.0
+STREAM_KEEPALIVE_SECONDS = 15.0
+# last_seen in the cached peer list is refreshed at least this often.
+PEER_SEEN_RESOLUTION_SECONDS = 5
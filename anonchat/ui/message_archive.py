@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from anonchat.ui.models import Message
+
+
+class MessageArchive:
+    """
+    Append-only, gzip-compressed segment files for pruned messages.
+
+    Each append writes one gzip member (a batch of JSON lines, one
+    [id, direction, room, peer_id, text, ts] row per line) to the end of
+    the current segment, so a segment is still a plain .jsonl.gz file
+    that `zcat` or gzip.open() can read front to back. The caller records
+    (segment, offset, length) of every member; read() decompresses just
+    that member.
+
+    The index lives in the message database, committed together with the
+    delete, so bytes past the last indexed member (a crash between append
+    and commit) are cut off by recover().
+    """
+
+    SEGMENT_BYTES = 16 * 1024 * 1024
+    # Decoded members kept for paging back through the same region.
+    CACHED_MEMBERS = 8
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._segment = None
+        self._size = 0
+        self._cache: "OrderedDict[Tuple[str, int], List[list]]" = OrderedDict()
+
+    def segments(self) -> List[Path]:
+        if not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob("segment-*.jsonl.gz"))
+
+    def recover(self, committed: Dict[str, int]):
+        """
+        Truncate every segment to the end of its last committed member.
+        """
+        with self._lock:
+            for path in self.segments():
+                end = committed.get(path.name, 0)
+                if path.stat().st_size > end:
+                    with open(path, "r+b") as fh:
+                        fh.truncate(end)
+            self._segment = None
+
+    def append(self, rows: Sequence[Message]) -> Tuple[str, int, int]:
+        """
+        Write rows as one member and fsync it. Returns (segment, offset, length).
+        """
+        lines = "".join(
+            json.dumps(
+                [msg.id, msg.direction, msg.room, msg.peer_id, msg.text, msg.ts],
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            + "\n"
+            for msg in rows
+        )
+        data = gzip.compress(lines.encode("utf-8"), compresslevel=6)
+        with self._lock:
+            path = self._current_segment()
+            with open(path, "ab") as fh:
+                offset = fh.tell()
+                fh.write(data)
+                fh.flush()
+                os.fsync(fh.fileno())
+            self._size = offset + len(data)
+            return path.name, offset, len(data)
+
+    def discard(self, segment: str, offset: int):
+        """
+        Drop a member that was appended but never committed to the index.
+        """
+        with self._lock:
+            path = self.directory / segment
+            if path.exists() and path.stat().st_size > offset:
+                with open(path, "r+b") as fh:
+                    fh.truncate(offset)
+            if self._segment == path:
+                self._size = offset
+
+    def read(self, segment: str, offset: int, length: int, room: Optional[str] = None) -> List[Message]:
+        """
+        Messages of one member, oldest first; only `room`'s when given.
+        """
+        key = (segment, offset)
+        with self._lock:
+            rows = self._cache.get(key)
+            if rows is not None:
+                self._cache.move_to_end(key)
+        if rows is None:
+            with open(self.directory / segment, "rb") as fh:
+                fh.seek(offset)
+                data = gzip.decompress(fh.read(length))
+            # One JSON array parse for the whole member instead of one per line.
+            rows = json.loads("[" + ",".join(data.decode("utf-8").splitlines()) + "]")
+            with self._lock:
+                self._cache[key] = rows
+                while len(self._cache) > self.CACHED_MEMBERS:
+                    self._cache.popitem(last=False)
+        return [
+            Message(id=row[0], direction=row[1], room=row[2], peer_id=row[3], text=row[4], ts=row[5])
+            for row in rows
+            if room is None or row[2] == room
+        ]
+
+    def stats(self) -> Dict:
+        segments = self.segments()
+        return {
+            "segments": len(segments),
+            "bytes": sum(path.stat().st_size for path in segments),
+        }
+
+    # ---------------- internal ----------------
+
+    def _current_segment(self) -> Path:
+        if self._segment is not None and self._size < self.SEGMENT_BYTES:
+            return self._segment
+        segments = self.segments()
+        if self._segment is None and segments:
+            last = segments[-1]
+            size = last.stat().st_size
+            if size < self.SEGMENT_BYTES:
+                self._segment, self._size = last, size
+                return last
+        number = int(segments[-1].name.split("-")[1].split(".")[0]) + 1 if segments else 1
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment = self.directory / f"segment-{number:06d}.jsonl.gz"
+        self._size = 0
+        return self._segment
@@ -0,0 +1,166 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from anonchat.ui.models import Message
+
+# Rough per-message overhead of the dataclass, its strings and deque slot.
+_MESSAGE_OVERHEAD = 160
+
+
+def _message_size(msg: Message) -> int:
+    return len(msg.text) + len(msg.room) + len(msg.peer_id) + _MESSAGE_OVERHEAD
+
+
+class _RoomTail:
+    __slots__ = ("messages", "floor", "size")
+
+    def __init__(self, floor: int):
+        self.messages: Deque[Message] = deque()
+        # Every message of this room with id > floor is in `messages`.
+        self.floor = floor
+        self.size = 0
+
+
+class HotTailCache:
+    """
+    Bounded in-memory tail of recent messages per room.
+
+    Filled from MessageStore.store() in id order, so a lookup whose
+    after_id is at or above a room's floor can be answered without
+    touching SQLite. The "all" feed is kept as its own tail.
+
+    Eviction:
+    - per room: oldest messages go once the room exceeds room_bytes
+    - global: least recently used rooms are dropped once the total
+      exceeds total_bytes
+    """
+
+    ALL = "all"
+
+    def __init__(self, start_id: int, room_bytes: int, total_bytes: int):
+        self._lock = threading.Lock()
+        self._rooms: "OrderedDict[str, _RoomTail]" = OrderedDict()
+        # Floor for rooms with no tail: anything above it would be cached.
+        self._absent_floor = start_id
+        self._room_bytes = max(1, room_bytes)
+        self._total_bytes = max(1, total_bytes)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, msg: Message):
+        """
+        Record a freshly stored message. Callers must add in id order.
+        """
+        size = _message_size(msg)
+        # The "all" room's own messages belong to the "all" feed once.
+        keys = (self.ALL,) if msg.room == self.ALL else (msg.room, self.ALL)
+        with self._lock:
+            for key in keys:
+                tail = self._rooms.get(key)
+                if tail is None:
+                    tail = _RoomTail(self._absent_floor)
+                    self._rooms[key] = tail
+                else:
+                    self._rooms.move_to_end(key)
+                tail.messages.append(msg)
+                tail.size += size
+                self._size += size
+                while tail.size > self._room_bytes and len(tail.messages) > 1:
+                    self._evict_oldest(tail)
+            while self._size > self._total_bytes and len(self._rooms) > 1:
+                self._drop_lru()
+
+    def since(self, after_id: int, room: str) -> Optional[List[Message]]:
+        """
+        Messages with id > after_id, oldest first, or None on a miss.
+        """
+        with self._lock:
+            tail = self._rooms.get(room)
+            floor = tail.floor if tail else self._absent_floor
+            if after_id < floor:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if tail is None:
+                return []
+            self._rooms.move_to_end(room)
+            newer = []
+            for msg in reversed(tail.messages):
+                if msg.id <= after_id:
+                    break
+                newer.append(msg)
+            newer.reverse()
+            return newer
+
+    def before(self, room: str, before_id: Optional[int], count: int) -> Optional[List[Message]]:
+        """
+        Newest `count` messages with id < before_id, oldest first, or None
+        when the tail cannot prove it holds them (older rows may be cold).
+        """
+        with self._lock:
+            tail = self._rooms.get(room)
+            picked = []
+            if tail is not None:
+                for msg in reversed(tail.messages):
+                    if before_id is not None and msg.id >= before_id:
+                        continue
+                    picked.append(msg)
+                    if len(picked) >= count:
+                        break
+            floor = tail.floor if tail else self._absent_floor
+            if len(picked) < count and floor > 0:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if tail is not None:
+                self._rooms.move_to_end(room)
+            picked.reverse()
+            return picked
+
+    def forget(self, through_id: int, room: Optional[str] = None):
+        """
+        Drop messages with id <= through_id (deleted from the database)
+        from one room's tail and the "all" feed, or from every tail.
+        """
+        with self._lock:
+            keys = list(self._rooms) if room is None else {room, self.ALL}
+            for key in keys:
+                tail = self._rooms.get(key)
+                if tail is None:
+                    continue
+                while tail.messages and tail.messages[0].id <= through_id:
+                    self._evict_oldest(tail)
+                tail.floor = max(tail.floor, through_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "rooms": len(self._rooms),
+                "bytes": self._size,
+            }
+
+    # ---------------- internal ----------------
+
+    def _evict_oldest(self, tail: _RoomTail):
+        msg = tail.messages.popleft()
+        size = _message_size(msg)
+        tail.size -= size
+        self._size -= size
+        tail.floor = msg.id
+        self.evictions += 1
+
+    def _drop_lru(self):
+        _, tail = self._rooms.popitem(last=False)
+        self._size -= tail.size
+        self.evictions += len(tail.messages)
+        if tail.messages:
+            self._absent_floor = max(self._absent_floor, tail.messages[-1].id)
+        self._absent_floor = max(self._absent_floor, tail.floor)
@@ -1,21 +1,117 @@
+import html
+import os
+import queue
 import sqlite3
 import threading
 import time
-from typing import Dict, List, Optional
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
 
+from anonchat.core.locks import TimedLock
 from anonchat.ui.constants import DATA_DIR
-from anonchat.ui.models import Message
+from anonchat.ui.message_archive import MessageArchive
+from anonchat.ui.message_cache import HotTailCache
+from anonchat.ui.models import Message, RetentionPolicy
+
+DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
+
+# Durability modes:
+#   message - INSERT + COMMIT per message on the caller's thread (fsync each)
+#   normal  - same, but PRAGMA synchronous=NORMAL (WAL fsyncs at checkpoints)
+#   batch   - background writer groups inserts into one transaction
+DURABILITY_MODES = ("message", "normal", "batch")
+
+# Full-text search modes:
+#   backfill - index new messages and, in the background, existing history
+#   new      - index only messages stored from now on
+#   off      - no index (an existing one is dropped)
+SEARCH_MODES = ("backfill", "new", "off")
+
+# Snippet highlight markers; private-use characters that never occur in
+# chat text, swapped for <mark> after HTML-escaping.
+_MARK_OPEN = "\ue000"
+_MARK_CLOSE = "\ue001"
+
+# Room ids as indexed for search: without the separators the tokenizer
+# would split on, so room_ab12 / anon-ab12 are single tokens.
+_ROOM_TOKEN_SQL = "replace(replace({column}, '_', ''), '-', '')"
+
+
+def _room_token(room: str) -> str:
+    return room.replace("_", "").replace("-", "")
+
+
+_MAX_ID = 2 ** 63 - 1
+
+
+def parse_room_retention(spec: str) -> Dict[str, RetentionPolicy]:
+    """
+    Per-room policies from "room:days:rows,room:days:rows" (either limit
+    may be empty or 0), e.g. "room_ab12:7:,anon-ff00::500".
+    """
+    policies = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        parts = entry.rsplit(":", 2)
+        if len(parts) != 3 or not parts[0]:
+            raise ValueError(f"Bad room retention entry: {entry!r}")
+        room, days, rows = parts
+        policies[room] = RetentionPolicy(
+            max_age=float(days or 0) * 86400,
+            max_rows=int(rows or 0),
+        )
+    return policies
+
+
+@lru_cache(maxsize=4096)
+def _format_ts(second: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
 
 
 class MessageStore:
-    def __init__(self, lock: Optional[threading.Lock] = None):
-        self._lock = lock or threading.Lock()
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
+    def __init__(
+        self,
+        lock: Optional[threading.Lock] = None,
+        on_store: Optional[Callable[[Message], None]] = None,
+        durability: str = "batch",
+        batch_size: int = 64,
+        batch_interval: float = 0.005,
+        queue_size: int = 4096,
+        cache_room_bytes: int = 1024 * 1024,
+        cache_total_bytes: int = 32 * 1024 * 1024,
+        db_path: Optional[Path] = None,
+        readers: int = 4,
+        search: str = "backfill",
+        retention: Optional[RetentionPolicy] = None,
+        room_retention: Optional[Dict[str, RetentionPolicy]] = None,
+        archive: bool = False,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {search}")
+        # Guards the SQLite connection only; nothing else should share it.
+        self._lock = lock or TimedLock("store")
+        self._on_store = on_store
+        self.durability = durability
+        if db_path is None:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            db_path = DATA_DIR / "messages.db"
+        self.db_path = Path(db_path).resolve()
         self._conn = sqlite3.connect(
-            str(DATA_DIR / "messages.db"),
+            str(self.db_path),
             check_same_thread=False,
         )
+        # Only takes effect on a new database; lets pruning hand pages back
+        # to the filesystem (see _compact).
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
         self._conn.execute("PRAGMA journal_mode=WAL")
+        # Shrink the WAL back to this size after a checkpoint.
+        self._conn.execute(f"PRAGMA journal_size_limit={self.WAL_SIZE_LIMIT}")
+        if durability == "normal":
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._auto_vacuum = self._conn.execute("PRAGMA auto_vacuum").fetchone()[0]
         self._conn.execute(
             """
             CREATE TABLE IF NOT EXISTS messages (
@@ -31,49 +127,949 @@ class MessageStore:
         self._conn.execute(
             "CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages (room, id)"
         )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        # Index of archived messages: one row per archive member, plus the
+        # id range each room has in it.
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archive_members (
+                id INTEGER PRIMARY KEY,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                rows INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archive_members_last_id ON archive_members (last_id)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archive_rooms (
+                room TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                first_id INTEGER NOT NULL,
+                member INTEGER NOT NULL,
+                PRIMARY KEY (room, last_id, member)
+            ) WITHOUT ROWID
+            """
+        )
         self._conn.commit()
+        self.search_enabled = self._init_search(search)
+        self._backfill = None
+
+        # Read-only connections for queries. WAL lets them run alongside
+        # the writer, so reads never wait on a commit or on each other.
+        # Opened on demand, at most `readers`; 0 keeps every query on the
+        # writer connection under the store lock.
+        self._readers = max(0, readers)
+        self._reader_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_conns: List[sqlite3.Connection] = []
+        self._reader_lock = threading.Lock()
+        # Reads between entering and leaving _reader(); close() waits for
+        # them to hand their connections back before closing the pool.
+        self._readers_busy = 0
+        self._readers_idle = threading.Condition(self._reader_lock)
+        self._readers_closed = False
+        self.reads_pooled = 0
+        self.reads_waited = 0
+
+        # Batch mode: ids are handed out here, rows wait in _pending (in id
+        # order) until the writer commits them. _slots bounds the backlog.
+        self._batch_size = max(1, batch_size)
+        self._batch_interval = max(0.0, batch_interval)
+        self._pending: List[Message] = []
+        self._pending_cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max(1, queue_size))
+        self._next_id = self._max_allocated_id() + 1
+        self._cache = HotTailCache(
+            start_id=self._next_id - 1,
+            room_bytes=cache_room_bytes,
+            total_bytes=cache_total_bytes,
+        )
+        self._closing = False
+        self._writer = None
+        self.batches_written = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        # Failed attempts so far on the batch at the head of the queue.
+        self.write_retrying = 0
+        self.rows_lost = 0
+        self.last_write_error: Optional[str] = None
+        if durability == "batch":
+            self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer.start()
+        if self.search_enabled and search == "backfill" and self._indexed_from() > 0:
+            self._backfill = threading.Thread(target=self._backfill_loop, name="anonchat-fts", daemon=True)
+            self._backfill.start()
+
+        # Retention: the global policy covers every room without a policy
+        # of its own. Expired rows are archived first when `archive` is on.
+        self._retention = retention if retention and retention.enabled else None
+        self._room_retention = {
+            room: policy for room, policy in (room_retention or {}).items() if policy.enabled
+        }
+        self._archive_enabled = archive
+        self._archive = MessageArchive(self.db_path.parent / "archive")
+        self._archive.recover(self._committed_segment_ends())
+        self._archived_rows = self._conn.execute(
+            "SELECT COALESCE(SUM(rows), 0) FROM archive_members"
+        ).fetchone()[0]
+        self._prune_lock = threading.Lock()
+        self._prune_wake = threading.Event()
+        self.prune_runs = 0
+        self.rows_pruned = 0
+        self.rows_archived = 0
+        self.last_prune_ms = 0.0
+        self._pruner = None
+        if self._retention or self._room_retention:
+            self._pruner = threading.Thread(target=self._prune_loop, name="anonchat-retention", daemon=True)
+            self._pruner.start()
+
+    def _max_allocated_id(self) -> int:
+        row = self._conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        max_id = int(row[0] or 0)
+        seq = self._conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'messages'"
+        ).fetchone()
+        if seq:
+            max_id = max(max_id, int(seq[0] or 0))
+        return max_id
 
     def store(self, direction: str, room: str, peer_id: str, text: str) -> Message:
+        if self._writer:
+            msg = self._enqueue(direction, room, peer_id, text)
+        else:
+            with self._lock:
+                ts = time.time()
+                cursor = self._conn.execute(
+                    "INSERT INTO messages (direction, room, peer_id, text, ts) VALUES (?, ?, ?, ?, ?)",
+                    (direction, room, peer_id, text, ts),
+                )
+                self._conn.commit()
+                msg = Message(
+                    id=int(cursor.lastrowid),
+                    direction=direction,
+                    room=room,
+                    peer_id=peer_id,
+                    text=text,
+                    ts=ts,
+                )
+                self._cache.add(msg)
+        if self._on_store:
+            self._on_store(msg)
+        return msg
+
+    def latest_id(self) -> int:
+        if self._writer:
+            with self._pending_cond:
+                return self._next_id - 1
+        with self._reader() as conn:
+            row = conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        return int(row[0] or 0)
+
+    # ---------------- reads ----------------
+
+    def _open_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            f"{self.db_path.as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def _reader(self):
+        """
+        A connection for one query: a pooled read-only connection, or the
+        writer connection under the store lock when the pool is disabled.
+        """
+        if not self._readers:
+            with self._lock:
+                yield self._conn
+            return
+        with self._reader_lock:
+            if self._readers_closed:
+                raise sqlite3.ProgrammingError("Cannot operate on a closed MessageStore.")
+            self._readers_busy += 1
+            self.reads_pooled += 1
+        try:
+            try:
+                conn = self._reader_pool.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._reader_lock:
+                    if len(self._reader_conns) < self._readers:
+                        conn = self._open_reader()
+                        self._reader_conns.append(conn)
+                    else:
+                        self.reads_waited += 1
+                if conn is None:
+                    conn = self._reader_pool.get()
+            try:
+                yield conn
+            finally:
+                self._reader_pool.put(conn)
+        finally:
+            with self._reader_lock:
+                self._readers_busy -= 1
+                if not self._readers_busy:
+                    self._readers_idle.notify_all()
+
+    def _merge_pending(self, messages: List[Message], pending: List[Message]) -> List[Message]:
+        """
+        Committed rows plus rows still queued for the writer. `pending` is
+        snapshotted before the query, so a batch committed in between shows
+        up in both; keep one copy.
+        """
+        if not pending:
+            return messages
+        seen = {msg.id for msg in messages}
+        merged = messages + [msg for msg in pending if msg.id not in seen]
+        merged.sort(key=lambda msg: msg.id)
+        return merged
+
+    def messages_since(
+        self,
+        after_id: int,
+        room: str,
+        limit: Optional[int] = None,
+    ) -> List[Message]:
+        cached = self._cache.since(after_id, room)
+        if cached is not None:
+            return cached[:limit] if limit else cached
+        where = "id > ?"
+        args: List = [after_id]
+        if room != "all":
+            where += " AND room = ?"
+            args.append(room)
+        sql = f"SELECT id, direction, room, peer_id, text, ts FROM messages WHERE {where} ORDER BY id ASC"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+        # Rows still queued for the writer are newer than anything committed.
+        pending = self._pending_matching(room, after_id=after_id)
+        with self._reader() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        messages = [self._row_message(row) for row in rows]
+        if not limit or len(messages) < limit:
+            messages = self._merge_pending(messages, pending)
+        return messages[:limit] if limit else messages
+
+    def messages_page(
+        self,
+        room: str,
+        after_id: int = 0,
+        before_id: Optional[int] = None,
+        limit: int = 100,
+    ) -> Tuple[List[Message], bool]:
+        """
+        Keyset page of messages, oldest first.
+
+        With after_id > 0 the page walks forward from that cursor and the
+        flag tells whether newer rows remain. Otherwise it holds the newest
+        `limit` rows below before_id (or the latest rows when before_id is
+        None) and the flag tells whether older rows remain.
+        """
+        limit = max(1, limit)
+        if after_id > 0:
+            messages = self.messages_since(after_id, room, limit + 1)
+            return messages[:limit], len(messages) > limit
+
+        messages = self._cache.before(room, before_id, limit + 1)
+        if messages is None:
+            messages = self._select_before(room, before_id, limit + 1)
+        if self._archived_rows:
+            # Expired history continues in the archive. In the "all" feed it
+            # interleaves with rooms kept longer, so merge rather than append;
+            # the index skips members older than a full page.
+            above = messages[0].id if len(messages) > limit else 0
+            archived = self._archived_before(room, before_id, limit + 1, above)
+            if archived:
+                # A prune between the two reads can put a row in both.
+                merged = {msg.id: msg for msg in archived + messages}
+                messages = [merged[msg_id] for msg_id in sorted(merged)][-(limit + 1):]
+        return messages[-limit:], len(messages) > limit
+
+    def _select_before(self, room: str, before_id: Optional[int], count: int) -> List[Message]:
+        where = "id < ?"
+        args: List = [before_id if before_id is not None else _MAX_ID]
+        if room != "all":
+            where += " AND room = ?"
+            args.append(room)
+        args.append(count)
+        pending = self._pending_matching(room, before_id=before_id)
+        with self._reader() as conn:
+            rows = conn.execute(
+                f"SELECT id, direction, room, peer_id, text, ts FROM messages WHERE {where} ORDER BY id DESC LIMIT ?",
+                args,
+            ).fetchall()
+        messages = [self._row_message(row) for row in reversed(rows)]
+        return self._merge_pending(messages, pending)[-count:]
+
+    def _row_message(self, row) -> Message:
+        return Message(
+            id=row[0],
+            direction=row[1],
+            room=row[2],
+            peer_id=row[3],
+            text=row[4],
+            ts=row[5],
+        )
+
+    # ---------------- full-text search ----------------
+
+    # Rows indexed per backfill transaction, and the pause between them so
+    # the writer is never starved.
+    BACKFILL_CHUNK = 2000
+    BACKFILL_PAUSE = 0.01
+    MAX_SEARCH_RESULTS = 100
+    # Ranked search scores only the newest RANK_WINDOW matches; a very
+    # common word would otherwise rank hundreds of thousands of rows.
+    RANK_WINDOW = 5000
+
+    def _init_search(self, mode: str) -> bool:
+        """
+        Create (or drop) the FTS5 index over messages.text. It is an
+        external-content table kept in sync by triggers, so both the direct
+        and the batch write paths index rows in the same transaction.
+
+        store_meta.fts_indexed_from is the lowest id known to be indexed:
+        0 for a database indexed from the start, otherwise the backfill
+        frontier, which walks down from the newest pre-existing row.
+        """
+        conn = self._conn
+        if mode == "off":
+            conn.execute("DROP TRIGGER IF EXISTS messages_fts_insert")
+            conn.execute("DROP TRIGGER IF EXISTS messages_fts_delete")
+            conn.execute("DROP TABLE IF EXISTS messages_fts")
+            conn.execute("DROP VIEW IF EXISTS messages_fts_source")
+            conn.execute("DELETE FROM store_meta WHERE key = 'fts_indexed_from'")
+            conn.commit()
+            return False
+
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            # room is indexed too, so a per-room search is one more term
+            # instead of a filter over every match. The view strips the
+            # separators from room ids (room_ab12 -> roomab12) so each room
+            # is a single, rare token.
+            conn.execute(
+                f"""
+                CREATE VIEW IF NOT EXISTS messages_fts_source AS
+                SELECT id, text, {_ROOM_TOKEN_SQL.format(column="room")} AS room FROM messages
+                """
+            )
+            conn.execute(
+                """
+                CREATE VIRTUAL TABLE messages_fts USING fts5(
+                    text, room,
+                    content='messages_fts_source', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+                """
+            )
+        except sqlite3.OperationalError as exc:
+            if DEBUG:
+                print(f"[store] full-text search unavailable: {exc}")
+            return False
+        row = conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        newest = int(row[0] or 0)
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('fts_indexed_from', ?)",
+            (newest + 1 if newest else 0,),
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, text, room)
+                VALUES (new.id, new.text, {_ROOM_TOKEN_SQL.format(column="new.room")});
+            END
+            """
+        )
+        # Deleting a row that was never indexed would corrupt the index, so
+        # only rows at or above the backfill frontier are removed from it.
+        conn.execute(
+            f"""
+            CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages
+            WHEN old.id >= (SELECT value FROM store_meta WHERE key = 'fts_indexed_from')
+            BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, room)
+                VALUES ('delete', old.id, old.text, {_ROOM_TOKEN_SQL.format(column="old.room")});
+            END
+            """
+        )
+        conn.commit()
+        return True
+
+    def _indexed_from(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM store_meta WHERE key = 'fts_indexed_from'"
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def _backfill_loop(self):
+        """
+        Index pre-existing history newest-first, one small transaction at a
+        time, so recent messages become searchable first.
+        """
+        while not self._closing:
+            with self._lock:
+                if self._closing:
+                    return
+                row = self._conn.execute(
+                    "SELECT value FROM store_meta WHERE key = 'fts_indexed_from'"
+                ).fetchone()
+                high = int(row[0]) if row else 0
+                if high <= 0:
+                    return
+                low = max(0, high - self.BACKFILL_CHUNK)
+                try:
+                    self._conn.execute(
+                        "INSERT INTO messages_fts (rowid, text, room) "
+                        "SELECT id, text, room FROM messages_fts_source WHERE id >= ? AND id < ?",
+                        (low, high),
+                    )
+                    self._conn.execute(
+                        "UPDATE store_meta SET value = ? WHERE key = 'fts_indexed_from'",
+                        (low,),
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as exc:
+                    self._conn.rollback()
+                    if DEBUG:
+                        print(f"[store] search backfill stopped: {exc}")
+                    return
+            time.sleep(self.BACKFILL_PAUSE)
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """
+        Turn free text into a safe FTS5 query: every word becomes a quoted
+        term (all must match); a trailing * keeps prefix matching.
+        """
+        terms = []
+        for word in query.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*").replace('"', '""')
+            if word:
+                terms.append(f'"{word}"*' if prefix else f'"{word}"')
+        return " ".join(terms)
+
+    def search(
+        self,
+        query: str,
+        room: Optional[str] = None,
+        limit: int = 20,
+        order: str = "rank",
+    ) -> List[Tuple[Message, str]]:
+        """
+        Messages matching `query`, best match first (order="rank", BM25
+        over the newest RANK_WINDOW matches) or newest first
+        (order="recent"), optionally within one room.
+        Returns (message, snippet_html) pairs; the snippet is HTML-escaped
+        with matches wrapped in <mark>.
+        """
+        if not self.search_enabled:
+            return []
+        match = self._match_expression(query)
+        if not match:
+            return []
+        if room and room != "all":
+            room_token = _room_token(room).replace('"', '""')
+            match = f'room : "{room_token}" AND text : ({match})'
+        else:
+            match = f"text : ({match})"
+        limit = max(1, min(limit, self.MAX_SEARCH_RESULTS))
+        order_by = "bm25(messages_fts, 1.0, 0.0)" if order == "rank" else "messages_fts.rowid DESC"
+        sql = (
+            "SELECT m.id, m.direction, m.room, m.peer_id, m.text, m.ts, "
+            f"snippet(messages_fts, 0, '{_MARK_OPEN}', '{_MARK_CLOSE}', '…', 16) "
+            "FROM messages_fts JOIN messages AS m ON m.id = messages_fts.rowid "
+            f"WHERE messages_fts MATCH ? AND messages_fts.rowid >= ? ORDER BY {order_by} LIMIT ?"
+        )
+        try:
+            with self._reader() as conn:
+                floor = 0
+                if order == "rank":
+                    # Walking the doclist newest-first is cheap; FTS5 then
+                    # applies the rowid bound before scoring.
+                    row = conn.execute(
+                        "SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? "
+                        "ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                        (match, self.RANK_WINDOW - 1),
+                    ).fetchone()
+                    if row:
+                        floor = row[0]
+                rows = conn.execute(sql, (match, floor, limit)).fetchall()
+        except sqlite3.OperationalError as exc:
+            if DEBUG:
+                print(f"[store] search failed for {query!r}: {exc}")
+            return []
+        results = []
+        for row in rows:
+            snippet = html.escape(row[6] or "")
+            snippet = snippet.replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>")
+            results.append((self._row_message(row), snippet))
+        return results
+
+    def search_stats(self) -> Dict:
+        if not self.search_enabled:
+            return {"enabled": False}
+        return {"enabled": True, "indexed_from": self._indexed_from()}
+
+    # ---------------- retention ----------------
+
+    # How often retention runs, messages removed per transaction, and the
+    # pause between transactions so the writer and readers get the lock.
+    PRUNE_INTERVAL = 60.0
+    PRUNE_BATCH = 500
+    PRUNE_PAUSE = 0.02
+    # Passive WAL checkpoint every this many prune batches.
+    CHECKPOINT_BATCHES = 20
+    # Free pages handed back per incremental_vacuum step.
+    VACUUM_PAGES = 512
+    WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+    def _committed_segment_ends(self) -> Dict[str, int]:
+        rows = self._conn.execute(
+            "SELECT segment, MAX(offset + length) FROM archive_members GROUP BY segment"
+        ).fetchall()
+        return {segment: end for segment, end in rows}
+
+    def _prune_loop(self):
+        while not self._closing:
+            try:
+                self.prune()
+            except sqlite3.Error as exc:
+                if DEBUG:
+                    print(f"[store] retention run failed: {exc}")
+            self._prune_wake.wait(self.PRUNE_INTERVAL)
+
+    def _retention_scopes(self) -> List[Tuple[Optional[str], RetentionPolicy]]:
+        # (room, policy); room None is the global policy.
+        scopes: List[Tuple[Optional[str], RetentionPolicy]] = list(self._room_retention.items())
+        if self._retention:
+            scopes.append((None, self._retention))
+        return scopes
+
+    def _scope_filter(self, room: Optional[str]) -> Tuple[str, List]:
+        if room is not None:
+            return "room = ?", [room]
+        if not self._room_retention:
+            return "1", []
+        marks = ", ".join("?" * len(self._room_retention))
+        return f"room NOT IN ({marks})", list(self._room_retention)
+
+    def _prune_cutoff(self, room: Optional[str], policy: RetentionPolicy, now: float) -> int:
+        """
+        Messages in scope with an id below this have expired.
+        """
+        where, args = self._scope_filter(room)
+        cutoff = 0
+        with self._reader() as conn:
+            if policy.max_age > 0:
+                # Read first: when everything in scope has expired, the
+                # cutoff stops here, so rows the writer commits while the
+                # prune runs are not swept up with them.
+                latest = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+                row = conn.execute(
+                    f"SELECT id FROM messages WHERE {where} AND ts >= ? ORDER BY id LIMIT 1",
+                    args + [now - policy.max_age],
+                ).fetchone()
+                cutoff = row[0] if row else latest + 1
+            if policy.max_rows > 0:
+                # The newest message beyond the row budget.
+                row = conn.execute(
+                    f"SELECT id FROM messages WHERE {where} ORDER BY id DESC LIMIT 1 OFFSET ?",
+                    args + [policy.max_rows],
+                ).fetchone()
+                if row:
+                    cutoff = max(cutoff, row[0] + 1)
+        return cutoff
+
+    def prune(self) -> int:
+        """
+        Apply the retention policies once: archive (when enabled) and delete
+        expired messages in small batches, then checkpoint and compact.
+        Returns the number of messages removed.
+        """
+        with self._prune_lock:
+            start = time.perf_counter()
+            now = time.time()
+            removed = 0
+            for room, policy in self._retention_scopes():
+                if self._closing:
+                    break
+                cutoff = self._prune_cutoff(room, policy, now)
+                if cutoff:
+                    removed += self._prune_below(room, cutoff)
+            if removed and not self._closing:
+                self._compact()
+            self.prune_runs += 1
+            self.last_prune_ms = (time.perf_counter() - start) * 1000
+            if DEBUG and removed:
+                print(f"[store] retention removed {removed} messages in {self.last_prune_ms:.0f}ms")
+            return removed
+
+    def _prune_below(self, room: Optional[str], cutoff: int) -> int:
+        where, args = self._scope_filter(room)
+        removed = 0
+        batches = 0
+        while not self._closing:
+            # Read and archive outside the store lock; only the delete
+            # (and the archive index rows) hold it.
+            with self._reader() as conn:
+                rows = conn.execute(
+                    f"SELECT id, direction, room, peer_id, text, ts FROM messages "
+                    f"WHERE {where} AND id < ? ORDER BY id LIMIT ?",
+                    args + [cutoff, self.PRUNE_BATCH],
+                ).fetchall()
+            if not rows:
+                break
+            batch = [self._row_message(row) for row in rows]
+            member = self._archive.append(batch) if self._archive_enabled else None
+            with self._lock:
+                try:
+                    if member:
+                        self._index_member(member, batch)
+                    self._conn.execute(
+                        f"DELETE FROM messages WHERE {where} AND id >= ? AND id <= ?",
+                        args + [batch[0].id, batch[-1].id],
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as exc:
+                    self._conn.rollback()
+                    if member:
+                        self._archive.discard(member[0], member[1])
+                    if DEBUG:
+                        print(f"[store] retention stopped: {exc}")
+                    break
+            if member:
+                self._archived_rows += len(batch)
+                self.rows_archived += len(batch)
+            self._cache.forget(batch[-1].id, room)
+            removed += len(batch)
+            self.rows_pruned += len(batch)
+            batches += 1
+            if batches % self.CHECKPOINT_BATCHES == 0:
+                self._checkpoint()
+            if len(batch) < self.PRUNE_BATCH:
+                break
+            time.sleep(self.PRUNE_PAUSE)
+        return removed
+
+    def _index_member(self, member: Tuple[str, int, int], batch: List[Message]):
+        segment, offset, length = member
+        cursor = self._conn.execute(
+            "INSERT INTO archive_members (segment, offset, length, first_id, last_id, rows) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (segment, offset, length, batch[0].id, batch[-1].id, len(batch)),
+        )
+        spans: Dict[str, Tuple[int, int]] = {}
+        for msg in batch:
+            span = spans.get(msg.room)
+            spans[msg.room] = (span[0], msg.id) if span else (msg.id, msg.id)
+        self._conn.executemany(
+            "INSERT INTO archive_rooms (room, last_id, first_id, member) VALUES (?, ?, ?, ?)",
+            [(room, last, first, cursor.lastrowid) for room, (first, last) in spans.items()],
+        )
+
+    def _checkpoint(self):
         with self._lock:
-            ts = time.time()
-            cursor = self._conn.execute(
-                "INSERT INTO messages (direction, room, peer_id, text, ts) VALUES (?, ?, ?, ?, ?)",
-                (direction, room, peer_id, text, ts),
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+    def _compact(self):
+        """
+        Checkpoint the WAL and, on a database created with incremental
+        auto-vacuum, return free pages to the filesystem a step at a time.
+        Older databases keep their free pages and reuse them for new rows.
+        """
+        self._checkpoint()
+        if self._auto_vacuum != 2:
+            return
+        steps = 0
+        while not self._closing:
+            with self._lock:
+                if not self._conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                    break
+                # execute() steps a statement once, which frees one page;
+                # executescript() runs it to completion.
+                self._conn.executescript(f"PRAGMA incremental_vacuum({self.VACUUM_PAGES});")
+            steps += 1
+            # Moved pages go through the WAL too; keep it from piling up.
+            if steps % self.CHECKPOINT_BATCHES == 0:
+                self._checkpoint()
+            time.sleep(self.PRUNE_PAUSE)
+        self._checkpoint()
+
+    def _archived_before(
+        self,
+        room: str,
+        before_id: Optional[int],
+        count: int,
+        above: int = 0,
+    ) -> List[Message]:
+        """
+        Newest `count` archived messages with above < id < before_id, oldest
+        first. Members are read newest-first until none left can hold a
+        newer one.
+        """
+        before = before_id if before_id is not None else _MAX_ID
+        if room == "all":
+            sql = (
+                "SELECT segment, offset, length, last_id FROM archive_members "
+                "WHERE first_id < ? AND last_id > ? ORDER BY last_id DESC"
             )
-            self._conn.commit()
-            return Message(
-                id=int(cursor.lastrowid),
+            args: Tuple = (before, above)
+        else:
+            sql = (
+                "SELECT m.segment, m.offset, m.length, r.last_id FROM archive_rooms AS r "
+                "JOIN archive_members AS m ON m.id = r.member "
+                "WHERE r.room = ? AND r.first_id < ? AND r.last_id > ? ORDER BY r.last_id DESC"
+            )
+            args = (room, before, above)
+        picked: List[Message] = []
+        try:
+            with self._reader() as conn:
+                for segment, offset, length, last_id in conn.execute(sql, args):
+                    if len(picked) >= count and last_id < picked[-1].id:
+                        break
+                    picked.extend(
+                        msg
+                        for msg in self._archive.read(segment, offset, length, None if room == "all" else room)
+                        if above < msg.id < before
+                    )
+                    picked.sort(key=lambda msg: msg.id, reverse=True)
+                    del picked[count:]
+        except OSError as exc:
+            if DEBUG:
+                print(f"[store] archive read failed: {exc}")
+        picked.reverse()
+        return picked
+
+    def retention_stats(self) -> Dict:
+        return {
+            "policies": len(self._retention_scopes()),
+            "runs": self.prune_runs,
+            "pruned": self.rows_pruned,
+            "archived": self.rows_archived,
+            "last_run_ms": round(self.last_prune_ms, 1),
+            "auto_vacuum": ("none", "full", "incremental")[self._auto_vacuum],
+            "archive": {
+                "enabled": self._archive_enabled,
+                "messages": self._archived_rows,
+                **self._archive.stats(),
+            },
+        }
+
+    # ---------------- batch writer ----------------
+
+    # Backoff between attempts to commit a failed batch (disk full, I/O
+    # error, database locked by another process).
+    WRITE_RETRY_MIN = 0.05
+    WRITE_RETRY_MAX = 5.0
+    # Attempts a failing batch still gets once close() has been called.
+    CLOSE_RETRIES = 3
+
+    def _enqueue(self, direction: str, room: str, peer_id: str, text: str) -> Message:
+        # Blocks when the writer is `queue_size` rows behind (backpressure).
+        self._slots.acquire()
+        with self._pending_cond:
+            msg = Message(
+                id=self._next_id,
                 direction=direction,
                 room=room,
                 peer_id=peer_id,
                 text=text,
-                ts=ts,
+                ts=time.time(),
             )
+            self._next_id += 1
+            self._pending.append(msg)
+            self._cache.add(msg)
+            self._pending_cond.notify_all()
+        return msg
 
-    def messages_since(self, after_id: int, room: str) -> List[Message]:
-        with self._lock:
-            if room == "all":
-                rows = self._conn.execute(
-                    "SELECT id, direction, room, peer_id, text, ts FROM messages WHERE id > ? ORDER BY id ASC",
-                    (after_id,),
-                ).fetchall()
-            else:
-                rows = self._conn.execute(
-                    "SELECT id, direction, room, peer_id, text, ts FROM messages WHERE id > ? AND room = ? ORDER BY id ASC",
-                    (after_id, room),
-                ).fetchall()
+    def _pending_matching(
+        self,
+        room: str,
+        after_id: int = 0,
+        before_id: Optional[int] = None,
+    ) -> List[Message]:
+        if not self._writer:
+            return []
+        with self._pending_cond:
             return [
-                Message(
-                    id=row[0],
-                    direction=row[1],
-                    room=row[2],
-                    peer_id=row[3],
-                    text=row[4],
-                    ts=row[5],
-                )
-                for row in rows
+                msg
+                for msg in self._pending
+                if msg.id > after_id
+                and (before_id is None or msg.id < before_id)
+                and (room == "all" or msg.room == room)
             ]
 
+    def _writer_loop(self):
+        attempts = 0
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    return
+                # Group commit: give a burst a few ms to fill the batch.
+                if not self._closing and not attempts:
+                    self._pending_cond.wait_for(
+                        lambda: len(self._pending) >= self._batch_size or self._closing,
+                        self._batch_interval,
+                    )
+                batch = self._pending[: self._batch_size]
+
+            with self._lock:
+                error = self._write_batch(batch)
+            if error is not None:
+                # The rows were already handed out (ids, UI, hot cache), so
+                # keep them pending and try again rather than drop them.
+                self.write_errors += 1
+                self.last_write_error = str(error)
+                attempts += 1
+                self.write_retrying = attempts
+                if not (self._closing and attempts > self.CLOSE_RETRIES):
+                    delay = min(self.WRITE_RETRY_MAX, self.WRITE_RETRY_MIN * 2 ** (attempts - 1))
+                    if DEBUG:
+                        print(f"[store] batch of {len(batch)} not committed ({error}); retrying in {delay:.2f}s")
+                    with self._pending_cond:
+                        if self._closing:
+                            self._pending_cond.wait(delay)
+                        else:
+                            self._pending_cond.wait_for(lambda: self._closing, delay)
+                    continue
+                self.rows_lost += len(batch)
+                if DEBUG:
+                    print(f"[store] giving up on {len(batch)} messages at shutdown: {error}")
+            elif attempts and DEBUG:
+                print(f"[store] writes recovered after {attempts} failed attempts")
+            attempts = 0
+            self.write_retrying = 0
+            with self._lock:
+                with self._pending_cond:
+                    del self._pending[: len(batch)]
+                    self._pending_cond.notify_all()
+            for _ in batch:
+                self._slots.release()
+
+    def _write_batch(self, batch: List[Message]) -> Optional[sqlite3.Error]:
+        """
+        Commit one batch; returns the error if it could not be written.
+        Caller holds the store lock.
+        """
+        rows = [(msg.id, msg.direction, msg.room, msg.peer_id, msg.text, msg.ts) for msg in batch]
+        sql = "INSERT INTO messages (id, direction, room, peer_id, text, ts) VALUES (?, ?, ?, ?, ?, ?)"
+        try:
+            self._conn.executemany(sql, rows)
+            self._conn.commit()
+        except sqlite3.IntegrityError:
+            # Retrying would fail the same way; write the rows one by one
+            # and lose only the ones that violate a constraint.
+            self._conn.rollback()
+            try:
+                written = 0
+                for row in rows:
+                    try:
+                        self._conn.execute(sql, row)
+                        written += 1
+                    except sqlite3.IntegrityError as exc:
+                        self.rows_lost += 1
+                        self.last_write_error = str(exc)
+                        if DEBUG:
+                            print(f"[store] dropped message {row[0]}: {exc}")
+                self._conn.commit()
+            except sqlite3.Error as exc:
+                self._conn.rollback()
+                return exc
+            self.batches_written += 1
+            self.rows_written += written
+            return None
+        except sqlite3.Error as exc:
+            self._conn.rollback()
+            return exc
+        self.batches_written += 1
+        self.rows_written += len(batch)
+        return None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued message has been committed.
+        """
+        if not self._writer:
+            return True
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self):
+        self._closing = True
+        self._prune_wake.set()
+        if self._backfill:
+            self._backfill.join()
+            self._backfill = None
+        if self._pruner:
+            self._pruner.join()
+            self._pruner = None
+        if self._writer:
+            with self._pending_cond:
+                self._closing = True
+                self._pending_cond.notify_all()
+            self._writer.join()
+            self._writer = None
+        with self._reader_lock:
+            # New reads fail from here on; the ones in flight finish first.
+            self._readers_closed = True
+            self._readers_idle.wait_for(lambda: not self._readers_busy)
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns = []
+            while not self._reader_pool.empty():
+                self._reader_pool.get_nowait()
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict:
+        with self._pending_cond:
+            queued = len(self._pending)
+        return {
+            "durability": self.durability,
+            "queued": queued,
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+            "write_errors": self.write_errors,
+            "write_retrying": self.write_retrying,
+            "rows_lost": self.rows_lost,
+            "last_write_error": self.last_write_error,
+            "readers": {
+                "max": self._readers,
+                "open": len(self._reader_conns),
+                "idle": self._reader_pool.qsize(),
+                "reads": self.reads_pooled,
+                "waited": self.reads_waited,
+            },
+            "cache": self._cache.stats(),
+            "search": self.search_stats(),
+            "retention": self.retention_stats(),
+        }
+
+    def lock_stats(self) -> Dict:
+        if isinstance(self._lock, TimedLock):
+            return {self._lock.name: self._lock.stats()}
+        return {}
+
     def serialize_message(self, msg: Message) -> Dict:
         return {
             "id": msg.id,
@@ -82,7 +1078,7 @@ class MessageStore:
             "peer_id": msg.peer_id,
             "text": msg.text,
             "ts": msg.ts,
-            "iso": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(msg.ts)),
+            "iso": _format_ts(int(msg.ts)),
         }
 
     def serialize_messages(self, messages: List[Message]) -> List[Dict]:
@@ -9,3 +9,13 @@ class Message:
     peer_id: str
     text: str
     ts: float
+
+
+@dataclass
+class RetentionPolicy:
+    max_age: float = 0.0    # seconds; 0 keeps messages regardless of age
+    max_rows: int = 0       # 0 keeps any number of messages
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age > 0 or self.max_rows > 0
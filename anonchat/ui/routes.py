@@ -1,15 +1,112 @@
+import json
 import secrets
+import time
+import zlib
 
-from flask import jsonify, render_template, request, send_from_directory
+from flask import Response, jsonify, render_template, request, send_from_directory
 from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 from anonchat.core.network import list_ipv4_interfaces
-from anonchat.core.room_chat import ROOM_MSG_PREFIX
-from anonchat.ui.constants import MAX_UPLOAD_BYTES, MAX_UPLOAD_MB, SHARE_DIR, UPLOAD_DIR
+from anonchat.ui.constants import (
+    HISTORY_PAGE_SIZE,
+    MAX_MESSAGE_TEXT_BYTES,
+    MAX_PAGE_SIZE,
+    MAX_UPLOAD_BYTES,
+    MAX_UPLOAD_MB,
+    SHARE_DIR,
+    STREAM_KEEPALIVE_SECONDS,
+    STREAM_WAIT_SECONDS,
+    UPLOAD_DIR,
+)
 
 
 def configure_routes(app, ui):
+    def me_payload():
+        return {
+            "id": ui.identity.anon_id,
+            "name": ui.identity.display_name(),
+            "nickname": ui.identity.nickname or "",
+        }
+
+    def announce_to_new_peers():
+        """
+        Announce our discoverable rooms to peers we have not seen before.
+        """
+        discovery = ui.discovery
+        if not discovery:
+            return
+        new_peers = ui.rooms.note_peers(set(discovery.get_peers()))
+        if new_peers:
+            for room_item in ui.rooms.get_owned_discoverable_rooms():
+                ui.rooms.announce_room(room_item, new_peers)
+
+    def encode_state(payload, fragments):
+        """
+        JSON object of payload plus `fragments`, a dict of keys whose
+        values are already-encoded JSON (the cached room and peer lists).
+        """
+        body = json.dumps(payload, separators=(",", ":"))
+        if not fragments:
+            return body
+        head = ",".join(f'"{key}":{value}' for key, value in fragments.items())
+        return "{" + head + ("," + body[1:] if payload else "}")
+
+    def state_tag() -> str:
+        """
+        ETag for /api/state: every input that can change its body.
+        """
+        return "-".join(
+            str(part)
+            for part in (
+                ui.rooms.version,
+                ui.peers_tag(),
+                ui.notifier.versions()["me"],
+                ui.messages.latest_id(),
+                ui.rooms.event_cursor(),
+                zlib.crc32(request.query_string),
+            )
+        )
+
+    def room_events_payload(cursor):
+        """
+        Room events after the reader's cursor, as the fields sent to the
+        browser: room_events, event_cursor and, when the ring buffer
+        overwrote unseen events, events_missed.
+        """
+        cursor, events, missed = ui.rooms.room_events_since(cursor)
+        payload = {"room_events": events, "event_cursor": cursor}
+        if missed:
+            payload["events_missed"] = True
+        return payload
+
+    def int_arg(name: str, default=None):
+        try:
+            return int(request.args.get(name, ""))
+        except ValueError:
+            return default
+
+    def message_page(room: str):
+        """
+        Read `after` / `before` / `limit` keyset arguments and return
+        (serialized messages, history flags). Without a forward cursor the
+        newest page comes back first, so load time does not grow with
+        history size.
+        """
+        after_id = max(0, int_arg("after", 0))
+        before_id = int_arg("before")
+        default_limit = MAX_PAGE_SIZE if after_id else HISTORY_PAGE_SIZE
+        limit = int_arg("limit", default_limit)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        if after_id and before_id is None:
+            messages, has_more = ui.messages.messages_page(room, after_id=after_id, limit=limit)
+            history = {"has_more_after": has_more}
+        else:
+            messages, has_more = ui.messages.messages_page(room, before_id=before_id, limit=limit)
+            history = {"has_more_before": has_more}
+        return ui.messages.serialize_messages(messages), history
+
     @app.errorhandler(RequestEntityTooLarge)
     def handle_large_upload(_err):
         return jsonify({"error": f"File too large (max {MAX_UPLOAD_MB} MB)"}), 413
@@ -24,43 +121,178 @@ def configure_routes(app, ui):
 
     @app.get("/api/state")
     def api_state():
-        try:
-            after_id = int(request.args.get("after", "0"))
-        except ValueError:
-            after_id = 0
-
         room = (request.args.get("room") or "all").strip()
-
-        messages = ui.messages.serialize_messages(
-            ui.messages.messages_since(after_id, room)
-        )
-
-        peers = ui.serialize_peers()
-        peer_ids = {peer["id"] for peer in peers}
-        new_peers, room_events = ui.rooms.consume_room_events(peer_ids)
-
-        rooms = ui.rooms.serialize_rooms()
-        if new_peers:
-            for room_item in ui.rooms.get_owned_discoverable_rooms():
-                ui.rooms.announce_room(room_item, new_peers)
-
-        return jsonify(
+        announce_to_new_peers()
+        ui.rooms.expire_pending()
+
+        # Most polls find nothing new: answer those from the tag alone.
+        etag = state_tag()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        messages, history = message_page(room)
+        body = encode_state(
             {
-                "me": {
-                    "id": ui.identity.anon_id,
-                    "name": ui.identity.display_name(),
-                    "nickname": ui.identity.nickname or "",
-                },
-                "rooms": rooms,
-                "peers": peers,
+                "me": me_payload(),
                 "messages": messages,
-                "room_events": room_events,
+                "history": history,
+                **room_events_payload(int_arg("events")),
                 "interface": {
                     "current": ui.current_ip,
                 },
+                "cursor": ui.messages.latest_id(),
+            },
+            {"rooms": ui.rooms.rooms_json(), "peers": ui.peers_json()},
+        )
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        # Let the browser revalidate with If-None-Match on every poll.
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @app.get("/api/messages")
+    def api_messages():
+        room = (request.args.get("room") or "all").strip()
+        messages, history = message_page(room)
+        return jsonify({"room": room, "messages": messages, "history": history})
+
+    @app.get("/api/search")
+    def api_search():
+        """
+        Full-text search over stored messages.
+
+        q: words to find (all must match; `word*` matches a prefix)
+        room: limit to one room or direct chat
+        order: `rank` (best match first, default) or `recent`
+        limit: up to 100 results
+
+        Each result is a message plus `snippet`, HTML-escaped text around
+        the matches with each match wrapped in <mark>.
+        """
+        query = (request.args.get("q") or "").strip()
+        if not query:
+            return jsonify({"error": "Missing query"}), 400
+        if not ui.messages.search_enabled:
+            return jsonify({"error": "Search is disabled"}), 503
+        room = (request.args.get("room") or "").strip() or None
+        order = request.args.get("order") or "rank"
+        if order not in ("rank", "recent"):
+            return jsonify({"error": "order must be rank or recent"}), 400
+
+        start = time.perf_counter()
+        results = ui.messages.search(query, room=room, limit=int_arg("limit", 20), order=order)
+        took = time.perf_counter() - start
+        return jsonify(
+            {
+                "query": query,
+                "room": room or "all",
+                "order": order,
+                "results": [
+                    {**ui.messages.serialize_message(msg), "snippet": snippet}
+                    for msg, snippet in results
+                ],
+                "took_ms": round(took * 1000, 2),
             }
         )
 
+    @app.get("/api/stream")
+    def api_stream():
+        """
+        Server-Sent Events feed of state deltas.
+
+        Each event carries only the sections that changed since the last
+        one; `messages` covers every room after the cursor. The cursor is
+        also sent as the event id so EventSource resumes via Last-Event-ID.
+        """
+        raw_cursor = request.headers.get("Last-Event-ID") or request.args.get("after")
+        try:
+            cursor = int(raw_cursor) if raw_cursor else ui.messages.latest_id()
+        except ValueError:
+            cursor = ui.messages.latest_id()
+
+        receipt_cursor = ui.outbox.receipt_cursor()
+        # Reconnects reuse the original URL, so this may be stale; the
+        # browser drops events at or below its own cursor.
+        event_cursor = int_arg("events")
+        if event_cursor is None:
+            event_cursor = ui.rooms.event_cursor()
+
+        def generate():
+            nonlocal cursor, receipt_cursor, event_cursor
+            seen = {}
+            last_write = time.monotonic()
+            while True:
+                current = ui.notifier.wait(seen, STREAM_WAIT_SECONDS)
+                if current == seen:
+                    ui.rooms.expire_pending()
+                    if time.monotonic() - last_write >= STREAM_KEEPALIVE_SECONDS:
+                        last_write = time.monotonic()
+                        yield ": keepalive\n\n"
+                    continue
+
+                changed = {topic for topic, version in current.items() if seen.get(topic) != version}
+                seen = current
+                payload = {}
+                fragments = {}
+                if "messages" in changed:
+                    messages = ui.messages.messages_since(cursor, "all", MAX_PAGE_SIZE + 1)
+                    has_more = len(messages) > MAX_PAGE_SIZE
+                    messages = messages[:MAX_PAGE_SIZE]
+                    if messages:
+                        cursor = messages[-1].id
+                        payload["messages"] = ui.messages.serialize_messages(messages)
+                    if has_more:
+                        # Let the next round send the rest without waiting.
+                        seen["messages"] = -1
+                if changed & {"peers", "rooms"}:
+                    announce_to_new_peers()
+                    fragments["peers"] = ui.peers_json()
+                if "rooms" in changed:
+                    fragments["rooms"] = ui.rooms.rooms_json()
+                    events = room_events_payload(event_cursor)
+                    event_cursor = events["event_cursor"]
+                    if events["room_events"] or events.get("events_missed"):
+                        payload.update(events)
+                if "deliveries" in changed:
+                    receipt_cursor, deliveries = ui.outbox.receipts_since(receipt_cursor)
+                    if deliveries:
+                        payload["receipts"] = [
+                            {"id": delivery.message_id, "counts": delivery.counts()}
+                            for delivery in deliveries
+                        ]
+                if "me" in changed:
+                    payload["me"] = me_payload()
+                    payload["interface"] = {"current": ui.current_ip}
+                if not payload and not fragments:
+                    continue
+
+                last_write = time.monotonic()
+                data = encode_state(payload, fragments)
+                yield f"id: {cursor}\nevent: state\ndata: {data}\n\n"
+
+        return Response(
+            generate(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.get("/api/metrics")
+    def api_metrics():
+        payload = {
+            "store": ui.messages.stats(),
+            "outbox": ui.outbox.stats(),
+            "uploads": ui.uploads.stats(),
+            "locks": ui.lock_stats(),
+        }
+        if ui.discovery:
+            payload["transport"] = ui.discovery.transport.stats()
+            payload["discovery"] = ui.discovery.stats()
+        if ui.chat:
+            payload["chat"] = ui.chat.stats()
+        return jsonify(payload)
+
     @app.post("/api/send")
     def api_send():
         if not ui.chat:
@@ -72,36 +304,48 @@ def configure_routes(app, ui):
 
         if not text:
             return jsonify({"error": "Message is empty"}), 400
-
-        try:
-            if room == "all":
-                sent = ui.chat.send_to_all(text)
-                ui.messages.store("out", "all", "all", text)
-                return jsonify({"ok": True, "sent": sent})
-
+        if len(text.encode("utf-8")) > MAX_MESSAGE_TEXT_BYTES:
+            return jsonify({"error": f"Message too long (max {MAX_MESSAGE_TEXT_BYTES // 1024} KB)"}), 413
+
+        if ui.outbox.saturated():
+            return jsonify({"error": "Send queue full, try again shortly"}), 503
+
+        # Persist, then queue: the outbox seals and sends on its own
+        # thread and records per-recipient status under the message id.
+        if room == "all":
+            msg = ui.messages.store("out", "all", "all", text)
+            delivery = ui.outbox.new_delivery(msg.id)
+            ui.outbox.send_to_all(text, delivery=delivery)
+        else:
             room_obj = ui.rooms.get_room(room)
-
             if room_obj:
                 if not room_obj.joined:
                     return jsonify({"error": "Join the room before sending"}), 403
-                members = set(room_obj.members)
-                if not members and room_obj.owner_id:
-                    members.add(room_obj.owner_id)
-                payload = f"{ROOM_MSG_PREFIX}{room_obj.id}::{text}"
-                sent = 0
-                for peer_id in members:
-                    if peer_id == ui.identity.anon_id:
-                        continue
-                    ui.chat.send_to_peer(peer_id, payload)
-                    sent += 1
-                ui.messages.store("out", room_obj.id, room_obj.id, text)
-                return jsonify({"ok": True, "sent": sent})
-
-            ui.chat.send_to_peer(room, text)
-            ui.messages.store("out", room, room, text)
-            return jsonify({"ok": True, "sent": 1})
-        except ValueError:
-            return jsonify({"error": f"Unknown peer: {room}"}), 400
+                msg = ui.messages.store("out", room_obj.id, room_obj.id, text)
+                delivery = ui.outbox.new_delivery(msg.id)
+                ui.rooms.send_room_message(room_obj, text, delivery=delivery)
+            else:
+                if ui.chat.discovery.get_peer(room) is None:
+                    return jsonify({"error": f"Unknown peer: {room}"}), 400
+                msg = ui.messages.store("out", room, room, text)
+                delivery = ui.outbox.new_delivery(msg.id)
+                ui.outbox.send_to_peer(room, text, delivery=delivery)
+
+        return jsonify(
+            {
+                "ok": True,
+                "id": msg.id,
+                "sent": len(delivery.recipients),
+                "delivery": delivery.serialize(),
+            }
+        )
+
+    @app.get("/api/deliveries/<int:message_id>")
+    def api_delivery(message_id: int):
+        delivery = ui.outbox.get_delivery(message_id)
+        if delivery is None:
+            return jsonify({"error": "Unknown message"}), 404
+        return jsonify(delivery.serialize())
 
     @app.post("/api/nickname")
     def api_nickname():
@@ -112,6 +356,9 @@ def configure_routes(app, ui):
             return jsonify({"error": "Nickname too long (max 32)"}), 400
 
         ui.identity.nickname = nickname or None
+        ui.notifier.bump("me")
+        if ui.discovery:
+            ui.discovery.announce()
         return jsonify(
             {
                 "ok": True,
@@ -215,6 +462,18 @@ def configure_routes(app, ui):
         status, response = ui.rooms.kick_member(room_id, member_id)
         return jsonify(response), status
 
+    def share_url(safe_room: str, target_name: str) -> str:
+        host = request.host.split(":")[0]
+        port = request.host.split(":")[1] if ":" in request.host else "80"
+        scheme = request.scheme or "http"
+        ip = ui.current_ip or host
+        if ip.startswith("127.") or ip == "localhost":
+            for _, candidate in list_ipv4_interfaces():
+                if not candidate.startswith("127."):
+                    ip = candidate
+                    break
+        return f"{scheme}://{ip}:{port}/share/{safe_room}/{target_name}"
+
     @app.post("/api/upload")
     def api_upload():
         if "file" not in request.files:
@@ -241,29 +500,74 @@ def configure_routes(app, ui):
         target_path = room_dir / target_name
         file.save(target_path)
 
-        host = request.host.split(":")[0]
-        port = request.host.split(":")[1] if ":" in request.host else "80"
-        scheme = request.scheme or "http"
-        ip = ui.current_ip or host
-        if ip.startswith("127.") or ip == "localhost":
-            for _, candidate in list_ipv4_interfaces():
-                if not candidate.startswith("127."):
-                    ip = candidate
-                    break
-        url = f"{scheme}://{ip}:{port}/share/{safe_room}/{target_name}"
-
         return jsonify(
             {
                 "ok": True,
                 "name": safe_name,
                 "size": target_path.stat().st_size,
                 "mime": file.mimetype or "application/octet-stream",
-                "url": url,
+                "url": share_url(safe_room, target_name),
             }
         )
 
+    # Chunked uploads: init, PUT each chunk at its offset (any order, in
+    # parallel), finish. GET lists missing chunks to resume after a drop.
+
+    @app.post("/api/upload/init")
+    def api_upload_init():
+        payload = request.get_json(silent=True) or {}
+        try:
+            size = int(payload.get("size"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Missing size"}), 400
+        status, response = ui.uploads.init(
+            name=str(payload.get("name") or ""),
+            size=size,
+            room=str(payload.get("room") or "all").strip() or "all",
+            mime=str(payload.get("mime") or ""),
+            sha256=payload.get("sha256"),
+        )
+        return jsonify(response), status
+
+    @app.get("/api/upload/<upload_id>")
+    def api_upload_status(upload_id: str):
+        status, response = ui.uploads.status(upload_id)
+        return jsonify(response), status
+
+    @app.put("/api/upload/<upload_id>")
+    def api_upload_chunk(upload_id: str):
+        offset = int_arg("offset")
+        if offset is None:
+            return jsonify({"error": "Missing offset"}), 400
+        # request.stream reads the raw body as it arrives, without form
+        # parsing or buffering the chunk in memory.
+        status, response = ui.uploads.write_chunk(upload_id, offset, request.content_length, request.stream)
+        return jsonify(response), status
+
+    @app.post("/api/upload/<upload_id>/finish")
+    def api_upload_finish(upload_id: str):
+        status, response = ui.uploads.finish(upload_id)
+        if status == 200:
+            response = {
+                "ok": True,
+                "name": response["name"],
+                "size": response["size"],
+                "mime": response["mime"],
+                "sha256": response["sha256"],
+                "url": share_url(response["room"], response["file"]),
+            }
+        return jsonify(response), status
+
+    @app.delete("/api/upload/<upload_id>")
+    def api_upload_cancel(upload_id: str):
+        status, response = ui.uploads.cancel(upload_id)
+        return jsonify(response), status
+
     @app.get("/share/<path:filename>")
     def share_serve(filename: str):
+        # Hidden files are uploads still in progress.
+        if any(part.startswith(".") for part in filename.split("/")):
+            return jsonify({"error": "Not found"}), 404
         return send_from_directory(SHARE_DIR, filename, as_attachment=False)
 
     @app.get("/uploads/<path:filename>")
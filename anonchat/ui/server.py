@@ -1,14 +1,31 @@
 from __future__ import annotations
 
+import json
 import threading
+import time
+from pathlib import Path
 from typing import Callable, Optional
 
 from flask import Flask
 
+from anonchat.config.settings import Settings
+from anonchat.core.locks import TimedLock
 from anonchat.core.room_chat import ROOM_CTL_PREFIX, ROOM_MSG_PREFIX, RoomManager
-from anonchat.ui.constants import MAX_UPLOAD_BYTES, SHARE_DIR, STATIC_DIR, TEMPLATES_DIR, UPLOAD_DIR
-from anonchat.ui.message_store import MessageStore
+from anonchat.messaging.outbox import Outbox
+from anonchat.ui.constants import (
+    MAX_UPLOAD_BYTES,
+    PEER_SEEN_RESOLUTION_SECONDS,
+    SHARE_DIR,
+    STATIC_DIR,
+    TEMPLATES_DIR,
+    UPLOAD_CHUNK_BYTES,
+    UPLOAD_DIR,
+)
+from anonchat.ui.message_store import MessageStore, parse_room_retention
+from anonchat.ui.models import RetentionPolicy
 from anonchat.ui.routes import configure_routes
+from anonchat.ui.state_stream import StateNotifier
+from anonchat.ui.uploads import UploadManager
 
 
 class UIServer:
@@ -26,7 +43,10 @@ class UIServer:
         identity,
         upstream_on_message: Optional[Callable] = None,
         on_set_interface: Optional[Callable[[str], bool]] = None,
+        settings: Optional[Settings] = None,
+        db_path: Optional[Path] = None,
     ):
+        self.settings = settings or Settings()
         self.chat = chat
         self.discovery = discovery
         self.identity = identity
@@ -34,18 +54,53 @@ class UIServer:
         self.on_set_interface = on_set_interface
 
         self.current_ip: Optional[str] = None
+        # (peers_tag, JSON array) of the last serialized peer list.
+        self._peers_json = ("", "[]")
 
-        self._lock = threading.Lock()
-        self.messages = MessageStore(self._lock)
+        self.notifier = StateNotifier()
+        # Storage, room state and the room event log each have their own
+        # lock (see MessageStore and RoomManager); this one only guards the
+        # chat/discovery swap in attach().
+        self._lock = TimedLock("ui")
+        self.messages = MessageStore(
+            db_path=db_path,
+            on_store=lambda _msg: self.notifier.bump("messages"),
+            durability=self.settings.db_durability,
+            batch_size=self.settings.db_batch_size,
+            batch_interval=self.settings.db_batch_ms / 1000.0,
+            readers=self.settings.db_readers,
+            search=self.settings.search_mode,
+            retention=RetentionPolicy(
+                max_age=self.settings.retention_days * 86400,
+                max_rows=self.settings.retention_rows,
+            ),
+            room_retention=parse_room_retention(self.settings.retention_rooms),
+            archive=self.settings.archive,
+            cache_room_bytes=self.settings.cache_room_kb * 1024,
+            cache_total_bytes=self.settings.cache_total_mb * 1024 * 1024,
+        )
+        # Outbound messages are queued here and sealed/sent on its thread.
+        self.outbox = Outbox(self.chat, on_receipt=lambda _delivery: self.notifier.bump("deliveries"))
+        self.outbox.start()
         self.rooms = RoomManager(
-            lock=self._lock,
+            lock=None,
             identity=self.identity,
             chat=self.chat,
             store_message=self.messages.store,
+            on_change=lambda: self.notifier.bump("rooms"),
+            outbox=self.outbox,
         )
+        if self.discovery:
+            self.discovery.set_peer_handler(self._on_peers_changed)
+            self.discovery.set_expiry_handler(self._on_peers_expired)
 
         SHARE_DIR.mkdir(parents=True, exist_ok=True)
         UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        self.uploads = UploadManager(
+            SHARE_DIR,
+            max_bytes=self.settings.upload_max_mb * 1024 * 1024,
+            chunk_size=UPLOAD_CHUNK_BYTES,
+        )
 
         self.app = Flask(
             __name__,
@@ -72,6 +127,16 @@ class UIServer:
         thread.start()
         return thread
 
+    def flush(self):
+        """
+        Commit queued message writes (called when the network stack stops).
+        """
+        self.messages.flush()
+
+    def close(self):
+        self.outbox.close()
+        self.messages.close()
+
     def attach(self, chat, discovery):
         """
         Swap chat/discovery references (used after interface switch).
@@ -80,14 +145,54 @@ class UIServer:
             self.chat = chat
             self.discovery = discovery
             self.rooms.update_chat(chat)
+        self.outbox.update_chat(chat)
+        if discovery:
+            discovery.set_peer_handler(self._on_peers_changed)
+            discovery.set_expiry_handler(self._on_peers_expired)
+        self.notifier.bump("peers")
         return self
 
     def set_current_ip(self, ip: str):
         self.current_ip = ip
+        self.notifier.bump("me")
         return self
 
     # ---------------- discovery ----------------
 
+    def _on_peers_changed(self):
+        self.notifier.bump("peers")
+
+    def _on_peers_expired(self, peer_ids):
+        self.rooms.forget_peers(peer_ids)
+        if self.chat and self.chat.reliability:
+            self.chat.reliability.forget(peer_ids)
+
+    def peers_tag(self) -> str:
+        """
+        Changes whenever serialize_peers() would: a new discovery, a new
+        peer snapshot, or (for last_seen) every PEER_SEEN_RESOLUTION_SECONDS.
+        """
+        discovery = self.discovery
+        if not discovery:
+            return "0"
+        bucket = int(time.time() // PEER_SEEN_RESOLUTION_SECONDS)
+        return f"{id(discovery):x}.{discovery.snapshot.version}.{bucket}"
+
+    def peers_json(self) -> str:
+        tag = self.peers_tag()
+        cached_tag, cached = self._peers_json
+        if cached_tag == tag:
+            return cached
+        cached = json.dumps(self.serialize_peers(), separators=(",", ":"))
+        self._peers_json = (tag, cached)
+        return cached
+
+    def lock_stats(self):
+        stats = {self._lock.name: self._lock.stats()}
+        stats.update(self.messages.lock_stats())
+        stats.update(self.rooms.lock_stats())
+        return stats
+
     def serialize_peers(self):
         if not self.discovery:
             return []
@@ -95,12 +200,12 @@ class UIServer:
         peers = self.discovery.get_peers()
         return [
             {
-                "id": peer_id,
-                "ip": ip,
-                "last_seen": last_seen,
-                "nickname": nickname or "",
+                "id": peer.peer_id,
+                "ip": peer.ip,
+                "last_seen": peer.last_seen,
+                "nickname": peer.nick or "",
             }
-            for peer_id, (ip, last_seen, _, nickname) in peers.items()
+            for peer in peers.values()
         ]
 
     # ---------------- inbound hook ----------------
@@ -126,6 +231,14 @@ class UIServer:
         if self.upstream_on_message:
             self.upstream_on_message(sender_id, message)
 
+    def on_group_message(self, sender_id: str, room_id: str, key_epoch: int, message: str):
+        """
+        Hook for room messages sealed with a room key.
+        """
+        result = self.rooms.handle_group_message(sender_id, room_id, key_epoch, message)
+        if result and self.upstream_on_message:
+            self.upstream_on_message(sender_id, f"[room {room_id}] {message}")
+
 
 def run_ui_server(
     chat,
@@ -135,6 +248,7 @@ def run_ui_server(
     host: str = "127.0.0.1",
     port: int = 5000,
     on_set_interface: Optional[Callable[[str], bool]] = None,
+    settings: Optional[Settings] = None,
 ) -> UIServer:
     """
     Convenience helper.
@@ -145,6 +259,7 @@ def run_ui_server(
         identity=identity,
         upstream_on_message=upstream_on_message,
         on_set_interface=on_set_interface,
+        settings=settings,
     )
     ui.run(host=host, port=port)
     return ui
@@ -0,0 +1,36 @@
+import threading
+from typing import Dict, Optional
+
+
+class StateNotifier:
+    """
+    Version counters for the parts of UI state that browsers watch.
+
+    Producers (message store, rooms, discovery) bump a topic when it
+    changes; stream readers block until any topic moves past the
+    versions they last sent.
+    """
+
+    TOPICS = ("messages", "rooms", "peers", "me", "deliveries")
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._versions: Dict[str, int] = {topic: 0 for topic in self.TOPICS}
+
+    def bump(self, topic: str):
+        with self._cond:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            self._cond.notify_all()
+
+    def versions(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._versions)
+
+    def wait(self, seen: Dict[str, int], timeout: Optional[float] = None) -> Dict[str, int]:
+        """
+        Block until the versions differ from `seen` or the timeout passes.
+        Returns the current versions either way.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions != seen, timeout)
+            return dict(self._versions)
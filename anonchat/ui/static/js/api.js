@@ -4,47 +4,23 @@ async function fetchState(force = false) {
     if (state.fetching) return;
     state.fetching = true;
     try {
-        const res = await fetch(`/api/state?after=${force ? 0 : state.lastId}&room=${encodeURIComponent(state.room)}`);
+        const res = await fetch(`/api/state?after=${force ? 0 : state.lastId}&room=${encodeURIComponent(state.room)}${eventQuery('&')}`);
         if (!res.ok) return;
         const data = await res.json();
 
-        let navDirty = false;
-        if (data.me && data.me.id) {
-            state.meId = data.me.id;
-        }
-        state.rooms = Array.isArray(data.rooms) ? data.rooms : [];
-        state.peers = data.peers || [];
-        navDirty = true;
-        const activeRoom = roomById(state.room);
-        if (activeRoom && !activeRoom.joined && !activeRoom.pending) {
-            switchRoom('all');
-            return;
+        if (typeof data.cursor === 'number' && !state.streamCursor) {
+            state.streamCursor = data.cursor;
         }
+        if (!applyState(data)) return;
 
-        if (data.me) {
-            if (data.me.id) {
-                state.meId = data.me.id;
-            }
-            if (data.me.name && els.userName) {
-                els.userName.textContent = data.me.name;
-            }
-            if (typeof data.me.nickname === 'string' && els.nicknameInput) {
-                const isEditing = document.activeElement === els.nicknameInput;
-                if (!isEditing) {
-                    els.nicknameInput.value = data.me.nickname;
-                }
-            }
-        }
-
-        if (data.interface && data.interface.current) {
-            state.currentInterface = data.interface.current;
-            if (state.interfaces.length) {
-                renderInterfaceMenu(state.interfaces);
-            }
-            updateHomeSummary(state.peers);
+        const history = data.history || {};
+        if (typeof history.has_more_before === 'boolean' && (force || !state.lastId)) {
+            state.hasMoreBefore = history.has_more_before;
+            state.oldestId = data.messages && data.messages.length ? data.messages[0].id : 0;
         }
 
         if (data.messages && data.messages.length) {
+            let navDirty = false;
             data.messages.forEach(msg => {
                 if (addMessage(msg)) {
                     navDirty = true;
@@ -52,23 +28,172 @@ async function fetchState(force = false) {
             });
             state.lastId = data.messages[data.messages.length - 1].id;
             state.sidebarLastId = Math.max(state.sidebarLastId, state.lastId);
+            if (navDirty) {
+                renderNav(state.rooms, state.peers);
+            }
         }
-
-        if (data.room_events && data.room_events.length) {
-            handleRoomEvents(data.room_events);
-        }
-        if (navDirty) {
-            renderNav(state.rooms, state.peers);
+        if (history.has_more_after) {
+            setTimeout(fetchState, 0);
         }
     } finally {
         state.fetching = false;
+        flushStreamBacklog();
+    }
+}
+
+async function loadOlderMessages() {
+    if (state.loadingOlder || !state.hasMoreBefore || !state.oldestId) return;
+    state.loadingOlder = true;
+    const room = state.room;
+    try {
+        const res = await fetch(`/api/messages?room=${encodeURIComponent(room)}&before=${state.oldestId}&limit=${HISTORY_PAGE_SIZE}`);
+        if (!res.ok) return;
+        const data = await res.json();
+        if (room !== state.room) return;
+        const messages = data.messages || [];
+        if (messages.length) {
+            prependMessages(messages);
+            state.oldestId = messages[0].id;
+        }
+        state.hasMoreBefore = Boolean(data.history && data.history.has_more_before);
+    } finally {
+        state.loadingOlder = false;
+    }
+}
+
+function applyState(data) {
+    let navDirty = false;
+    if (Array.isArray(data.rooms)) {
+        state.rooms = data.rooms;
+        navDirty = true;
+    }
+    if (Array.isArray(data.peers)) {
+        state.peers = data.peers;
+        navDirty = true;
+    }
+    const activeRoom = roomById(state.room);
+    if (activeRoom && !activeRoom.joined && !activeRoom.pending) {
+        switchRoom('all');
+        return false;
+    }
+
+    if (data.me) {
+        if (data.me.id) {
+            state.meId = data.me.id;
+        }
+        if (data.me.name && els.userName) {
+            els.userName.textContent = data.me.name;
+        }
+        if (typeof data.me.nickname === 'string' && els.nicknameInput) {
+            const isEditing = document.activeElement === els.nicknameInput;
+            if (!isEditing) {
+                els.nicknameInput.value = data.me.nickname;
+            }
+        }
+    }
+
+    if (data.interface && data.interface.current) {
+        state.currentInterface = data.interface.current;
+        if (state.interfaces.length) {
+            renderInterfaceMenu(state.interfaces);
+        }
+        updateHomeSummary(state.peers);
+    }
+
+    handleRoomEvents(takeRoomEvents(data));
+    if (Array.isArray(data.receipts)) {
+        applyReceipts(data.receipts);
+    }
+    if (navDirty) {
+        renderNav(state.rooms, state.peers);
+    }
+    return true;
+}
+
+function startStream() {
+    if (typeof EventSource === 'undefined') {
+        startPolling();
+        return;
+    }
+    const params = [];
+    if (state.streamCursor) params.push(`after=${state.streamCursor}`);
+    if (state.eventCursor !== null) params.push(`events=${state.eventCursor}`);
+    const query = params.length ? `?${params.join('&')}` : '';
+    const source = new EventSource(`/api/stream${query}`);
+    let opened = false;
+    source.onopen = () => {
+        opened = true;
+    };
+    source.addEventListener('state', e => {
+        let data;
+        try {
+            data = JSON.parse(e.data);
+        } catch (err) {
+            return;
+        }
+        applyState(data);
+        if (data.messages && data.messages.length) {
+            applyStreamMessages(data.messages);
+        }
+    });
+    source.onerror = () => {
+        // EventSource retries on its own; only give up when it stops trying
+        // or the endpoint never worked at all.
+        if (!opened || source.readyState === EventSource.CLOSED) {
+            source.close();
+            startPolling();
+        }
+    };
+    state.stream = source;
+}
+
+function startPolling() {
+    if (state.pollTimers.length) return;
+    state.stream = null;
+    state.pollTimers.push(setInterval(fetchSidebarState, 2000));
+    state.pollTimers.push(setInterval(fetchState, 1000));
+}
+
+function applyStreamMessages(messages) {
+    let navDirty = false;
+    messages.forEach(msg => {
+        state.streamCursor = Math.max(state.streamCursor, msg.id);
+        state.sidebarLastId = Math.max(state.sidebarLastId, msg.id);
+        const msgRoom = msg.room || msg.peer_id;
+        if (state.room === 'all' || msgRoom === state.room) {
+            if (state.fetching) {
+                state.streamBacklog.push(msg);
+                return;
+            }
+            if (msg.id <= state.lastId) return;
+            if (addMessage(msg)) {
+                navDirty = true;
+            }
+            state.lastId = msg.id;
+            return;
+        }
+        if (msg.direction !== 'in') return;
+        if (incrementUnread(msgRoom)) {
+            navDirty = true;
+        }
+        addNotification(msg);
+    });
+    if (navDirty) {
+        renderNav(state.rooms, state.peers);
     }
 }
 
+function flushStreamBacklog() {
+    if (!state.streamBacklog.length) return;
+    const backlog = state.streamBacklog;
+    state.streamBacklog = [];
+    applyStreamMessages(backlog);
+}
+
 async function fetchSidebarState() {
     if (state.room === 'all') return;
     try {
-        const res = await fetch(`/api/state?after=${state.sidebarLastId}&room=all`);
+        const res = await fetch(`/api/state?after=${state.sidebarLastId}&room=all${eventQuery('&')}`);
         if (!res.ok) return;
         const data = await res.json();
 
@@ -98,9 +223,7 @@ async function fetchSidebarState() {
             state.sidebarLastId = data.messages[data.messages.length - 1].id;
         }
 
-        if (data.room_events && data.room_events.length) {
-            handleRoomEvents(data.room_events);
-        }
+        handleRoomEvents(takeRoomEvents(data));
         if (navDirty) {
             renderNav(state.rooms, state.peers);
         }
@@ -119,13 +242,21 @@ async function sendPayload(text) {
         room: state.room,
         optimistic: true
     });
+    const bubble = state.lastOptimistic;
 
     await fetch('/api/send', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ room: state.room, text })
     }).then(async res => {
-        if (res.ok) return;
+        if (res.ok) {
+            const data = await res.json().catch(() => ({}));
+            if (bubble && data.id) {
+                bubble.dataset.msgId = data.id;
+                markReceipt(bubble, state.receipts[data.id]);
+            }
+            return;
+        }
         try {
             const data = await res.json();
             showToast(data.error || 'Send failed');
@@ -159,26 +290,81 @@ function insertEmoji(emoji) {
     input.dispatchEvent(new Event('input', { bubbles: true }));
 }
 
-async function uploadFile(file) {
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('room', state.room || 'all');
-    const res = await fetch('/api/upload', {
+async function uploadRequest(url, options) {
+    const res = await fetch(url, options);
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok) {
+        const err = new Error(data.error || 'Upload failed');
+        err.status = res.status;
+        throw err;
+    }
+    return data;
+}
+
+function uploadResumeKey(file, room) {
+    return `upload:${room}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function startUpload(file, room) {
+    // Picking the same file again after a failure resumes that upload.
+    const key = uploadResumeKey(file, room);
+    const saved = localStorage.getItem(key);
+    if (saved) {
+        try {
+            return { key, ...(await uploadRequest(`/api/upload/${saved}`)) };
+        } catch (err) {
+            localStorage.removeItem(key);
+        }
+    }
+    const created = await uploadRequest('/api/upload/init', {
         method: 'POST',
-        body: formData
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ name: file.name, size: file.size, mime: file.type, room })
     });
-    const data = await res.json();
-    if (!res.ok) {
-        throw new Error(data.error || 'Upload failed');
+    localStorage.setItem(key, created.id);
+    return { key, ...created };
+}
+
+async function putChunk(upload, file, index) {
+    const start = index * upload.chunk_size;
+    const body = file.slice(start, Math.min(file.size, start + upload.chunk_size));
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await uploadRequest(`/api/upload/${upload.id}?offset=${start}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body
+            });
+        } catch (err) {
+            // Network errors, 5xx and 409 (a dropped copy still draining) are worth retrying.
+            const retryable = !err.status || err.status >= 500 || err.status === 409;
+            if (!retryable || attempt >= UPLOAD_RETRIES) throw err;
+            await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+        }
     }
+}
+
+async function uploadFile(file) {
+    const upload = await startUpload(file, state.room || 'all');
+    const queue = upload.missing.slice();
+    const total = Math.ceil(file.size / upload.chunk_size);
+    let done = total - queue.length;
+    const worker = async () => {
+        while (queue.length) {
+            await putChunk(upload, file, queue.shift());
+            done += 1;
+            if (total > 1) {
+                showToast(`Uploading ${file.name}: ${Math.floor(done * 100 / total)}%`);
+            }
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(UPLOAD_PARALLEL, queue.length) }, worker));
+    const data = await uploadRequest(`/api/upload/${upload.id}/finish`, { method: 'POST' });
+    localStorage.removeItem(upload.key);
     return data;
 }
 
 async function sendFile(file) {
-    if (file.size > MAX_UPLOAD_BYTES) {
-        showToast(`File too large (max ${MAX_UPLOAD_LABEL})`);
-        return;
-    }
     try {
         const uploaded = await uploadFile(file);
         const payload = {
@@ -207,6 +393,30 @@ function toggleEmojiPicker(force) {
     els.emojiPicker.classList.toggle('hidden', !shouldShow);
 }
 
+function eventQuery(sep) {
+    return state.eventCursor === null ? '' : `${sep}events=${state.eventCursor}`;
+}
+
+// Room events are a shared log on the server; every poll and the stream
+// read it with the same cursor, so each event is shown once per tab.
+function takeRoomEvents(data) {
+    const events = Array.isArray(data.room_events) ? data.room_events : [];
+    const cursor = state.eventCursor;
+    const fresh = cursor === null ? events : events.filter(event => event.seq > cursor);
+    if (typeof data.event_cursor === 'number') {
+        // Never moves back: a poll answered before the stream advanced can
+        // arrive late. The server seeds its log from boot time, so after a
+        // restart its cursor is still ahead of ours.
+        state.eventCursor = Math.max(cursor || 0, data.event_cursor);
+    }
+    if (data.events_missed) {
+        // Fell behind the server's buffer; the room list itself is full
+        // state, only the notifications are gone.
+        showToast('Some room notifications were missed');
+    }
+    return fresh;
+}
+
 function handleRoomEvents(events) {
     events.forEach(event => {
         if (event.type === 'room_joined') {
@@ -363,6 +573,9 @@ async function kickMember(roomId, memberId) {
 }
 
 function handleFeedScroll() {
+    if (els.feed.scrollTop < 120) {
+        loadOlderMessages();
+    }
     if (isNearBottom()) {
         if (!state.autoScroll) {
             state.autoScroll = true;
@@ -7,12 +7,17 @@ const ICONS = {
 };
 
 const EMOJI_PICKER = ['😀', '😄', '😂', '😊', '😍', '😎', '👍', '🔥', '✨', '🎉'];
-const MAX_UPLOAD_BYTES = 10 * 1024 * 1024;
-const MAX_UPLOAD_LABEL = '10 MB';
+// Chunks of one upload sent at once, and retries per chunk.
+const UPLOAD_PARALLEL = 4;
+const UPLOAD_RETRIES = 5;
+const HISTORY_PAGE_SIZE = 100;
 
 const state = {
     room: 'all',
     lastId: 0,
+    oldestId: 0,
+    hasMoreBefore: false,
+    loadingOlder: false,
     fetching: false,
     autoScroll: true,
     unread: 0,
@@ -24,13 +29,20 @@ const state = {
     currentInterface: '',
     interfaces: [],
     pendingOut: [],
+    lastOptimistic: null,
+    receipts: {},
+    eventCursor: null,
     unreadByRoom: {},
     sidebarLastId: 0,
     notifications: [],
     blockedPeers: new Set(),
     meId: '',
     mutedRooms: new Set(),
-    memberPopover: null
+    memberPopover: null,
+    stream: null,
+    streamCursor: 0,
+    streamBacklog: [],
+    pollTimers: []
 };
 
 const els = {
@@ -309,6 +309,4 @@ loadMutedRooms();
 updateRoomActionUI();
 renderNav(state.rooms, state.peers);
 loadInterfaces();
-setInterval(fetchSidebarState, 2000);
-setInterval(fetchState, 1000);
-fetchState(true);
+fetchState(true).then(startStream);
@@ -112,20 +112,23 @@ function buildBubbleContent(bubble, payload) {
     return payload.text || '';
 }
 
-function addMessage(msg) {
+function renderBubble(container, msg) {
     const isOut = msg.direction === 'out';
-    const msgRoom = msg.room || state.room;
-    if (!msg.optimistic && isOut && consumePending(msg.text, msgRoom)) {
-        return;
-    }
     const groupKey = `${msg.direction}:${msg.peer_id}`;
     const bubble = document.createElement('div');
     bubble.className = `bubble ${isOut ? 'out' : 'in'}`;
     const payload = parsePayload(msg.text);
     const filterText = buildBubbleContent(bubble, payload);
     bubble.title = `${isOut ? 'You' : msg.peer_id.substring(0, 8)} - ${relativeTime(msg.ts)}`;
+    if (msg.id) {
+        bubble.dataset.msgId = msg.id;
+        markReceipt(bubble, state.receipts[msg.id]);
+    }
+    if (msg.optimistic) {
+        state.lastOptimistic = bubble;
+    }
 
-    let group = els.feed.lastElementChild;
+    let group = container.lastElementChild;
     if (!group || !group.classList.contains('bubble-group') || group.dataset.groupKey !== groupKey) {
         group = document.createElement('div');
         group.className = isOut ? 'bubble-group out' : 'bubble-group';
@@ -140,13 +143,44 @@ function addMessage(msg) {
             group.appendChild(meta);
         }
 
-        els.feed.appendChild(group);
+        container.appendChild(group);
     } else {
         group.dataset.text += ` ${(filterText || '').toLowerCase()}`;
     }
 
     group.appendChild(bubble);
-    state.lastGroupKey = groupKey;
+    return groupKey;
+}
+
+function markReceipt(bubble, counts) {
+    if (!counts) return;
+    const total = Object.values(counts).reduce((sum, n) => sum + n, 0);
+    if (total && (counts.delivered || 0) === total) {
+        bubble.dataset.receipt = 'delivered';
+    } else if (counts.failed || counts.dropped) {
+        bubble.dataset.receipt = 'failed';
+    }
+}
+
+function applyReceipts(receipts) {
+    receipts.forEach(receipt => {
+        state.receipts[receipt.id] = receipt.counts;
+        const bubble = els.feed.querySelector(`.bubble[data-msg-id="${receipt.id}"]`);
+        if (bubble) markReceipt(bubble, receipt.counts);
+    });
+    const ids = Object.keys(state.receipts);
+    if (ids.length > 500) {
+        ids.slice(0, ids.length - 500).forEach(id => delete state.receipts[id]);
+    }
+}
+
+function addMessage(msg) {
+    const isOut = msg.direction === 'out';
+    const msgRoom = msg.room || state.room;
+    if (!msg.optimistic && isOut && consumePending(msg.text, msgRoom)) {
+        return;
+    }
+    state.lastGroupKey = renderBubble(els.feed, msg);
 
     applyMessageFilter();
 
@@ -168,6 +202,20 @@ function addMessage(msg) {
     return unreadChanged;
 }
 
+function prependMessages(messages) {
+    const holder = document.createElement('div');
+    messages.forEach(msg => renderBubble(holder, msg));
+    const anchor = els.feed.querySelector('.bubble-group');
+    const previousHeight = els.feed.scrollHeight;
+    while (holder.firstChild) {
+        els.feed.insertBefore(holder.firstChild, anchor);
+    }
+    // Keep the message the user was reading in place.
+    els.feed.scrollTop += els.feed.scrollHeight - previousHeight;
+    applyMessageFilter();
+    updateEmptyState();
+}
+
 function applyMessageFilter() {
     const query = state.filterQuery.trim().toLowerCase();
     const groups = els.feed.querySelectorAll('.bubble-group');
@@ -201,6 +249,8 @@ function switchRoom(room) {
     }
     state.room = room;
     state.lastId = 0;
+    state.oldestId = 0;
+    state.hasMoreBefore = false;
     state.lastGroupKey = null;
     if (room === 'all') {
         clearUnread('all');
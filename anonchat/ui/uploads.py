@@ -0,0 +1,320 @@
+import hashlib
+import os
+import secrets
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+
+from werkzeug.utils import secure_filename
+
+DEBUG = os.getenv("ANONCHAT_DEBUG") == "1"
+
+
+class _Upload:
+    def __init__(self, upload_id: str, name: str, room: str, mime: str, size: int, chunk_size: int, path: Path):
+        self.id = upload_id
+        self.name = name
+        self.room = room
+        self.mime = mime
+        self.size = size
+        self.chunk_size = chunk_size
+        self.path = path
+        self.expected_sha256: Optional[str] = None
+        self.lock = threading.Lock()
+        self.received: Set[int] = set()
+        self.in_flight: Set[int] = set()
+        # SHA-256 of bytes [0, hashed); advanced as contiguous chunks land.
+        self.hasher = hashlib.sha256()
+        self.hashed = 0
+        # Set while one thread reads back chunks that landed ahead of the
+        # frontier; hash_done is signalled when it stops.
+        self.hashing = False
+        self.hash_done = threading.Condition(self.lock)
+        # Set once finish() or a discard has claimed the upload.
+        self.closed = False
+        self.touched = time.monotonic()
+
+    @property
+    def chunks(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    def missing(self) -> List[int]:
+        return [index for index in range(self.chunks) if index not in self.received]
+
+    def status(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "received": len(self.received),
+            "missing": self.missing(),
+        }
+
+
+class UploadManager:
+    """
+    Chunked, resumable uploads into SHARE_DIR/<room>.
+
+    init() reserves a hidden temp file (.<id>.part) in the room directory;
+    chunks are PUT at chunk-aligned offsets in any order and streamed to
+    disk a block at a time, so memory stays flat whatever the file size.
+    A chunk that arrives at the hash frontier is hashed while it streams;
+    ones that arrive early are read back once the gap before them fills.
+    finish() checks every chunk is in and renames the file into place.
+
+    A dropped connection loses at most the chunks in flight: status()
+    lists what is missing and the client sends only those. Sessions live
+    in memory and expire after IDLE_SECONDS without a chunk.
+
+    Methods return (http_status, response) like RoomManager.
+    """
+
+    READ_BLOCK = 256 * 1024
+    IDLE_SECONDS = 3600.0
+    MAX_ACTIVE = 32
+
+    def __init__(self, share_dir: Path, max_bytes: int, chunk_size: int):
+        self.share_dir = Path(share_dir)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._uploads: Dict[str, _Upload] = {}
+        self.completed = 0
+        self.bytes_received = 0
+        self.bytes_reread = 0
+        # Sessions do not survive a restart; neither should their files.
+        for path in self.share_dir.glob("*/.*.part"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def init(self, name: str, size: int, room: str, mime: str, sha256: Optional[str] = None) -> Tuple[int, Dict]:
+        safe_name = secure_filename(name)
+        if not safe_name:
+            return 400, {"error": "Invalid filename"}
+        if size < 0:
+            return 400, {"error": "Invalid size"}
+        if size > self.max_bytes:
+            return 413, {"error": f"File too large (max {self.max_bytes // (1024 * 1024)} MB)"}
+        safe_room = (secure_filename(room) or "all")[:64]
+        room_dir = self.share_dir / safe_room
+        room_dir.mkdir(parents=True, exist_ok=True)
+        if shutil.disk_usage(room_dir).free < size:
+            return 507, {"error": "Not enough disk space"}
+
+        self._expire_idle()
+        with self._lock:
+            if len(self._uploads) >= self.MAX_ACTIVE:
+                return 429, {"error": "Too many uploads in progress"}
+            upload_id = secrets.token_hex(16)
+            path = room_dir / f".{upload_id}.part"
+            upload = _Upload(upload_id, safe_name, safe_room, mime or "application/octet-stream", size, self.chunk_size, path)
+            upload.expected_sha256 = (sha256 or "").lower() or None
+            self._uploads[upload_id] = upload
+        # Sized up front (sparse) so chunks can land at any offset.
+        with open(path, "wb") as fh:
+            fh.truncate(size)
+        return 201, upload.status()
+
+    def status(self, upload_id: str) -> Tuple[int, Dict]:
+        upload = self._get(upload_id)
+        if upload is None:
+            return 404, {"error": "Unknown upload"}
+        with upload.lock:
+            return 200, upload.status()
+
+    def write_chunk(self, upload_id: str, offset: int, length: Optional[int], stream: BinaryIO) -> Tuple[int, Dict]:
+        upload = self._get(upload_id)
+        if upload is None:
+            return 404, {"error": "Unknown upload"}
+        if offset < 0 or offset % upload.chunk_size or offset >= max(upload.size, 1):
+            return 400, {"error": "Offset must be a chunk boundary inside the file"}
+        expected = min(upload.chunk_size, upload.size - offset)
+        if length is None:
+            return 411, {"error": "Content-Length required"}
+        if length != expected:
+            return 400, {"error": f"Chunk at {offset} must be {expected} bytes"}
+        index = offset // upload.chunk_size
+        with upload.lock:
+            if upload.closed:
+                return 404, {"error": "Unknown upload"}
+            if index in upload.received:
+                return 200, {"received": len(upload.received)}
+            if index in upload.in_flight:
+                return 409, {"error": "Chunk already uploading"}
+            upload.in_flight.add(index)
+            # Only this chunk can move the frontier past its offset, so a
+            # copy taken now can hash the bytes as they stream in.
+            hasher = upload.hasher.copy() if upload.hashed == offset else None
+            upload.touched = time.monotonic()
+
+        done = False
+        try:
+            written = self._receive(upload.path, offset, length, stream, hasher)
+            done = written == length
+        finally:
+            with upload.lock:
+                upload.in_flight.discard(index)
+                if done:
+                    upload.received.add(index)
+                    upload.touched = time.monotonic()
+                    if hasher is not None:
+                        upload.hasher = hasher
+                        upload.hashed = offset + length
+        if not done:
+            return 400, {"error": "Incomplete chunk"}
+        self._advance_hash(upload)
+        with self._lock:
+            self.bytes_received += length
+        return 200, {"received": len(upload.received)}
+
+    def finish(self, upload_id: str) -> Tuple[int, Dict]:
+        upload = self._get(upload_id)
+        if upload is None:
+            return 404, {"error": "Unknown upload"}
+        with upload.lock:
+            upload.hash_done.wait_for(lambda: not upload.hashing)
+            if upload.closed:
+                return 404, {"error": "Unknown upload"}
+            missing = upload.missing()
+            if missing or upload.in_flight:
+                return 409, {"error": "Upload incomplete", "missing": missing}
+            if upload.hashed < upload.size:
+                self._discard(upload)
+                return 500, {"error": "Could not read back upload"}
+            digest = upload.hasher.hexdigest()
+            if upload.expected_sha256 and digest != upload.expected_sha256:
+                self._discard(upload)
+                return 422, {"error": "Checksum mismatch", "sha256": digest}
+            # Claimed before the rename: a concurrent finish() or cancel()
+            # now gets 404 instead of racing on the file.
+            upload.closed = True
+            with self._lock:
+                self._uploads.pop(upload.id, None)
+        target_name = f"{secrets.token_hex(8)}_{upload.name}"
+        try:
+            with open(upload.path, "rb+") as fh:
+                os.fsync(fh.fileno())
+            os.replace(upload.path, upload.path.with_name(target_name))
+        except OSError as exc:
+            if DEBUG:
+                print(f"[uploads] could not store {upload.name}: {exc}")
+            self._discard(upload)
+            return 500, {"error": "Could not store upload"}
+        with self._lock:
+            self.completed += 1
+        return 200, {
+            "name": upload.name,
+            "size": upload.size,
+            "mime": upload.mime,
+            "sha256": digest,
+            "room": upload.room,
+            "file": target_name,
+        }
+
+    def cancel(self, upload_id: str) -> Tuple[int, Dict]:
+        upload = self._get(upload_id)
+        if upload is None:
+            return 404, {"error": "Unknown upload"}
+        with upload.lock:
+            if upload.closed:
+                return 404, {"error": "Unknown upload"}
+            self._discard(upload)
+        return 200, {"ok": True}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "active": len(self._uploads),
+                "completed": self.completed,
+                "bytes_received": self.bytes_received,
+                "bytes_reread": self.bytes_reread,
+                "max_bytes": self.max_bytes,
+                "chunk_size": self.chunk_size,
+            }
+
+    # ---------------- internal ----------------
+
+    def _get(self, upload_id: str) -> Optional[_Upload]:
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+    def _receive(self, path: Path, offset: int, length: int, stream: BinaryIO, hasher) -> int:
+        written = 0
+        with open(path, "rb+") as fh:
+            fh.seek(offset)
+            while written < length:
+                block = stream.read(min(self.READ_BLOCK, length - written))
+                if not block:
+                    break
+                fh.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+                written += len(block)
+        return written
+
+    def _advance_hash(self, upload: _Upload):
+        # Chunks that arrived ahead of the frontier are read back from disk
+        # (usually still in page cache) without holding upload.lock, so
+        # other chunks and status() are not held up. One thread per upload
+        # does this; it checks for more work and gives up the role under
+        # the same lock hold, so a chunk landing meanwhile is never missed.
+        with upload.lock:
+            if upload.hashing:
+                return
+            upload.hashing = True
+        while True:
+            with upload.lock:
+                start = upload.hashed
+                if upload.closed or start >= upload.size or start // upload.chunk_size not in upload.received:
+                    upload.hashing = False
+                    upload.hash_done.notify_all()
+                    return
+                hasher = upload.hasher.copy()
+            end = min(upload.size, start + upload.chunk_size)
+            position = start
+            try:
+                with open(upload.path, "rb") as fh:
+                    fh.seek(start)
+                    while position < end:
+                        block = fh.read(min(self.READ_BLOCK, end - position))
+                        if not block:
+                            break
+                        hasher.update(block)
+                        position += len(block)
+            except OSError:
+                pass
+            with self._lock:
+                self.bytes_reread += position - start
+            with upload.lock:
+                if position < end or upload.hashed != start:
+                    # Cancelled or truncated under us; finish() reports it.
+                    upload.hashing = False
+                    upload.hash_done.notify_all()
+                    return
+                upload.hasher = hasher
+                upload.hashed = end
+
+    def _discard(self, upload: _Upload):
+        # Caller holds upload.lock.
+        upload.closed = True
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+        try:
+            upload.path.unlink()
+        except OSError:
+            pass
+
+    def _expire_idle(self):
+        cutoff = time.monotonic() - self.IDLE_SECONDS
+        with self._lock:
+            idle = [upload for upload in self._uploads.values() if upload.touched < cutoff and not upload.in_flight]
+        for upload in idle:
+            if DEBUG:
+                print(f"[uploads] expiring idle upload {upload.id} ({upload.name})")
+            with upload.lock:
+                self._discard(upload)
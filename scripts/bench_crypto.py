@@ -0,0 +1,69 @@
+"""
+Microbenchmark for CryptoBox encrypt/decrypt throughput.
+
+Compares the previous per-message path (new ChaCha20Poly1305 object plus
+os.urandom nonce for every message) with the cached-context, counter-nonce
+path CryptoBox uses now.
+
+    python scripts/bench_crypto.py [--messages N] [--size BYTES]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305  # noqa: E402
+
+from anonchat.core.crypto import CryptoBox, _b64d, _b64e  # noqa: E402
+
+
+def legacy_encrypt(key: bytes, plaintext: str) -> str:
+    nonce = os.urandom(12)
+    ct = ChaCha20Poly1305(key).encrypt(nonce, plaintext.encode(), None)
+    return f"{_b64e(nonce)}.{_b64e(ct)}"
+
+
+def legacy_decrypt(key: bytes, blob: str) -> str:
+    nonce_b64, ct_b64 = blob.split(".", 1)
+    return ChaCha20Poly1305(key).decrypt(_b64d(nonce_b64), _b64d(ct_b64), None).decode()
+
+
+def rate(count: int, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--size", type=int, default=200)
+    args = parser.parse_args()
+
+    alice, bob = CryptoBox(), CryptoBox()
+    alice.register_peer("bob", bob.public_key_b64)
+    bob.register_peer("alice", alice.public_key_b64)
+    key = alice._shared_keys["bob"]
+    text = "x" * args.size
+    n = args.messages
+
+    legacy_blobs = []
+    legacy_enc = rate(n, lambda: legacy_blobs.extend(legacy_encrypt(key, text) for _ in range(n)))
+    legacy_dec = rate(n, lambda: [legacy_decrypt(key, blob) for blob in legacy_blobs])
+
+    blobs = []
+    new_enc = rate(n, lambda: blobs.extend(alice.encrypt("bob", text) for _ in range(n)))
+    new_dec = rate(n, lambda: [bob.decrypt("alice", blob) for blob in blobs])
+
+    print(f"{n} messages of {args.size} bytes")
+    print(f"{'':10}{'before':>14}{'after':>14}{'speedup':>10}")
+    print(f"{'encrypt':10}{legacy_enc:>12,.0f}/s{new_enc:>12,.0f}/s{new_enc / legacy_enc:>9.2f}x")
+    print(f"{'decrypt':10}{legacy_dec:>12,.0f}/s{new_dec:>12,.0f}/s{new_dec / legacy_dec:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark a retention run on a large message history.
+
+Seeds a database with N messages spread over the last --days days, then
+opens it with MessageStore and a retention policy that expires about half
+of them (archived first with --archive). While the background pruner
+works, one thread keeps storing messages and others page through recent
+history. Reports how long pruning took, store lock holds, reader latency,
+the database/WAL/archive sizes, and the cost of paging back into the
+archive. Messages stored while the prune runs must all survive it; a
+tiny --keep-days (e.g. 0.0001) expires the whole seeded history, the
+case where a prune could sweep up rows committed after it started.
+
+    python scripts/bench_retention.py [--rows 1000000] [--archive] [--search off]
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.ui.message_store import MessageStore  # noqa: E402
+from anonchat.ui.models import RetentionPolicy  # noqa: E402
+
+ROOMS = [f"room_{i:08x}" for i in range(32)]
+
+
+def seed(path: Path, rows: int, days: float):
+    conn = sqlite3.connect(str(path))
+    # As created by MessageStore, so incremental vacuum is available.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            direction TEXT NOT NULL,
+            room TEXT NOT NULL,
+            peer_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            ts REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX idx_messages_room_id ON messages (room, id)")
+    start = time.time() - days * 86400
+    step = days * 86400 / rows
+    conn.executemany(
+        "INSERT INTO messages (direction, room, peer_id, text, ts) VALUES ('in', ?, 'anon-seed', ?, ?)",
+        (
+            (ROOMS[i % len(ROOMS)], f"seeded message {i} " + "lorem ipsum " * random.randint(1, 8), start + i * step)
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def size_mb(path: Path) -> float:
+    return path.stat().st_size / 1e6 if path.exists() else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=float, default=60.0)
+    parser.add_argument("--keep-days", type=float, default=30.0)
+    parser.add_argument("--archive", action="store_true")
+    parser.add_argument("--search", default="backfill", help="search mode (indexing competes with pruning)")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--write-rate", type=float, default=200.0, help="messages per second")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="anonchat-retention-", ignore_cleanup_errors=True) as data_dir:
+        bench(args, Path(data_dir) / "messages.db")
+
+
+def bench(args, path: Path):
+    start = time.perf_counter()
+    seed(path, args.rows, args.days)
+    print(f"seeded {args.rows} messages over {args.days:.0f} days in {time.perf_counter() - start:.1f}s")
+    print(f"database {size_mb(path):.1f} MB")
+
+    store = MessageStore(
+        db_path=path,
+        retention=RetentionPolicy(max_age=args.keep_days * 86400),
+        archive=args.archive,
+        search=args.search,
+    )
+    stop = threading.Event()
+    latencies = []
+    wal_peak = [0.0]
+    live = []
+
+    def writer():
+        interval = 1.0 / args.write_rate
+        while not stop.is_set():
+            live.append(store.store("in", random.choice(ROOMS), "anon-writer", "live message").id)
+            time.sleep(interval)
+
+    def reader():
+        samples = []
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            store.messages_page(random.choice(ROOMS), before_id=random.randint(args.rows // 2, args.rows), limit=50)
+            samples.append(time.perf_counter() - t0)
+            wal_peak[0] = max(wal_peak[0], size_mb(path.with_name(path.name + "-wal")))
+        latencies.extend(samples)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    # The pruner starts with the store; wait for its first run to finish.
+    while store.retention_stats()["runs"] < 1:
+        time.sleep(0.05)
+    took = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    store.flush()
+
+    conn = sqlite3.connect(str(path))
+    kept = {row[0] for row in conn.execute("SELECT id FROM messages WHERE peer_id = 'anon-writer'")}
+    conn.close()
+    lost = [msg_id for msg_id in live if msg_id not in kept]
+    assert not lost, f"{len(lost)} of {len(live)} messages stored during the prune were pruned"
+    print(f"{len(live)} messages stored during the prune all kept")
+
+    retention = store.retention_stats()
+    lock = store.lock_stats()["store"]
+    latencies.sort()
+    print(f"pruned {retention['pruned']} messages in {took:.1f}s ({retention['pruned'] / took:.0f}/s)")
+    print(
+        f"store lock: hold avg {lock['hold_ms_avg']:.2f}ms max {lock['hold_ms_max']:.1f}ms, "
+        f"wait max {lock['wait_ms_max']:.1f}ms, slow holds {lock['slow_holds']}"
+    )
+    print(
+        f"readers during prune: p50 {statistics.median(latencies) * 1000:.2f}ms "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms"
+    )
+    print(
+        f"database {size_mb(path):.1f} MB, WAL peak {wal_peak[0]:.1f} MB, "
+        f"now {size_mb(path.with_name(path.name + '-wal')):.1f} MB ({retention['auto_vacuum']} vacuum)"
+    )
+    if args.archive:
+        archive = retention["archive"]
+        print(f"archive: {archive['messages']} messages in {archive['segments']} segments, {archive['bytes'] / 1e6:.1f} MB")
+        samples = []
+        for _ in range(50):
+            before = random.randint(1, args.rows // 2)
+            t0 = time.perf_counter()
+            page, _ = store.messages_page(random.choice(ROOMS), before_id=before, limit=50)
+            samples.append(time.perf_counter() - t0)
+            assert page and page[-1].id < before
+        samples.sort()
+        print(f"archived page: p50 {statistics.median(samples) * 1000:.2f}ms p95 {samples[47] * 1000:.2f}ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
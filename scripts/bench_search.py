@@ -0,0 +1,131 @@
+"""
+Benchmark full-text search on a large message history.
+
+Seeds a database with N synthetic messages (Zipf-distributed vocabulary,
+many rooms) without an index, opens it with MessageStore so the FTS5
+index is backfilled in the background, then times a mix of queries:
+rare and common words, multi-word, prefix, per-room, ranked and recent.
+
+    python scripts/bench_search.py [--rows 1000000] [--reps 50]
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.ui.message_store import MessageStore  # noqa: E402
+
+VOCABULARY = 20_000
+ROOMS = [f"room_{i:08x}" for i in range(64)] + [f"anon-{i:08x}" for i in range(64)]
+
+
+def word(rank: int) -> str:
+    # Deterministic pseudo-words: w<rank> would tokenize fine, but mixing
+    # letters keeps prefix queries meaningful.
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    out = []
+    rank += 1
+    while rank:
+        rank, digit = divmod(rank, 26)
+        out.append(letters[digit])
+    return "".join(out) + "o"
+
+
+def seed(path: Path, rows: int, rng: random.Random):
+    weights = [1.0 / (rank + 1) for rank in range(VOCABULARY)]
+    words = [word(rank) for rank in range(VOCABULARY)]
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            direction TEXT NOT NULL,
+            room TEXT NOT NULL,
+            peer_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            ts REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX idx_messages_room_id ON messages (room, id)")
+    now = time.time()
+    batch = 50_000
+    for start in range(0, rows, batch):
+        count = min(batch, rows - start)
+        texts = rng.choices(words, weights, k=count * 12)
+        conn.executemany(
+            "INSERT INTO messages (direction, room, peer_id, text, ts) VALUES ('in', ?, 'anon-seed', ?, ?)",
+            (
+                (rng.choice(ROOMS), " ".join(texts[i * 12: i * 12 + rng.randint(4, 12)]), now)
+                for i in range(count)
+            ),
+        )
+        conn.commit()
+    conn.close()
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--reps", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="anonchat-search-", ignore_cleanup_errors=True) as data_dir:
+        bench(args, Path(data_dir) / "messages.db")
+
+
+def bench(args, path: Path):
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    words = seed(path, args.rows, rng)
+    print(f"seeded {args.rows} messages in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    store = MessageStore(db_path=path, search="backfill")
+    while store.search_stats()["indexed_from"] > 0:
+        time.sleep(0.1)
+    took = time.perf_counter() - start
+    print(f"backfilled index in {took:.1f}s ({args.rows / took:.0f} rows/s, writer stays available)")
+
+    room = ROOMS[3]
+    cases = [
+        ("rare word", lambda: (rng.choice(words[15000:]), None, "rank")),
+        ("mid word", lambda: (rng.choice(words[500:2000]), None, "rank")),
+        ("common word", lambda: (rng.choice(words[:20]), None, "rank")),
+        ("common, recent", lambda: (rng.choice(words[:20]), None, "recent")),
+        ("two words", lambda: (f"{rng.choice(words[100:1000])} {rng.choice(words[100:1000])}", None, "rank")),
+        ("prefix", lambda: (rng.choice(words[1000:5000])[:3] + "*", None, "rank")),
+        ("mid word, one room", lambda: (rng.choice(words[500:2000]), room, "rank")),
+        ("common, one room", lambda: (rng.choice(words[:20]), room, "recent")),
+    ]
+    print(f"{'query':22}{'p50':>10}{'p95':>10}{'hits':>8}")
+    for label, make in cases:
+        samples = []
+        hits = 0
+        for _ in range(args.reps):
+            query, in_room, order = make()
+            t0 = time.perf_counter()
+            results = store.search(query, room=in_room, limit=20, order=order)
+            samples.append(time.perf_counter() - t0)
+            hits += len(results)
+        samples.sort()
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(
+            f"{label:22}{statistics.median(samples) * 1000:>8.2f}ms{p95 * 1000:>8.2f}ms"
+            f"{hits / args.reps:>8.1f}"
+        )
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
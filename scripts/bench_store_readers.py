@@ -0,0 +1,149 @@
+"""
+Benchmark concurrent /api/state readers against a steady write load,
+with reads on the writer connection (ANONCHAT_DB_READERS=0) and on the
+read-only connection pool.
+
+Each run seeds a fresh database, starts one writer storing messages at a
+fixed rate, then points N reader threads at /api/state through Flask's
+test client. Half of the readers page through old history (`before=`,
+which misses the recent-message cache and hits SQLite), half poll the
+newest page.
+
+    python scripts/bench_store_readers.py [--readers N] [--rows N] [--seconds S]
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.config.settings import Settings  # noqa: E402
+from anonchat.core.identity import Identity  # noqa: E402
+from anonchat.ui.message_store import DURABILITY_MODES  # noqa: E402
+from anonchat.ui.server import UIServer  # noqa: E402
+
+ROOMS = [f"room_{i:02d}" for i in range(16)]
+
+
+def seed(path: Path, rows: int):
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            direction TEXT NOT NULL,
+            room TEXT NOT NULL,
+            peer_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            ts REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX idx_messages_room_id ON messages (room, id)")
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO messages (direction, room, peer_id, text, ts) VALUES (?, ?, ?, ?, ?)",
+        (("in", ROOMS[i % len(ROOMS)], "anon-seed", f"seed message {i} " * 4, now) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(pool: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="anonchat-bench-", ignore_cleanup_errors=True) as data_dir:
+        db_path = Path(data_dir) / "messages.db"
+        seed(db_path, args.rows)
+        settings = Settings(db_readers=pool, db_durability=args.durability)
+        ui = UIServer(chat=None, discovery=None, identity=Identity(nickname="bench"), settings=settings, db_path=db_path)
+        try:
+            return measure(ui, args)
+        finally:
+            ui.close()
+
+
+def measure(ui: UIServer, args) -> dict:
+
+    stop = threading.Event()
+    latencies = [[] for _ in range(args.readers)]
+    writes = [0]
+
+    def writer():
+        interval = 1.0 / args.write_rate
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            ui.messages.store("in", random.choice(ROOMS), "anon-writer", "live message")
+            writes[0] += 1
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def reader(index: int):
+        client = ui.app.test_client()
+        history = index % 2 == 0
+        samples = latencies[index]
+        while not stop.is_set():
+            room = random.choice(ROOMS)
+            if history:
+                url = f"/api/state?room={room}&before={random.randint(1, args.rows)}"
+            else:
+                url = f"/api/state?room={room}"
+            start = time.perf_counter()
+            res = client.get(url)
+            samples.append(time.perf_counter() - start)
+            if res.status_code != 200:
+                raise RuntimeError(f"{url} returned {res.status_code}")
+
+    threads = [threading.Thread(target=writer, daemon=True)]
+    threads += [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    samples = sorted(sample for per_reader in latencies for sample in per_reader)
+    locks = ui.lock_stats()["store"]
+    return {
+        "reads/s": len(samples) / args.seconds,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": samples[int(len(samples) * 0.99)] * 1000,
+        "writes/s": writes[0] / args.seconds,
+        "store_lock_wait_ms": locks["wait_ms_total"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-rate", type=float, default=200.0, help="messages per second")
+    parser.add_argument("--durability", default="normal", choices=DURABILITY_MODES)
+    parser.add_argument("--pool", type=int, default=4)
+    args = parser.parse_args()
+
+    print(
+        f"{args.readers} readers, {args.rows} seeded rows, {args.write_rate:.0f} writes/s, "
+        f"durability={args.durability}"
+    )
+    print(f"{'reads on':18}{'reads/s':>10}{'p50':>10}{'p99':>10}{'writes/s':>10}{'lock wait':>12}")
+    for label, pool in (("writer connection", 0), (f"pool of {args.pool}", args.pool)):
+        result = run(pool, args)
+        print(
+            f"{label:18}{result['reads/s']:>10.0f}{result['p50_ms']:>8.2f}ms{result['p99_ms']:>8.2f}ms"
+            f"{result['writes/s']:>10.0f}{result['store_lock_wait_ms']:>10.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare batched receive (recvmsg_into into a reusable slab) with asyncio's
+datagram endpoint (one recvfrom per callback) on loopback.
+
+A sender thread blasts datagrams at a Transport as fast as it can; the
+loop drains them through recv_packet(). Reports packets received per
+second, average datagrams per readiness event, how many datagrams never
+arrived, and how many of those the kernel reported dropping
+(kernel_drops, batched mode on Linux only).
+
+    python scripts/bench_transport.py [--packets N] [--size BYTES] [--rcvbuf KB]
+"""
+
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.core.transport import Transport  # noqa: E402
+
+HOST = "127.0.0.1"
+PORT = 54601
+
+
+def blast(count: int, size: int):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = b"x" * size
+    for _ in range(count):
+        sock.sendto(payload, (HOST, PORT))
+    sock.close()
+
+
+async def run(batch_io: bool, count: int, size: int, rcvbuf: int):
+    transport = Transport(PORT, HOST, broadcast=False, rcvbuf=rcvbuf, batch_io=batch_io)
+    await transport.open()
+    received = 0
+
+    async def consume():
+        nonlocal received
+        while True:
+            await transport.recv_packet()
+            received += 1
+
+    consumer = asyncio.create_task(consume())
+    sender = threading.Thread(target=blast, args=(count, size))
+    start = time.perf_counter()
+    sender.start()
+    last, idle_since = -1, time.perf_counter()
+    while True:
+        await asyncio.sleep(0.05)
+        if received != last:
+            last, idle_since = received, time.perf_counter()
+        elif not sender.is_alive() and time.perf_counter() - idle_since > 0.3:
+            break
+    elapsed = idle_since - start
+    sender.join()
+    consumer.cancel()
+    stats = transport.stats()
+    transport.close()
+    await asyncio.sleep(0)
+    return received, elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=200_000)
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--rcvbuf", type=int, default=2048, help="SO_RCVBUF in KiB")
+    args = parser.parse_args()
+
+    print(f"{args.packets} datagrams of {args.size} bytes, SO_RCVBUF {args.rcvbuf} KiB")
+    print(f"{'mode':10}{'received':>10}{'pkts/s':>12}{'per wakeup':>12}{'lost':>9}{'kernel drops':>14}")
+    for label, batch_io in (("endpoint", False), ("batched", True)):
+        received, elapsed, stats = asyncio.run(run(batch_io, args.packets, args.size, args.rcvbuf * 1024))
+        per_wakeup = stats["rx_datagrams"] / stats["rx_batches"] if stats["rx_batches"] else 1.0
+        kernel_drops = stats["kernel_drops"] if stats["kernel_drops"] is not None else "n/a"
+        print(
+            f"{label:10}{received:>10}{received / elapsed:>12,.0f}{per_wakeup:>12.1f}"
+            f"{args.packets - received:>9}{kernel_drops!s:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the text and binary packet formats for ENC messages.
+
+Reports bytes on the wire and the receive-side cost of parse + decrypt
+for the legacy text line (split + base64) and the binary framing from
+anonchat/core/wire.py (memoryview slices, no base64).
+
+    python scripts/bench_wire.py [--messages N] [--size BYTES]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.core import wire  # noqa: E402
+from anonchat.core.crypto import CryptoBox  # noqa: E402
+
+SENDER = "anon-12345678"
+
+
+def rate(count: int, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - start)
+
+
+def parse_text(box: CryptoBox, data: bytes) -> str:
+    _, sender_id, payload = data.decode("utf-8").split(maxsplit=2)
+    return box.decrypt(sender_id, payload)
+
+
+def parse_binary(box: CryptoBox, data: bytes) -> str:
+    packet = wire.parse(data)
+    return box.decrypt_raw(packet.sender_id, packet.nonce, packet.ciphertext)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--size", type=int, default=200)
+    args = parser.parse_args()
+
+    alice, bob = CryptoBox(), CryptoBox()
+    alice.register_peer("bob", bob.public_key_b64)
+    bob.register_peer(SENDER, alice.public_key_b64)
+    text = "x" * args.size
+    n = args.messages
+
+    text_packets = [
+        f"ENC {SENDER} {alice.encrypt('bob', text)}".encode("utf-8") for _ in range(n)
+    ]
+    binary_packets = [
+        wire.encode_enc(SENDER, *alice.encrypt_raw("bob", text)) for _ in range(n)
+    ]
+
+    text_rate = rate(n, lambda: [parse_text(bob, data) for data in text_packets])
+    binary_rate = rate(n, lambda: [parse_binary(bob, data) for data in binary_packets])
+
+    text_len = len(text_packets[0])
+    binary_len = len(binary_packets[0])
+    print(f"{n} messages of {args.size} bytes")
+    print(f"{'':16}{'text':>12}{'binary':>12}")
+    print(f"{'bytes/packet':16}{text_len:>12}{binary_len:>12}  ({binary_len / text_len:.0%})")
+    print(f"{'parse+decrypt':16}{text_rate:>10,.0f}/s{binary_rate:>10,.0f}/s  ({binary_rate / text_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
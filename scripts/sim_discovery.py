@@ -0,0 +1,121 @@
+"""
+Simulate discovery traffic for N nodes on one broadcast domain.
+
+Runs real Discovery instances over an in-process LAN with every interval
+scaled down, once per mode, and reports datagrams per (simulated) second,
+whether every node sees every other node, and how many peers were
+wrongly expired.
+
+    python scripts/sim_discovery.py [--nodes N] [--seconds S] [--scale F]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.core.discovery import Discovery  # noqa: E402
+from anonchat.core.identity import Identity  # noqa: E402
+
+BROADCAST = "10.0.255.255"
+PORT = 54545
+
+
+class Lan:
+    def __init__(self):
+        self.nodes = {}
+        self.datagrams = 0
+        self.deliveries = 0
+
+
+class LanTransport:
+    """
+    Just enough of Transport for Discovery: send() and recv_packet().
+    """
+
+    def __init__(self, lan: Lan, ip: str):
+        self.lan = lan
+        self.ip = ip
+        self.loop = asyncio.get_running_loop()
+        self.inbox = asyncio.Queue()
+        lan.nodes[ip] = self
+
+    def send(self, message: str, target_ip: str, target_port: int):
+        self.lan.datagrams += 1
+        data = message.encode("utf-8")
+        if target_ip == BROADCAST:
+            targets = [node for ip, node in self.lan.nodes.items() if ip != self.ip]
+        else:
+            targets = [self.lan.nodes[target_ip]] if target_ip in self.lan.nodes else []
+        for node in targets:
+            self.lan.deliveries += 1
+            node.inbox.put_nowait((data, self.ip, PORT))
+
+    async def recv_packet(self):
+        return await self.inbox.get()
+
+
+def scaled_discovery(scale: float):
+    attrs = {
+        name: getattr(Discovery, name) * scale
+        for name in ("GM_INTERVAL", "GM_INTERVAL_MAX", "PEER_TIMEOUT", "PEER_TIMEOUT_MAX")
+    }
+    attrs["RATE_WINDOW"] = Discovery.RATE_WINDOW * scale
+    return type("ScaledDiscovery", (Discovery,), attrs)
+
+
+async def run(mode: str, nodes: int, seconds: float, scale: float):
+    lan = Lan()
+    cls = scaled_discovery(scale)
+    expired = []
+    members = []
+    for index in range(nodes):
+        ip = f"10.0.{index // 250}.{index % 250 + 1}"
+        identity = Identity(nickname=f"node{index}")
+        discovery = cls(LanTransport(lan, ip), identity, BROADCAST, PORT, wire_format="binary", mode=mode)
+        discovery.set_expiry_handler(expired.extend)
+        members.append(discovery)
+
+    start = time.monotonic()
+    for discovery in members:
+        discovery.start()
+        # Staggered start, as on a real network.
+        await asyncio.sleep(scale * 0.05)
+    await asyncio.sleep(seconds * scale)
+    elapsed = (time.monotonic() - start) / scale
+
+    converged = all(len(d.get_peers()) == nodes - 1 for d in members)
+    intervals = sorted(d.stats()["beacon_interval"] / scale for d in members)
+    for discovery in members:
+        await discovery.stop()
+    return {
+        "datagrams/s": lan.datagrams / elapsed,
+        "deliveries/s": lan.deliveries / elapsed,
+        "converged": converged,
+        "expired": len(expired),
+        "beacon_interval": intervals[len(intervals) // 2],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=120)
+    parser.add_argument("--scale", type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(f"{args.nodes} nodes, {args.seconds:.0f}s simulated")
+    print(f"{'mode':10}{'datagrams/s':>14}{'deliveries/s':>15}{'interval':>10}{'converged':>11}{'expired':>9}")
+    for mode in ("classic", "adaptive"):
+        result = asyncio.run(run(mode, args.nodes, args.seconds, args.scale))
+        print(
+            f"{mode:10}{result['datagrams/s']:>14,.1f}{result['deliveries/s']:>15,.1f}"
+            f"{result['beacon_interval']:>9.0f}s{str(result['converged']):>11}{result['expired']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Measure room-join latency under packet loss, with and without the
+reliable delivery layer.
+
+Two real stacks (Transport, Discovery, Chat, Outbox, RoomManager) run on
+loopback, finding each other over a multicast group. Their transports
+drop a fraction of inbound datagrams. For each trial the owner creates a
+room, the joiner sends room_join, and we time until the joiner holds
+room_join_ack. Without reliability a lost join or ack is only noticed
+when the pending join goes stale (8s) and the user retries.
+
+    python scripts/sim_reliability.py [--loss 0,0.1,0.2,0.3] [--trials N]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.core.discovery import Discovery  # noqa: E402
+from anonchat.core.event_loop import NetworkLoop  # noqa: E402
+from anonchat.core.identity import Identity  # noqa: E402
+from anonchat.core.room_chat import ROOM_CTL_PREFIX, RoomManager  # noqa: E402
+from anonchat.core.transport import Transport  # noqa: E402
+from anonchat.messaging import reliability  # noqa: E402
+from anonchat.messaging.chat import Chat  # noqa: E402
+from anonchat.messaging.outbox import Outbox  # noqa: E402
+
+GROUP = "239.255.77.77"
+PORT = 54611
+TRIAL_TIMEOUT = 60.0
+
+
+class LossyTransport(Transport):
+    """
+    Transport that drops each inbound datagram with probability `loss`.
+    """
+
+    loss = 0.0
+    lost = 0
+
+    def _on_datagram(self, data, addr):
+        if self.loss and random.random() < self.loss:
+            self.lost += 1
+            return
+        super()._on_datagram(data, addr)
+
+
+class Node:
+    def __init__(self, net: NetworkLoop, ip: str, reliable: bool):
+        self.identity = Identity(nickname=ip)
+        self.id = self.identity.anon_id
+        self.transport = LossyTransport(PORT, ip, broadcast=False, multicast_group=GROUP)
+        self.discovery = Discovery(self.transport, self.identity, GROUP, PORT)
+        self.chat = Chat(self.transport, self.discovery, self.identity, PORT, reliable=reliable)
+        self.outbox = Outbox(self.chat)
+        self.outbox.start()
+        self.rooms = RoomManager(
+            lock=None,
+            identity=self.identity,
+            chat=self.chat,
+            store_message=lambda *args: None,
+            outbox=self.outbox,
+        )
+        self.net = net
+        net.run(self._start())
+
+    async def _start(self):
+        await self.transport.open()
+        self.discovery.start()
+        self.chat.start(self._on_message)
+
+    def _on_message(self, sender_id: str, message: str):
+        if message.startswith(ROOM_CTL_PREFIX):
+            self.rooms.handle_room_control(sender_id, message[len(ROOM_CTL_PREFIX):])
+
+    def close(self):
+        self.outbox.close()
+        self.net.run(self.chat.stop())
+        self.net.run(self.discovery.stop())
+        self.transport.close()
+
+
+def wait_for(condition, timeout: float, interval: float = 0.002) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+def join_once(owner: Node, joiner: Node, loss: float) -> float:
+    for node in (owner, joiner):
+        node.transport.loss = 0.0
+    room = owner.rooms.create_room(f"r{random.random():.6f}", "", True, 0)
+    if not wait_for(lambda: joiner.rooms.get_room(room.id) is not None, 5):
+        raise RuntimeError("room announcement never arrived")
+
+    for node in (owner, joiner):
+        node.transport.loss = loss
+    start = time.monotonic()
+    joiner.rooms.join_room(room.id, "")
+    while time.monotonic() - start < TRIAL_TIMEOUT:
+        current = joiner.rooms.get_room(room.id)
+        if current.joined:
+            return time.monotonic() - start
+        # What the UI does: stale joins are reset after 8s, then the user
+        # presses join again.
+        joiner.rooms.expire_pending()
+        if not current.pending:
+            joiner.rooms.join_room(room.id, "")
+        time.sleep(0.002)
+    return float("inf")
+
+
+def run(net: NetworkLoop, reliable: bool, losses, trials: int, base: int):
+    owner = Node(net, f"127.0.0.{base}", reliable)
+    joiner = Node(net, f"127.0.0.{base + 1}", reliable)
+    try:
+        ready = wait_for(
+            lambda: joiner.discovery.get_peer(owner.id) and owner.discovery.get_peer(joiner.id),
+            10,
+        )
+        if not ready:
+            raise RuntimeError("nodes did not discover each other")
+        if reliable and not wait_for(
+            lambda: joiner.chat.reliable_for(owner.id) and owner.chat.reliable_for(joiner.id), 10
+        ):
+            raise RuntimeError("rel1 capability not exchanged")
+        results = {}
+        for loss in losses:
+            results[loss] = [join_once(owner, joiner, loss) for _ in range(trials)]
+        stats = joiner.chat.stats()["reliability"] if reliable else None
+        return results, stats
+    finally:
+        owner.close()
+        joiner.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loss", default="0,0.1,0.2,0.3")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    losses = [float(value) for value in args.loss.split(",")]
+
+    net = NetworkLoop()
+    net.start()
+    print(f"room join latency, {args.trials} trials per loss rate (loss applies to each direction)")
+    print(f"{'mode':12}{'loss':>6}{'median':>10}{'p90':>10}{'max':>10}")
+    for label, reliable, base in (("best-effort", False, 20), ("reliable", True, 30)):
+        results, stats = run(net, reliable, losses, args.trials, base)
+        for loss, samples in results.items():
+            samples.sort()
+            p90 = samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+            print(
+                f"{label:12}{loss:>6.0%}{statistics.median(samples) * 1000:>8.1f}ms"
+                f"{p90 * 1000:>8.1f}ms{samples[-1] * 1000:>8.1f}ms"
+            )
+        if stats:
+            print(f"  {reliability.CAPABILITY}: {stats}")
+    net.stop()
+
+
+if __name__ == "__main__":
+    main()
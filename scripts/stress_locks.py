@@ -0,0 +1,156 @@
+"""
+Concurrency stress test for the UI server's locks.
+
+Runs a real UIServer (no network stack) against a temporary database and
+hammers it from many threads at once: message writes, inbound room
+messages, owner-side joins/leaves from simulated peers, /api/state and
+/api/metrics requests, event-log readers and interface swaps. Every
+thread must finish before the deadline; otherwise all thread stacks are
+dumped and the script exits 1 (a deadlock or a stuck lock).
+
+    python scripts/stress_locks.py [--seconds S] [--readers N] [--writers N]
+"""
+
+import argparse
+import faulthandler
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from anonchat.core.identity import Identity  # noqa: E402
+from anonchat.core.room_chat import ROOM_MSG_PREFIX  # noqa: E402
+from anonchat.ui.server import UIServer  # noqa: E402
+
+
+class Worker(threading.Thread):
+    def __init__(self, name: str, step, stop: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.step = step
+        self.stop = stop
+        self.ops = 0
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                self.step()
+                self.ops += 1
+        except Exception as exc:  # reported by main()
+            self.error = exc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--peers", type=int, default=50)
+    parser.add_argument("--deadline", type=float, default=10.0, help="seconds allowed for threads to stop")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="anonchat-stress-", ignore_cleanup_errors=True) as data_dir:
+        code = stress(args, Path(data_dir) / "messages.db")
+    sys.exit(code)
+
+
+def stress(args, db_path: Path) -> int:
+    identity = Identity(nickname="stress")
+    ui = UIServer(chat=None, discovery=None, identity=identity, db_path=db_path)
+    rooms = [ui.rooms.create_room(f"room{i}", "", True, 0) for i in range(4)]
+    peers = [f"anon-{i:08x}" for i in range(args.peers)]
+    stop = threading.Event()
+
+    def write_message():
+        ui.messages.store("in", random.choice(peers), random.choice(peers), "x" * random.randint(1, 200))
+
+    def room_message():
+        room = random.choice(rooms)
+        ui.on_message(random.choice(peers), f"{ROOM_MSG_PREFIX}{room.id}::hello")
+
+    def membership():
+        room = random.choice(rooms)
+        peer = random.choice(peers)
+        kind = random.choice(("room_join", "room_leave"))
+        payload = {"type": kind, "room_id": room.id, "group_key": True, "member_deltas": True}
+        ui.rooms.handle_room_control(peer, json.dumps(payload))
+        if random.random() < 0.05:
+            ui.rooms.kick_member(room.id, random.choice(peers))
+
+    def make_reader():
+        client = ui.app.test_client()
+        state = {"etag": None, "events": 0, "after": 0}
+
+        def read_state():
+            headers = {"If-None-Match": state["etag"]} if state["etag"] and random.random() < 0.5 else {}
+            res = client.get(f"/api/state?after={state['after']}&events={state['events']}", headers=headers)
+            if res.status_code == 200:
+                data = res.get_json()
+                state["etag"] = res.headers.get("ETag")
+                state["events"] = data["event_cursor"]
+                if data["messages"]:
+                    state["after"] = data["messages"][-1]["id"]
+            elif res.status_code != 304:
+                raise RuntimeError(f"/api/state returned {res.status_code}")
+
+        return read_state
+
+    def metrics():
+        ui.app.test_client().get("/api/metrics")
+        ui.rooms.room_events_since(0)
+        time.sleep(0.001)
+
+    def swap_interface():
+        ui.attach(None, None)
+        ui.set_current_ip("127.0.0.1")
+        time.sleep(0.01)
+
+    workers = []
+    for i in range(args.writers):
+        workers.append(Worker(f"writer-{i}", write_message, stop))
+        workers.append(Worker(f"room-msg-{i}", room_message, stop))
+        workers.append(Worker(f"membership-{i}", membership, stop))
+    for i in range(args.readers):
+        workers.append(Worker(f"reader-{i}", make_reader(), stop))
+    workers.append(Worker("metrics", metrics, stop))
+    workers.append(Worker("attach", swap_interface, stop))
+
+    for worker in workers:
+        worker.start()
+    time.sleep(args.seconds)
+    stop.set()
+
+    deadline = time.monotonic() + args.deadline
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.monotonic()))
+    stuck = [worker.name for worker in workers if worker.is_alive()]
+    if stuck:
+        print(f"DEADLOCK: {len(stuck)} threads did not stop: {', '.join(stuck)}")
+        faulthandler.dump_traceback(all_threads=True)
+        return 1
+    errors = [(worker.name, worker.error) for worker in workers if worker.error]
+    for name, error in errors:
+        print(f"{name}: {error!r}")
+
+    ui.flush()
+    totals = {}
+    for worker in workers:
+        kind = worker.name.rsplit("-", 1)[0]
+        totals[kind] = totals.get(kind, 0) + worker.ops
+    print(f"{args.seconds:.0f}s, {len(workers)} threads, no deadlock")
+    for kind, ops in sorted(totals.items()):
+        print(f"  {kind:12} {ops / args.seconds:10.0f} ops/s")
+    print("locks:")
+    for name, stats in ui.lock_stats().items():
+        print(f"  {name:12} {stats}")
+    ui.close()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    main()